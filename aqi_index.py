@@ -0,0 +1,82 @@
+import numpy as np
+
+# --- 1. CPCB Breakpoint Tables ---
+
+# Pollutant order doubles as the tie-break order for the primary pollutant.
+POLLUTANTS = ['pm2_5', 'pm10', 'co', 'no2', 'o3', 'so2', 'nh3']
+
+# ((BP_LO, BP_HI), (I_LO, I_HI)) per band. Ranges are continuous so values
+# such as 30.17 never fall into a gap. CO is looked up in mg/m3.
+BREAKPOINTS = {
+    'pm2_5': [((0, 30), (0, 50)), ((30, 60), (51, 100)), ((60, 90), (101, 200)), ((90, 120), (201, 300)), ((120, 250), (301, 400)), ((250, float('inf')), (401, 500))],
+    'pm10': [((0, 50), (0, 50)), ((50, 100), (51, 100)), ((100, 250), (101, 200)), ((250, 350), (201, 300)), ((350, 430), (301, 400)), ((430, float('inf')), (401, 500))],
+    'o3': [((0, 50), (0, 50)), ((50, 100), (51, 100)), ((100, 168), (101, 200)), ((168, 208), (201, 300)), ((208, 748), (301, 400)), ((748, float('inf')), (401, 500))],
+    'co': [((0.0, 1.0), (0, 50)), ((1.0, 2.0), (51, 100)), ((2.0, 10.0), (101, 200)), ((10.0, 17.0), (201, 300)), ((17.0, 34.0), (301, 400)), ((34.0, float('inf')), (401, 500))],
+    'so2': [((0, 40), (0, 50)), ((40, 80), (51, 100)), ((80, 380), (101, 200)), ((380, 800), (201, 300)), ((800, 1600), (301, 400)), ((1600, float('inf')), (401, 500))],
+    'no2': [((0, 40), (0, 50)), ((40, 80), (51, 100)), ((80, 180), (101, 200)), ((180, 280), (201, 300)), ((280, 400), (301, 400)), ((400, float('inf')), (401, 500))],
+    'nh3': [((0, 200), (0, 50)), ((200, 400), (51, 100)), ((400, 800), (101, 200)), ((800, 1200), (201, 300)), ((1200, 1800), (301, 400)), ((1800, float('inf')), (401, 500))],
+}
+
+# Raw inputs arrive in ug/m3; divide by this before the table lookup.
+UNIT_DIVISORS = {'co': 1000.0}
+
+MAX_AQI = 500.0
+
+
+def _compile(bands):
+    """ Precomputes the lookup arrays for one pollutant's bands. """
+    bp_lo = np.array([b[0][0] for b in bands], dtype=float)
+    bp_hi = np.array([b[0][1] for b in bands], dtype=float)
+    i_lo = np.array([b[1][0] for b in bands], dtype=float)
+    i_hi = np.array([b[1][1] for b in bands], dtype=float)
+    # The open-ended top band has zero slope: everything above it maps to I_LO.
+    slope = np.where(np.isfinite(bp_hi), (i_hi - i_lo) / (bp_hi - bp_lo), 0.0)
+    return bp_lo, bp_hi, i_lo, slope
+
+
+COMPILED_BREAKPOINTS = {p: _compile(bands) for p, bands in BREAKPOINTS.items()}
+POLLUTANT_NAMES = np.array(POLLUTANTS)
+
+
+# --- 2. Vectorised Sub-Index Engine ---
+
+def subindex(values, pollutant):
+    """
+    Indian AQI sub-index for an array (or scalar) of raw concentrations.
+    NaN and negative readings count as 0; results are clamped to MAX_AQI.
+    """
+    bp_lo, bp_hi, i_lo, slope = COMPILED_BREAKPOINTS[pollutant]
+    x = np.asarray(values, dtype=float) / UNIT_DIVISORS.get(pollutant, 1.0)
+    x = np.where(np.isnan(x) | (x < 0), 0.0, x)
+
+    band = np.minimum(np.searchsorted(bp_hi, x, side='left'), len(bp_hi) - 1)
+    offset = np.where(slope[band] > 0, slope[band] * (x - bp_lo[band]), 0.0)
+    return np.minimum(i_lo[band] + offset, MAX_AQI)
+
+
+def compute_subindices(concentrations):
+    """
+    Sub-indices for a mapping of pollutant -> scalar/array of concentrations.
+    Returns an (n_readings, len(POLLUTANTS)) matrix; missing pollutants score 0.
+    """
+    columns = []
+    for p in POLLUTANTS:
+        values = concentrations.get(p)
+        columns.append(np.atleast_1d(subindex(0.0 if values is None else values, p)))
+    n = max(len(c) for c in columns)
+    return np.column_stack([np.broadcast_to(c, n) for c in columns])
+
+
+def compute_aqi(concentrations):
+    """
+    Overall AQI and primary pollutant for every reading at once.
+    Returns (aqi, primary_pollutant, sub_indices) as NumPy arrays.
+    """
+    sub_indices = compute_subindices(concentrations)
+    primary = sub_indices.argmax(axis=1)
+    return sub_indices.max(axis=1), POLLUTANT_NAMES[primary], sub_indices
+
+
+def calculate_indian_aqi_subindex(Cp, pollutant):
+    """ Scalar convenience wrapper around subindex(). """
+    return float(subindex(Cp, pollutant))
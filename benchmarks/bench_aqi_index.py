@@ -0,0 +1,74 @@
+"""
+Throughput benchmark for aqi_index.
+
+Times the vectorised engine against the original per-value scalar
+implementation. check_parity(), which compares the two on random and
+edge-case concentrations, is run by tests/test_aqi_index.py.
+
+    python benchmarks/bench_aqi_index.py [n_readings]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aqi_index import BREAKPOINTS, POLLUTANTS, compute_aqi, subindex  # noqa: E402
+
+
+def legacy_subindex(Cp, pollutant):
+    """ The scalar implementation previously in run_forecast_all_stations.py. """
+    Cp_lookup = Cp
+    if pollutant == 'co': Cp_lookup = Cp / 1000.0
+    if pd.isna(Cp_lookup) or Cp_lookup < 0: Cp_lookup = 0
+
+    for (BP_LO, BP_HI), (I_LO, I_HI) in BREAKPOINTS.get(pollutant, []):
+        if BP_LO <= Cp_lookup <= BP_HI:
+            return ((I_HI - I_LO) / (BP_HI - BP_LO)) * (Cp_lookup - BP_LO) + I_LO
+
+    if Cp_lookup > 0: return 500
+    return 0
+
+
+def check_parity(rng, n=20000):
+    for p in POLLUTANTS:
+        scale = 60000.0 if p == 'co' else 2500.0
+        edges = [bp for (lo, hi), _ in BREAKPOINTS[p] for bp in (lo, hi) if np.isfinite(bp)]
+        if p == 'co':
+            edges = [e * 1000.0 for e in edges]
+        values = np.concatenate([
+            rng.uniform(0, scale, n),
+            np.array(edges),
+            np.array([-5.0, np.nan, 0.0]),
+        ])
+        expected = np.array([legacy_subindex(v, p) for v in values])
+        actual = subindex(values, p)
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9, err_msg=p)
+
+
+def bench(rng, n):
+    readings = {p: rng.uniform(0, 400, n) for p in POLLUTANTS}
+    readings['co'] = readings['co'] * 50
+
+    start = time.perf_counter()
+    compute_aqi(readings)
+    vectorised = time.perf_counter() - start
+
+    sample = min(n, 20000)
+    start = time.perf_counter()
+    for i in range(sample):
+        sub = {p: legacy_subindex(readings[p][i], p) for p in POLLUTANTS}
+        max(sub.values()), max(sub, key=sub.get)
+    scalar = (time.perf_counter() - start) * n / sample
+
+    print(f"readings:   {n:,}")
+    print(f"vectorised: {vectorised:.3f}s ({n / vectorised:,.0f} readings/s)")
+    print(f"scalar:     {scalar:.3f}s ({n / scalar:,.0f} readings/s, extrapolated)")
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    bench(rng, int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark: NumPy feature matrix builder vs the previous pandas builders.
+
+    python benchmarks/bench_feature_matrix.py [n_rows]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_matrix import FEATURES_LIST, build_feature_matrix  # noqa: E402
+
+
+def legacy_all_stations(current_data):
+    """ Cell-by-cell DataFrame fill previously in run_forecast_all_stations.py. """
+    feature_vector = pd.DataFrame(columns=FEATURES_LIST)
+    for col in FEATURES_LIST:
+        feature_vector.loc[0, col] = current_data.get(col, 0)
+    for col in feature_vector.columns:
+        feature_vector[col] = pd.to_numeric(feature_vector[col], errors='coerce')
+    feature_vector = feature_vector.fillna(0).astype(float)
+    return feature_vector[FEATURES_LIST]
+
+
+def legacy_openweather(current_data):
+    """ Whole-dict DataFrame previously in run_forecast_openweather.py. """
+    df = pd.DataFrame([current_data])
+    return df[FEATURES_LIST].apply(pd.to_numeric, errors="coerce").fillna(0)
+
+
+def sample_row(rng):
+    row = {name: float(rng.uniform(0, 300)) for name in FEATURES_LIST}
+    row['primary_pollutant'] = 'pm10'
+    row['datetime'] = pd.Timestamp('2025-01-01T10:00')
+    row['pollutant_details'] = {'pm10': {'value': row['pm10'], 'sub_index': 80.0}}
+    return row
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = [sample_row(rng) for _ in range(n_rows)]
+
+    new_one, matrix = timed(lambda: build_feature_matrix(rows[:1]), 2000)
+    old_one, frame = timed(lambda: legacy_all_stations(dict(rows[0])), 50)
+    ow_one, ow_frame = timed(lambda: legacy_openweather(dict(rows[0])), 200)
+    np.testing.assert_array_equal(matrix, frame.to_numpy())
+    np.testing.assert_array_equal(matrix, ow_frame.to_numpy())
+
+    new_many, _ = timed(lambda: build_feature_matrix(rows), 5)
+    sample = rows[:200]
+    old_many, _ = timed(lambda: [legacy_openweather(dict(r)) for r in sample], 1)
+    old_many *= n_rows / len(sample)
+
+    print("single row:")
+    print(f"  build_feature_matrix:        {new_one * 1e6:10.1f} us")
+    print(f"  legacy all_stations builder: {old_one * 1e6:10.1f} us ({old_one / new_one:,.0f}x slower)")
+    print(f"  legacy openweather builder:  {ow_one * 1e6:10.1f} us ({ow_one / new_one:,.0f}x slower)")
+    print(f"{n_rows:,} rows:")
+    print(f"  build_feature_matrix:        {new_many * 1e3:10.1f} ms")
+    print(f"  legacy openweather builder:  {old_many * 1e3:10.1f} ms (extrapolated, one call per row)")
@@ -0,0 +1,113 @@
+"""
+Latency/throughput benchmark for the compiled tree models.
+
+Times 1-row latency and n-row throughput of the pickled estimator's
+predict() and of CompiledEnsemble (NumPy level-synchronous walk, and
+LightGBM's booster for large batches). check_parity(), which compares both
+compiled paths against predict() on rows spread over each feature's split
+range, is run by tests/test_model_cache.py.
+
+    python benchmarks/bench_tree_inference.py [n_rows] [model.pkl]
+"""
+import os
+import statistics
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model_cache  # noqa: E402
+from model_cache import load_model  # noqa: E402
+
+# Outputs may differ only by floating-point summation order.
+TOLERANCE = 1e-9
+
+
+def sample_rows(model, rng, n):
+    """ Rows uniform over each feature's range of split thresholds, so every branch gets taken. """
+    n_features = model.meta["n_features"]
+    split = np.isfinite(model.threshold)
+    lo = np.zeros(n_features)
+    hi = np.ones(n_features)
+    for f in range(n_features):
+        thresholds = model.threshold[split & (model.feature == f)]
+        if len(thresholds):
+            margin = 0.1 * (thresholds.max() - thresholds.min()) + 1.0
+            lo[f], hi[f] = thresholds.min() - margin, thresholds.max() + margin
+    return rng.uniform(lo, hi, (n, n_features))
+
+
+def predict_numpy(model, X):
+    saved, model_cache.NATIVE_MIN_ROWS = model_cache.NATIVE_MIN_ROWS, sys.maxsize
+    try:
+        return model.predict(X)
+    finally:
+        model_cache.NATIVE_MIN_ROWS = saved
+
+
+def predict_native(model, X):
+    saved, model_cache.NATIVE_MIN_ROWS = model_cache.NATIVE_MIN_ROWS, 0
+    try:
+        return model.predict(X)
+    finally:
+        model_cache.NATIVE_MIN_ROWS = saved
+
+
+def latency(fn, repeat=300):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def check_parity(reference, model, rng, n=5000):
+    X = sample_rows(model, rng, n)
+    X[rng.random(X.shape) < 0.02] = np.nan
+    expected = reference.predict(X)
+    np.testing.assert_allclose(predict_numpy(model, X), expected, rtol=0, atol=TOLERANCE)
+    if model._native():
+        np.testing.assert_allclose(predict_native(model, X), expected, rtol=0, atol=TOLERANCE)
+
+
+def bench(reference, model, rng, n):
+    one = sample_rows(model, rng, 1)
+    paths = [
+        ("pickled predict()", reference.predict),
+        ("compiled, NumPy", lambda X: predict_numpy(model, X)),
+    ]
+    if model._native():
+        paths.append((f"compiled, native ({model_cache.NATIVE_THREADS} threads max)",
+                      lambda X: predict_native(model, X)))
+
+    print("1 row latency (median):")
+    for label, fn in paths:
+        print(f"  {label:<36} {latency(lambda: fn(one)) * 1e3:8.3f} ms")
+
+    X = sample_rows(model, rng, n)
+    print(f"{n:,} rows throughput:")
+    for label, fn in paths:
+        start = time.perf_counter()
+        fn(X)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<36} {elapsed:8.2f} s ({n / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    import joblib
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    pkl_path = sys.argv[2] if len(sys.argv) > 2 else "model_hourly.pkl"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        reference = joblib.load(pkl_path)
+        model = load_model(pkl_path)
+    if not isinstance(model, model_cache.CompiledEnsemble):
+        raise SystemExit(f"{pkl_path} could not be compiled; nothing to time")
+
+    rng = np.random.default_rng(0)
+    bench(reference, model, rng, n_rows)
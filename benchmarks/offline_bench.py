@@ -0,0 +1,272 @@
+"""
+Offline end-to-end benchmark for both forecast scripts.
+
+Starts local stand-in servers for Open-Meteo and OpenWeather that replay the
+recorded responses in benchmarks/fixtures/ with configurable latency, jitter
+and error rate, points WEATHER_API_URL / OPENWEATHER_AQI_URL at them, and
+times each script's main() in a fresh process for growing numbers of
+synthetic stations. Results (throughput, p50/p95/p99 run latency, peak RSS)
+are written as JSON so runs on different commits can be compared.
+
+    python benchmarks/offline_bench.py --stations 10 100 1000 --repeats 5
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_DIR, "benchmarks", "fixtures")
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+SCRIPTS = {
+    "openweather": "run_forecast_openweather",
+    "all_stations": "run_forecast_all_stations",
+}
+
+# Bengaluru-sized box the synthetic stations are scattered over.
+SYNTHETIC_BBOX = (12.85, 77.45, 13.10, 77.75)
+
+# Runs main() of one script against a stations file in its own process.
+DRIVER = """
+import json, sys
+sys.path.insert(0, {repo!r})
+import {module} as pipeline
+with open({stations!r}) as f:
+    pipeline.STATIONS = json.load(f)
+pipeline.main([])
+"""
+
+
+# --- 1. Stand-in Servers ---
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+def _location_factor(lat, lon):
+    """ Deterministic 0.8-1.2 factor so each location gets distinct but stable readings. """
+    return 0.8 + 0.4 * ((hash((round(lat, 4), round(lon, 4))) % 1000) / 1000)
+
+
+class StubConfig:
+    def __init__(self, latency_ms, jitter_ms, error_rate):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_stub_handler(config):
+    open_meteo = _load_fixture("open_meteo_current.json")
+    openweather = _load_fixture("openweather_air_pollution.json")
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            with config.lock:
+                config.requests += 1
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+            if random.random() < config.error_rate:
+                self._send(500, {"error": True, "reason": "injected failure"})
+                return
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path.endswith("/forecast"):
+                lats = [float(v) for v in query["latitude"][0].split(",")]
+                lons = [float(v) for v in query["longitude"][0].split(",")]
+                bodies = []
+                for lat, lon in zip(lats, lons):
+                    body = copy.deepcopy(open_meteo)
+                    body["latitude"], body["longitude"] = lat, lon
+                    body["current"]["temperature_2m"] *= _location_factor(lat, lon)
+                    bodies.append(body)
+                self._send(200, bodies if len(bodies) > 1 else bodies[0])
+            elif url.path.endswith("/air_pollution"):
+                lat, lon = float(query["lat"][0]), float(query["lon"][0])
+                body = copy.deepcopy(openweather)
+                body["coord"] = {"lat": lat, "lon": lon}
+                factor = _location_factor(lat, lon)
+                components = body["list"][0]["components"]
+                for key in components:
+                    components[key] = round(components[key] * factor, 2)
+                self._send(200, body)
+            else:
+                self._send(404, {"error": True, "reason": "not found"})
+
+    return StubHandler
+
+
+def start_stub_server(config):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- 2. Runs ---
+
+def synthetic_stations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    min_lat, min_lon, max_lat, max_lon = SYNTHETIC_BBOX
+    lats = np.round(rng.uniform(min_lat, max_lat, n), 4)
+    lons = np.round(rng.uniform(min_lon, max_lon, n), 4)
+    return {
+        f"syn_{i:05d}": {"lat": float(lat), "lon": float(lon), "name": f"Synthetic {i}"}
+        for i, (lat, lon) in enumerate(zip(lats, lons))
+    }
+
+
+def run_once(module, stations_file, env):
+    """ Runs one script in a fresh working directory; returns (seconds, peak RSS MB, exit code). """
+    workdir = tempfile.mkdtemp(prefix="aqi-bench-")
+    try:
+        for name in ("model_hourly.pkl", "model_daily.pkl"):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+        code = DRIVER.format(repo=REPO_DIR, module=module, stations=stations_file)
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KiB on Linux.
+        return elapsed, usage.ru_maxrss / 1024, proc.returncode
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(samples, n_stations, exit_codes, rss):
+    samples = np.array(samples)
+    return {
+        "stations": n_stations,
+        "runs": len(samples),
+        "failed_runs": sum(1 for code in exit_codes if code != 0),
+        "latency_s": {
+            "mean": float(samples.mean()),
+            "p50": float(np.percentile(samples, 50)),
+            "p95": float(np.percentile(samples, 95)),
+            "p99": float(np.percentile(samples, 99)),
+        },
+        "throughput_stations_per_s": float(n_stations / np.median(samples)),
+        "peak_rss_mb": float(max(rss)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# --- 3. Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the forecast scripts against local stub APIs.")
+    parser.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=list(SCRIPTS))
+    parser.add_argument("--stations", nargs="+", type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=1e6,
+                        help="Requests/sec allowed per provider (default: effectively unlimited)")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/offline-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate)
+    server = start_stub_server(config)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    tmp_dir = tempfile.mkdtemp(prefix="aqi-bench-shared-")
+    env = dict(os.environ)
+    env.update({
+        "WEATHER_API_URL": f"{base_url}/v1/forecast",
+        "OPENWEATHER_AQI_URL": f"{base_url}/data/2.5/air_pollution",
+        "OPENWEATHER_API_KEY": "offline-benchmark",
+        "OPEN_METEO_RATE_PER_SEC": str(args.rate_limit),
+        "OPENWEATHER_RATE_PER_SEC": str(args.rate_limit),
+        "OPEN_METEO_BURST": str(int(min(args.rate_limit, 1e6))),
+        "OPENWEATHER_BURST": str(int(min(args.rate_limit, 1e6))),
+        # Compiled models are shared so runs measure the warm pipeline, not compilation.
+        "MODEL_CACHE_DIR": os.path.join(tmp_dir, "models"),
+    })
+
+    results = []
+    try:
+        for script in args.scripts:
+            for n in args.stations:
+                stations_file = os.path.join(tmp_dir, f"stations-{n}.json")
+                with open(stations_file, "w") as f:
+                    json.dump(synthetic_stations(n), f)
+                run_once(SCRIPTS[script], stations_file, env)  # warm-up (compiles models once)
+
+                samples, rss, codes = [], [], []
+                requests_before = config.requests
+                for _ in range(args.repeats):
+                    elapsed, peak_rss, code = run_once(SCRIPTS[script], stations_file, env)
+                    samples.append(elapsed)
+                    rss.append(peak_rss)
+                    codes.append(code)
+                summary = summarize(samples, n, codes, rss)
+                summary["script"] = script
+                summary["upstream_requests_per_run"] = (config.requests - requests_before) / args.repeats
+                results.append(summary)
+                print(f"{script:>12} {n:>6} stations: p50 {summary['latency_s']['p50']:.2f}s  "
+                      f"p95 {summary['latency_s']['p95']:.2f}s  "
+                      f"{summary['throughput_stations_per_s']:.0f} stations/s  "
+                      f"RSS {summary['peak_rss_mb']:.0f} MB")
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at_utc": datetime.now(UTC).isoformat(),
+        "config": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "rate_limit": args.rate_limit,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"offline-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import numpy as np
+
+# --- 1. Feature Layout (Must match training) ---
+FEATURES_LIST = [
+    'co', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3',
+    'calculated_aqi', 'temperature', 'humidity', 'wind_speed',
+    'precipitation', 'pressure', 'hour', 'dayofweek', 'month',
+    'dayofyear', 'weekofyear', 'aqi_lag_24hr', 'aqi_lag_48hr',
+    'aqi_lag_168hr', 'aqi_roll_avg_24hr', 'aqi_roll_avg_168hr'
+]
+
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURES_LIST)}
+N_FEATURES = len(FEATURES_LIST)
+
+
+def _coerce(value):
+    """ Same rule as pd.to_numeric(errors='coerce').fillna(0) for a single cell. """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if np.isnan(value) else value
+
+
+# --- 2. Builder ---
+
+def build_feature_matrix(rows, out=None):
+    """
+    Writes the FEATURES_LIST columns of each row dict straight into a float64
+    (n_rows, N_FEATURES) matrix. Missing or non-numeric cells become 0.
+    Pass `out` to reuse a preallocated matrix.
+    """
+    n = len(rows)
+    if out is None:
+        out = np.empty((n, N_FEATURES), dtype=np.float64)
+    for i, row in enumerate(rows):
+        values = [row.get(name, 0) for name in FEATURES_LIST]
+        try:
+            out[i] = values
+        except (TypeError, ValueError):
+            out[i] = [_coerce(v) for v in values]
+    out[:n][np.isnan(out[:n])] = 0.0
+    return out[:n]
+
+
+def build_feature_matrix_from_columns(columns, n_rows):
+    """
+    Column-wise counterpart of build_feature_matrix for data that is already
+    columnar (a DataFrame or a dict of arrays): one vectorised copy per
+    feature instead of one per row. Same missing/non-numeric rule.
+    """
+    out = np.zeros((n_rows, N_FEATURES), dtype=np.float64)
+    for j, name in enumerate(FEATURES_LIST):
+        if name not in columns:
+            continue
+        values = columns[name]
+        try:
+            out[:, j] = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            out[:, j] = [_coerce(v) for v in values]
+    out[np.isnan(out)] = 0.0
+    return out
+
+
+# --- 3. Validation ---
+
+def validate_feature_order(model, name="model"):
+    """
+    Raises if the model was trained on a different column order than
+    FEATURES_LIST, since arrays are passed to predict() without names.
+    """
+    trained = getattr(model, "feature_names_in_", None)
+    if trained is not None and list(trained) != FEATURES_LIST:
+        raise ValueError(
+            f"{name} was trained on features {list(trained)}, expected {FEATURES_LIST}"
+        )
+    n_features = getattr(model, "n_features_in_", None)
+    if n_features is not None and n_features != N_FEATURES:
+        raise ValueError(f"{name} expects {n_features} features, expected {N_FEATURES}")
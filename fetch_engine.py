@@ -0,0 +1,368 @@
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from response_cache import CACHE
+from run_metrics import METRICS
+
+# --- 1. Configuration ---
+
+# Requests per second (and burst size) allowed against each upstream provider.
+# Open-Meteo's free tier allows ~600 calls/min, OpenWeather's ~60 calls/min.
+PROVIDER_RATE_LIMITS = {
+    "open_meteo": {
+        "rate": float(os.getenv("OPEN_METEO_RATE_PER_SEC", "5")),
+        "burst": int(os.getenv("OPEN_METEO_BURST", "10")),
+    },
+    "openweather": {
+        "rate": float(os.getenv("OPENWEATHER_RATE_PER_SEC", "1")),
+        "burst": int(os.getenv("OPENWEATHER_BURST", "10")),
+    },
+}
+
+# Upper bound on stations being fetched at the same time.
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "8"))
+
+# Keep-alive connections held per host by the shared session.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+# Conservative limit for multi-location GET URLs (servers commonly allow 8 KB).
+MAX_URL_LENGTH = int(os.getenv("MAX_URL_LENGTH", "2000"))
+
+# Run-metrics stage each provider's requests are timed under.
+PROVIDER_STAGES = {"open_meteo": "weather_fetch", "openweather": "aqi_fetch"}
+
+# Wall-clock budget for all upstream calls in one run; each request's timeout
+# is capped by what is left, so a bad network day cannot stall the run.
+FETCH_DEADLINE_SECONDS = float(os.getenv("FETCH_DEADLINE_SECONDS", "120"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "20"))
+
+# Retries for connection errors, timeouts, 429 and 5xx, with jittered
+# exponential backoff between attempts.
+MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# A duplicate request is sent if the first has not answered within this many
+# seconds; whichever finishes first wins. 0 disables hedging.
+HEDGE_AFTER_SECONDS = float(os.getenv("HEDGE_AFTER_SECONDS", "3"))
+
+# Consecutive failures after which a provider is skipped for BREAKER_COOLDOWN seconds.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+
+
+# --- 2. Rate Limiting ---
+
+class TokenBucket:
+    """ Thread-safe token bucket: `rate` tokens/sec refill, at most `burst` banked. """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait=math.inf):
+        """
+        Blocks until a token is available. Returns the seconds spent waiting,
+        or raises DeadlineExceeded if that would take longer than max_wait.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+            if waited + delay > max_wait:
+                raise DeadlineExceeded("rate limit wait would exceed the fetch deadline")
+            time.sleep(delay)
+            waited += delay
+
+
+RATE_LIMITERS = {
+    provider: TokenBucket(limits["rate"], limits["burst"])
+    for provider, limits in PROVIDER_RATE_LIMITS.items()
+}
+
+
+def acquire(provider, max_wait=math.inf):
+    """ Waits for the given provider's rate budget before issuing a request. """
+    waited = RATE_LIMITERS[provider].acquire(max_wait)
+    if waited:
+        METRICS.record(f"rate_limit_wait_{provider}", waited)
+    return waited
+
+
+# --- 3. Shared HTTP Session ---
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# One keep-alive session for the whole run, so repeated calls to the same
+# provider reuse TLS connections instead of opening a fresh one per request.
+SESSION = _build_session()
+
+
+# --- 4. Deadline, Retries, Hedging & Circuit Breakers ---
+
+class DeadlineExceeded(Exception):
+    """ The run's fetch deadline has passed; no further upstream calls are made. """
+
+
+class CircuitOpenError(Exception):
+    """ The provider's circuit breaker is open; the call fails fast. """
+
+
+class RetryableHTTPError(requests.HTTPError):
+    """ 429 or 5xx response, worth another attempt. """
+
+
+class Deadline:
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+_deadline = Deadline()
+
+
+def start_deadline(seconds=FETCH_DEADLINE_SECONDS):
+    """ Starts the fetch budget for a run (or a daemon refresh). """
+    global _deadline
+    _deadline = Deadline(seconds)
+    return _deadline
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `cooldown` seconds. After that, calls are let through again; one more
+    failure re-opens it at once, a success closes it.
+    """
+
+    def __init__(self, provider, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.provider = provider
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.allow():
+                self.open_until = time.monotonic() + self.cooldown
+                METRICS.incr(f"{self.provider}_breaker_opened")
+                print(f"Circuit open for {self.provider} after {self.failures} failures; "
+                      f"failing fast for {self.cooldown:.0f}s")
+
+
+BREAKERS = {provider: CircuitBreaker(provider) for provider in PROVIDER_RATE_LIMITS}
+
+# Extra threads for hedged duplicates, separate from fetch_all's station pool.
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=2 * FETCH_MAX_WORKERS)
+
+
+def _attempt(provider, url, params, timeout):
+    acquire(provider, max_wait=_deadline.remaining())
+    timeout = min(timeout, _deadline.remaining())
+    if timeout <= 0:
+        raise DeadlineExceeded(f"fetch deadline passed before {provider} request")
+    response = SESSION.get(url, params=params, timeout=timeout)
+    if response.status_code in RETRYABLE_STATUS:
+        raise RetryableHTTPError(f"{response.status_code} from {provider}", response=response)
+    response.raise_for_status()
+    return response.json()
+
+
+def _hedged_attempt(provider, url, params, timeout):
+    """ One attempt, plus a duplicate if the first is still running after HEDGE_AFTER_SECONDS. """
+    if HEDGE_AFTER_SECONDS <= 0 or HEDGE_AFTER_SECONDS >= timeout:
+        return _attempt(provider, url, params, timeout)
+
+    primary = _HEDGE_POOL.submit(_attempt, provider, url, params, timeout)
+    done, _ = wait([primary], timeout=HEDGE_AFTER_SECONDS)
+    if done or not BREAKERS[provider].allow():
+        return primary.result()
+
+    METRICS.incr(f"{provider}_hedged_requests")
+    backup = _HEDGE_POOL.submit(_attempt, provider, url, params, timeout - HEDGE_AFTER_SECONDS)
+    error = None
+    for future in as_completed([primary, backup]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+def request_json(provider, url, params, hedge=True):
+    """
+    GET with the run deadline, retries with backoff, optional hedging and the
+    provider's circuit breaker. Raises DeadlineExceeded or CircuitOpenError
+    without touching the network once either applies.
+    """
+    breaker = BREAKERS[provider]
+    for attempt in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit open")
+        remaining = _deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"fetch deadline passed before {provider} request")
+        timeout = min(REQUEST_TIMEOUT, remaining)
+
+        try:
+            with METRICS.span(PROVIDER_STAGES.get(provider, f"{provider}_fetch")):
+                if hedge:
+                    payload = _hedged_attempt(provider, url, params, timeout)
+                else:
+                    payload = _attempt(provider, url, params, timeout)
+        except (requests.ConnectionError, requests.Timeout, RetryableHTTPError):
+            breaker.record_failure()
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if attempt == MAX_RETRIES or delay >= _deadline.remaining():
+                raise
+            METRICS.incr(f"{provider}_retries")
+            METRICS.record(f"retry_backoff_{provider}", delay)
+            time.sleep(delay)
+            continue
+        except requests.HTTPError:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return payload
+
+
+# --- 5. Bulk Open-Meteo Requests ---
+
+def _coordinate_batches(url, coords, params):
+    """
+    Splits coords into the fewest batches whose request URL stays under
+    MAX_URL_LENGTH. Yields lists of positions into coords.
+    """
+    base_length = len(url) + 1 + len(urlencode(params)) + len("&latitude=&longitude=")
+    batch, length = [], base_length
+    for i, (lat, lon) in enumerate(coords):
+        # Each extra location adds its digits plus an encoded comma (%2C) per list.
+        extra = len(str(lat)) + len(str(lon)) + 6
+        if batch and length + extra > MAX_URL_LENGTH:
+            yield batch
+            batch, length = [], base_length
+        batch.append(i)
+        length += extra
+    if batch:
+        yield batch
+
+
+def fetch_open_meteo_bulk(url, coords, params):
+    """
+    Fetches Open-Meteo `current` data for many locations using comma-separated
+    latitude/longitude lists. Locations still fresh in the response cache are
+    not requested. Returns one `current` dict per coordinate, in order; a
+    location whose batch failed gets its last cached value, or None.
+    """
+    keys = [CACHE.make_key("open_meteo", lat, lon, params) for lat, lon in coords]
+    results = [CACHE.get("open_meteo", key) for key in keys]
+    missing = [i for i, current in enumerate(results) if current is None]
+    missing_coords = [coords[i] for i in missing]
+
+    for batch in _coordinate_batches(url, missing_coords, params):
+        targets = [missing[pos] for pos in batch]
+        query = dict(params)
+        query["latitude"] = ",".join(str(coords[i][0]) for i in targets)
+        query["longitude"] = ",".join(str(coords[i][1]) for i in targets)
+        try:
+            # Bulk calls are large, so they are retried but never hedged.
+            payload = request_json("open_meteo", url, query, hedge=False)
+            # A single location comes back as an object, several as a list.
+            if isinstance(payload, dict):
+                payload = [payload]
+            if len(payload) != len(targets):
+                raise ValueError(f"expected {len(targets)} locations, got {len(payload)}")
+            for i, item in zip(targets, payload):
+                results[i] = item.get("current")
+                CACHE.put("open_meteo", keys[i], results[i])
+        except Exception as e:
+            METRICS.incr("open_meteo_request_failures")
+            print(f"Bulk weather fetch failed for {len(targets)} locations: {type(e).__name__}")
+            for i in targets:
+                results[i] = CACHE.get_stale(keys[i])
+    return results
+
+
+def fetch_json(provider, url, params, lat, lon):
+    """
+    Single-location GET through request_json (deadline, retries, hedging,
+    circuit breaker) and the response cache. If the request still fails, or
+    the deadline or breaker rules it out, a stale cached payload is returned;
+    the error is re-raised only when there is nothing cached to fall back on.
+    """
+    key = CACHE.make_key(provider, lat, lon, params)
+    payload = CACHE.get(provider, key)
+    if payload is not None:
+        return payload
+
+    try:
+        payload = request_json(provider, url, params)
+    except Exception as e:
+        METRICS.incr(f"{provider}_request_failures")
+        payload = CACHE.get_stale(key)
+        if payload is None:
+            raise
+        print(f"Using cached {provider} data for ({lat}, {lon}) after {type(e).__name__}")
+        return payload
+
+    CACHE.put(provider, key, payload)
+    return payload
+
+
+# --- 6. Concurrent Fetching ---
+
+def fetch_all(stations, fetch_fn, max_workers=None):
+    """
+    Runs fetch_fn(station_id, station_info) for every station concurrently.
+    Returns {station_id: result} in the same order as `stations`, so callers
+    see exactly what the old sequential loop produced.
+    """
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    if not stations:
+        return {}
+
+    def timed_fetch(sid, info):
+        with METRICS.span("station_fetch", sid):
+            return fetch_fn(sid, info)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stations))) as pool:
+        futures = {sid: pool.submit(timed_fetch, sid, info) for sid, info in stations.items()}
+        return {sid: future.result() for sid, future in futures.items()}
@@ -0,0 +1,257 @@
+import argparse
+import heapq
+import importlib
+import json
+import signal
+import threading
+import time
+from datetime import datetime, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from forecast_output import degraded_record, fresh_records
+from forecast_verification import verify_forecasts
+from prediction_memo import PredictionMemo
+from response_cache import CACHE
+from run_metrics import METRICS
+from station_registry import StationIndex, plan_fetches
+from station_state import StationState
+
+# --- 1. Configuration ---
+VARIANTS = {
+    "openweather": "run_forecast_openweather",
+    "all_stations": "run_forecast_all_stations",
+}
+
+DEFAULT_INTERVAL = 60 * 60      # seconds between refreshes of a normal station
+DEFAULT_HOT_INTERVAL = 15 * 60  # seconds between refreshes of a hot station
+DEFAULT_PORT = 8765
+
+# Stations due within this many seconds of each other are refreshed together,
+# so their weather still goes out as one bulk request.
+BATCH_WINDOW = 5
+
+
+# --- 2. Daemon ---
+
+class ForecastDaemon:
+    """
+    Keeps models, HTTP sessions and station state warm in one process and
+    refreshes each station on its own staggered schedule.
+    """
+
+    def __init__(self, pipeline, interval=DEFAULT_INTERVAL, hot_stations=(), hot_interval=DEFAULT_HOT_INTERVAL):
+        self.pipeline = pipeline
+        self.models = pipeline.load_models()
+        if not self.models:
+            raise RuntimeError("Models failed to load")
+        self.state = StationState.load()
+        self.memo = PredictionMemo.load()
+        self.index = StationIndex(pipeline.STATIONS)
+        # Start from what was last published: refreshes are staggered, so the
+        # first ones would otherwise shrink all_forecasts.json and /forecasts
+        # to the few stations they covered.
+        self.forecasts = self._load_published()
+        self.last_refresh = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.intervals = {
+            sid: hot_interval if sid in hot_stations else interval
+            for sid in pipeline.STATIONS
+        }
+        self._expire_hot_pollutants(hot_stations, hot_interval)
+        # Spread first refreshes evenly across each station's interval so the
+        # upstream APIs never see every station at minute 0.
+        now = time.monotonic()
+        n = len(pipeline.STATIONS)
+        self.schedule = [
+            (now + i * self.intervals[sid] / n, sid)
+            for i, sid in enumerate(pipeline.STATIONS)
+        ]
+        heapq.heapify(self.schedule)
+
+    def _expire_hot_pollutants(self, hot_stations, hot_interval):
+        """
+        OpenWeather pollutants are cached for an hour, which would hand a hot
+        station the same payload on every refresh. Hot stations' points get
+        half their interval as max age instead, so each refresh fetches anew.
+        A cell may be requested at any of its members' coordinates, so every
+        member of a cell holding a hot station is covered.
+        """
+        for cell in plan_fetches(self.pipeline.STATIONS).values():
+            if any(sid in hot_stations for sid in cell["stations"]):
+                for sid in cell["stations"]:
+                    info = self.pipeline.STATIONS[sid]
+                    CACHE.set_max_age("openweather", info["lat"], info["lon"], hot_interval / 2)
+
+    def _load_published(self):
+        try:
+            with open(self.pipeline.FORECAST_OUTPUT_FILE) as f:
+                published = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {sid: record for sid, record in published.items() if sid in self.pipeline.STATIONS}
+
+    def _due_batch(self):
+        due_at, sid = heapq.heappop(self.schedule)
+        batch = [(due_at, sid)]
+        while self.schedule and self.schedule[0][0] - due_at <= BATCH_WINDOW:
+            batch.append(heapq.heappop(self.schedule))
+        return batch
+
+    def refresh(self, station_ids):
+        """ Fetches, predicts and publishes the given stations. """
+        stations = {sid: self.pipeline.STATIONS[sid] for sid in station_ids}
+        fetched = self.pipeline.fetch_stations(stations)
+        updated = {}
+        for sid, info in stations.items():
+            raw = fetched[sid]
+            if raw:
+                output = self.pipeline.build_station_forecast(sid, info, raw, self.models, self.state, self.memo)
+                if output is not None:
+                    updated[sid] = output
+            else:
+                updated[sid] = degraded_record(sid, info["lat"], info["lon"], "upstream data unavailable")
+
+        with self.lock:
+            self.forecasts.update(updated)
+            refreshed_at = datetime.now(UTC).isoformat()
+            for sid in updated:
+                self.last_refresh[sid] = refreshed_at
+            snapshot = dict(self.forecasts)
+
+        fresh = fresh_records(updated)
+        if hasattr(self.pipeline, "update_history"):
+            self.pipeline.update_history(fresh)
+        verify_forecasts(fresh)
+        self.state.save()
+        self.memo.save()
+        self.pipeline.write_forecasts(snapshot)
+        # Each refresh batch gets its own run-metrics file.
+        self.pipeline.write_run_metrics(len(stations), len(fresh))
+        METRICS.reset()
+        print(f"▶ Refreshed {len(fresh)}/{len(stations)} stations: {', '.join(stations)}")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            wait = self.schedule[0][0] - time.monotonic()
+            if wait > 0:
+                self.stop_event.wait(wait)
+                continue
+
+            batch = self._due_batch()
+            try:
+                self.refresh([sid for _, sid in batch])
+            except Exception as e:
+                print(f"⚠️ Refresh failed: {e}")
+            for due_at, sid in batch:
+                heapq.heappush(self.schedule, (due_at + self.intervals[sid], sid))
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+    def snapshot(self, sid=None):
+        with self.lock:
+            if sid is None:
+                return dict(self.forecasts)
+            return self.forecasts.get(sid)
+
+
+# --- 3. Local HTTP Endpoint ---
+
+def make_handler(daemon):
+    class ForecastHandler(BaseHTTPRequestHandler):
+        """
+        GET /forecasts, /forecasts/<station_id>, /nearest?lat=&lon=[&k=] and
+        /health, served from memory.
+        """
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _nearest(self, query):
+            try:
+                lat, lon = float(query["lat"][0]), float(query["lon"][0])
+                k = int(query.get("k", ["1"])[0])
+            except (KeyError, ValueError):
+                self._send(400, {"error": "lat and lon query parameters are required"})
+                return
+            self._send(200, [
+                {"station_id": sid, "name": daemon.pipeline.STATIONS[sid]["name"],
+                 "distance_km": round(km, 3), "forecast": daemon.snapshot(sid)}
+                for sid, km in daemon.index.nearest(lat, lon, k=max(1, k))
+            ])
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["forecasts"]:
+                self._send(200, daemon.snapshot())
+            elif len(parts) == 2 and parts[0] == "forecasts":
+                forecast = daemon.snapshot(parts[1])
+                if forecast is None:
+                    self._send(404, {"error": f"unknown or not yet refreshed station '{parts[1]}'"})
+                else:
+                    self._send(200, forecast)
+            elif parts == ["nearest"]:
+                self._nearest(parse_qs(url.query))
+            elif parts == ["health"]:
+                with daemon.lock:
+                    last_refresh = dict(daemon.last_refresh)
+                self._send(200, {"stations": len(daemon.intervals), "last_refresh": last_refresh})
+            else:
+                self._send(404, {"error": "not found"})
+
+    return ForecastHandler
+
+
+# --- 4. Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the forecast pipeline as a long-lived daemon.")
+    parser.add_argument("--variant", choices=VARIANTS, default="openweather",
+                        help="Which forecast script's pipeline to run")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds between refreshes of each station")
+    parser.add_argument("--hot-stations", default="",
+                        help="Comma-separated station ids refreshed every --hot-interval")
+    parser.add_argument("--hot-interval", type=float, default=DEFAULT_HOT_INTERVAL,
+                        help="Seconds between refreshes of a hot station; its OpenWeather "
+                             "pollutants are refetched each time instead of served from the hour-long cache")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    pipeline = importlib.import_module(VARIANTS[args.variant])
+    if not pipeline.OPENWEATHER_API_KEY:
+        raise RuntimeError("OPENWEATHER_API_KEY is missing")
+
+    hot = {sid for sid in args.hot_stations.split(",") if sid}
+    unknown = hot - set(pipeline.STATIONS)
+    if unknown:
+        raise ValueError(f"Unknown hot stations: {', '.join(sorted(unknown))}")
+
+    daemon = ForecastDaemon(pipeline, args.interval, hot, args.hot_interval)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    print(f"✅ Forecast daemon ({args.variant}) serving on http://{args.host}:{args.port}/forecasts")
+    try:
+        daemon.run()
+    finally:
+        server.shutdown()
+        print("Forecast daemon stopped.")
+
+
+if __name__ == "__main__":
+    main()
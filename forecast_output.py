@@ -0,0 +1,187 @@
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, UTC
+
+# --- 1. Configuration ---
+OUTPUT_DIR = os.getenv("FORECAST_OUTPUT_DIR", "forecasts")
+MANIFEST_FILE = "manifest.json"
+
+# json (default), gzip (gzipped JSON) or msgpack (requires the msgpack package).
+FORECAST_ENCODING = os.getenv("FORECAST_ENCODING", "json")
+ENCODING_SUFFIXES = {"json": ".json", "gzip": ".json.gz", "msgpack": ".msgpack"}
+
+# Fields that change every run without the forecast itself changing.
+VOLATILE_FIELDS = {"forecast_generated_at_utc"}
+
+# Held while the manifest or all_forecasts.json is read and rewritten, so the
+# hourly runs and forecast_stream.py can publish at the same time.
+OUTPUT_LOCK_FILE = os.getenv("FORECAST_OUTPUT_LOCK", os.path.join(".cache", "forecast_output.lock"))
+
+_HASH_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def content_hash(record):
+    """ Stable hash of a station record, ignoring VOLATILE_FIELDS, computed from streamed chunks. """
+    sha = hashlib.sha256()
+    body = {k: v for k, v in record.items() if k not in VOLATILE_FIELDS}
+    for chunk in _HASH_ENCODER.iterencode(body):
+        sha.update(chunk.encode())
+    return sha.hexdigest()[:16]
+
+
+def _open_encoded(path, encoding):
+    if encoding == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8")
+    if encoding == "msgpack":
+        return open(path, "wb")
+    return open(path, "w", encoding="utf-8")
+
+
+def _encode_to(f, record, encoding):
+    """ Streams the record straight into the open file. """
+    if encoding == "msgpack":
+        import msgpack
+
+        msgpack.pack(record, f, use_bin_type=True)
+    else:
+        json.dump(record, f, separators=(",", ":"))
+
+
+def _write_atomic(path, record, encoding):
+    tmp_path = path + ".tmp"
+    with _open_encoded(tmp_path, encoding) as f:
+        _encode_to(f, record, encoding)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def output_lock(path=OUTPUT_LOCK_FILE):
+    """ Exclusive lock (flock) on the published outputs, released on exit. """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_manifest(output_dir=OUTPUT_DIR):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"stations": {}}
+
+
+def load_station_record(sid, output_dir=OUTPUT_DIR):
+    """ The record last published for a station, or None. """
+    entry = load_manifest(output_dir)["stations"].get(sid)
+    if not entry:
+        return None
+    path = os.path.join(output_dir, entry["file"])
+    try:
+        if entry["file"].endswith(".msgpack"):
+            import msgpack
+
+            with open(path, "rb") as f:
+                return msgpack.unpack(f, raw=False)
+        opener = gzip.open if entry["file"].endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# --- 2. Degraded Stations ---
+
+def degraded_record(sid, lat, lon, reason, output_dir=OUTPUT_DIR):
+    """
+    Output for a station whose upstream data could not be fetched: the last
+    published record flagged "degraded", so no made-up AQI is ever shown.
+    With nothing published before, a stub without AQI or forecasts.
+    """
+    previous = load_station_record(sid, output_dir)
+    if previous and previous.get("current_aqi") is not None:
+        record = dict(previous)
+        record["degraded_since"] = previous.get("degraded_since") or datetime.now(UTC).isoformat()
+    else:
+        record = {
+            "location_coords": {"latitude": lat, "longitude": lon},
+            "current_aqi": None,
+            "hourly_forecast": [],
+            "daily_forecast": [],
+            "degraded_since": datetime.now(UTC).isoformat(),
+        }
+    record["forecast_generated_at_utc"] = datetime.now(UTC).isoformat()
+    record["status"] = "degraded"
+    record["degraded_reason"] = reason
+    return record
+
+
+def is_degraded(record):
+    return record.get("status") == "degraded"
+
+
+def fresh_records(station_records):
+    """ The records built from this run's data, i.e. without degraded stations. """
+    return {sid: r for sid, r in station_records.items() if not is_degraded(r)}
+
+
+# --- 3. Output Stage ---
+
+def write_station_outputs(station_records, output_dir=OUTPUT_DIR, encoding=FORECAST_ENCODING, registry=None):
+    """
+    Writes each (station_id, record) to its own file, but only when its content
+    hash differs from the manifest. Records are consumed one at a time, so a
+    generator keeps memory flat however many stations there are. The manifest
+    is rewritten only if something changed, under output_lock() so entries
+    written by another process meanwhile are kept. Full runs pass the
+    station `registry`: stations no longer in it lose their file and
+    manifest entry. Returns the changed station ids.
+    """
+    if encoding not in ENCODING_SUFFIXES:
+        raise ValueError(f"Unknown forecast encoding '{encoding}'")
+    os.makedirs(output_dir, exist_ok=True)
+    with output_lock():
+        return _write_station_outputs(station_records, output_dir, encoding, registry)
+
+
+def _write_station_outputs(station_records, output_dir, encoding, registry):
+    manifest = load_manifest(output_dir)
+    entries = manifest.get("stations", {})
+    changed = []
+
+    for sid, record in station_records:
+        digest = content_hash(record)
+        filename = f"{sid}{ENCODING_SUFFIXES[encoding]}"
+        entry = entries.get(sid)
+        if (entry and entry["hash"] == digest and entry["file"] == filename
+                and os.path.exists(os.path.join(output_dir, filename))):
+            continue
+        _write_atomic(os.path.join(output_dir, filename), record, encoding)
+        entries[sid] = {
+            "hash": digest,
+            "file": filename,
+            "updated_at": record.get("forecast_generated_at_utc"),
+        }
+        changed.append(sid)
+
+    removed = [sid for sid in entries if registry is not None and sid not in registry]
+    for sid in removed:
+        path = os.path.join(output_dir, entries.pop(sid)["file"])
+        if os.path.exists(path):
+            os.remove(path)
+
+    if changed or removed:
+        manifest = {
+            "generated_at_utc": datetime.now(UTC).isoformat(),
+            "encoding": encoding,
+            "stations": entries,
+        }
+        _write_atomic(os.path.join(output_dir, MANIFEST_FILE), manifest, "json")
+    return changed
@@ -0,0 +1,531 @@
+"""
+Streaming ingestion for readings pushed by local sensors.
+
+Reads newline-delimited JSON from stdin, a UNIX socket or a watched
+(appended-to) file, one reading per line:
+
+    {"station_id": "peenya", "time": "2025-01-01T10:05:00",
+     "pm2_5": 41.2, "pm10": 88.0, "co": 650, "no2": 21, "o3": 30, "so2": 6, "nh3": 4,
+     "temperature": 24.1, "humidity": 61}
+
+Concentrations are in ug/m3, as OpenWeather reports them. A reading may
+give lat/lon instead of station_id; it is then assigned to the nearest
+registered station within MAX_MATCH_KM. Weather fields are optional, and a
+station's last known weather is reused for any that are missing. Times with
+an offset are read as local wall-clock time, like the Open-Meteo times the
+models were trained on; a reading without a time gets its batch's time.
+
+Readings are micro-batched: a batch closes --window seconds after its first
+reading arrived or at --max-batch readings, whichever comes first. Each
+batch computes AQI for all its readings in one vectorised pass, then
+re-forecasts only the stations it touched with one predict() per model and
+rewrites only those stations' forecast files.
+
+The stream can run alongside the hourly runs. It keeps its own ring
+buffer, verification and run metrics, and both publish the per-station
+files, manifest and all_forecasts.json under forecast_output.output_lock(),
+the stream reloading all_forecasts.json before each save. A station fed by
+both shows whichever forecast was published last.
+
+    tail -F sensors.ndjson | python forecast_stream.py
+    python forecast_stream.py --socket /run/aqi/sensors.sock --window 5 --max-batch 500
+    python forecast_stream.py --watch /var/log/aqi/sensors.ndjson
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import stat
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from aqi_index import POLLUTANTS, compute_aqi
+from feature_matrix import build_feature_matrix_from_columns
+from forecast_output import output_lock, write_station_outputs
+from forecast_verification import ForecastVerifier
+from run_forecast_openweather import (
+    FORECAST_OUTPUT_FILE, STATIONS, format_predictions, load_models, update_history,
+)
+from run_metrics import METRICS
+from station_registry import StationIndex
+from station_state import HISTORY_FEATURES, StationState, to_epoch_hour
+
+# --- 1. Configuration ---
+DEFAULT_WINDOW = 5.0       # seconds a batch stays open after its first reading
+DEFAULT_MAX_BATCH = 500    # readings that close a batch early
+
+# Readings waiting for a batch; sources block (backpressure) once it is full.
+QUEUE_MAX = 100_000
+
+# Ring buffer, verification and run metrics kept apart from the hourly runs' own.
+STREAM_STATE_FILE = os.getenv("STREAM_STATE_FILE", os.path.join(".cache", "stream_state.npz"))
+STREAM_VERIFICATION_DIR = os.getenv("STREAM_VERIFICATION_DIR", os.path.join("verification", "stream"))
+STREAM_METRICS_JSON_FILE = os.getenv("STREAM_METRICS_FILE", "stream_metrics.json")
+STREAM_METRICS_PROM_FILE = os.getenv("STREAM_METRICS_PROM_FILE", "stream_metrics.prom")
+STREAM_PROM_PREFIX = "aqi_stream"
+
+# State, verification, all_forecasts.json and run metrics are saved at most this often.
+CHECKPOINT_SECONDS = 30
+
+WATCH_POLL_SECONDS = 0.2
+READ_CHUNK_BYTES = 1 << 16
+
+# Largest distance at which a lat/lon reading is matched to a station.
+MAX_MATCH_KM = 2.0
+
+WEATHER_FIELDS = ["temperature", "humidity", "wind_speed", "visibility", "precipitation", "pressure"]
+
+# Rejected lines are counted; only the first few are printed.
+MAX_LOGGED_REJECTS = 20
+
+
+def _number(item, key):
+    """ A numeric field of a reading, NaN when absent or null. """
+    value = item.get(key)
+    if value is None:
+        return math.nan
+    if isinstance(value, bool):
+        raise ValueError(f"'{key}' is not a number")
+    return float(value)
+
+
+def _reading_time(value, received_at):
+    if value is None:
+        return received_at
+    if not isinstance(value, str):
+        raise ValueError("'time' must be an ISO 8601 string")
+    ts = datetime.fromisoformat(value)
+    return ts.replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def _load_published():
+    try:
+        with open(FORECAST_OUTPUT_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# --- 2. Re-Forecasting ---
+
+class StreamForecaster:
+    """
+    Turns batches of raw reading lines into updated station forecasts.
+    Runs one batch at a time (off the event loop), so it owns its state.
+    """
+
+    def __init__(self, models, stations=STATIONS, max_match_km=MAX_MATCH_KM):
+        self.models = models
+        self.stations = stations
+        self.index = StationIndex(stations)
+        self.max_match_km = max_match_km
+        self.state = StationState.load(STREAM_STATE_FILE)
+        self.verifier = ForecastVerifier.load(STREAM_VERIFICATION_DIR)
+        self.unpublished = {}    # sid -> record not yet in all_forecasts.json
+        # Last known weather per station, seeded from what was last published.
+        self.weather = {
+            sid: dict(record.get("current_weather") or {}) for sid, record in _load_published().items()
+        }
+        self.current_time = {}   # sid -> time of the reading behind its current forecast
+        self.booked_hour = {}    # sid -> last hour recorded in history and verification
+        self.dirty = False
+        self.stats = {"readings": 0, "rejected": 0, "batches": 0, "forecasts": 0}
+
+    def parse(self, line, received_at):
+        """ One NDJSON line -> (station_id, time, pollutants, weather). Raises ValueError. """
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not JSON ({e.msg})") from None
+        if not isinstance(item, dict):
+            raise ValueError("not a JSON object")
+
+        sid = item.get("station_id")
+        if sid is None:
+            if item.get("lat") is None or item.get("lon") is None:
+                raise ValueError("needs station_id or lat/lon")
+            nearest = self.index.nearest(float(item["lat"]), float(item["lon"]))
+            if not nearest or nearest[0][1] > self.max_match_km:
+                raise ValueError(f"no station within {self.max_match_km} km of {item['lat']},{item['lon']}")
+            sid = nearest[0][0]
+        elif sid not in self.stations:
+            raise ValueError(f"unknown station '{sid}'")
+
+        ts = _reading_time(item.get("time"), received_at)
+        pollutants = [_number(item, p) for p in POLLUTANTS]
+        if all(math.isnan(v) for v in pollutants):
+            raise ValueError("no pollutant concentrations")
+        return sid, ts, pollutants, [_number(item, k) for k in WEATHER_FIELDS]
+
+    def _reject(self, line, error):
+        self.stats["rejected"] += 1
+        METRICS.incr("stream_rejected_readings")
+        if self.stats["rejected"] <= MAX_LOGGED_REJECTS:
+            print(f"⚠️ Rejected reading ({error}): {line[:200].decode(errors='replace')}")
+            if self.stats["rejected"] == MAX_LOGGED_REJECTS:
+                print("⚠️ Further rejected readings are only counted.")
+
+    def process(self, batch):
+        """
+        One micro-batch of (monotonic arrival time, line). Updates each
+        station's hourly ring buffer, then re-forecasts every station whose
+        newest reading is in this batch. Returns the new station records.
+        """
+        started = time.monotonic()
+        now = datetime.now()
+        sids, times, pollutants, weather = [], [], [], []
+        with METRICS.span("stream_parse"):
+            for _, line in batch:
+                try:
+                    sid, ts, p, w = self.parse(line, now)
+                except (ValueError, TypeError) as e:
+                    self._reject(line, e)
+                    continue
+                sids.append(sid)
+                times.append(ts)
+                pollutants.append(p)
+                weather.append(w)
+        self.stats["readings"] += len(batch)
+        self.stats["batches"] += 1
+        METRICS.incr("stream_readings", len(batch))
+        if not sids:
+            return {}
+
+        with METRICS.span("aqi"):
+            pollutants = np.array(pollutants)
+            aqi, primary, sub_indices = compute_aqi({p: pollutants[:, i] for i, p in enumerate(POLLUTANTS)})
+
+        # Oldest first, so the ring buffer and weather end up at each station's newest reading.
+        latest = {}
+        with METRICS.span("state_update"):
+            for i in sorted(range(len(sids)), key=times.__getitem__):
+                sid, ts = sids[i], times[i]
+                if sid in self.current_time and ts < self.current_time[sid]:
+                    continue
+                self.current_time[sid] = ts
+                self.state.update(sid, ts, float(aqi[i]))
+                known = self.weather.setdefault(sid, {})
+                for key, value in zip(WEATHER_FIELDS, weather[i]):
+                    if not math.isnan(value):
+                        known[key] = value
+                latest[sid] = i
+        if not latest:
+            return {}
+
+        records = self._forecast(latest, times, pollutants, aqi, primary, sub_indices)
+
+        with METRICS.span("write"):
+            changed = write_station_outputs(records.items())
+        self.unpublished.update(records)
+        self._book_hours(records)
+        self.dirty = True
+        self.stats["forecasts"] += len(records)
+
+        latency = time.monotonic() - batch[0][0]
+        METRICS.record("stream_batch", time.monotonic() - started)
+        METRICS.record("stream_latency", latency)
+        print(f"▶ Batch of {len(batch)} readings: {len(records)} stations re-forecast, "
+              f"{len(changed)} files changed, {latency:.2f}s from first reading")
+        return records
+
+    def _forecast(self, latest, times, pollutants, aqi, primary, sub_indices):
+        """ Features for every re-forecast station, one predict() per model, formatted records. """
+        sids = list(latest)
+        rows = np.array([latest[sid] for sid in sids])
+        with METRICS.span("feature_build"):
+            stamps = [times[i] for i in rows]
+            columns = {p: pollutants[rows, j] for j, p in enumerate(POLLUTANTS)}
+            columns["calculated_aqi"] = aqi[rows]
+            for key in WEATHER_FIELDS:
+                columns[key] = [self.weather[sid].get(key) for sid in sids]
+            columns.update({
+                "hour": [ts.hour for ts in stamps],
+                "dayofweek": [ts.weekday() for ts in stamps],
+                "month": [ts.month for ts in stamps],
+                "dayofyear": [ts.timetuple().tm_yday for ts in stamps],
+                "weekofyear": [ts.isocalendar().week for ts in stamps],
+            })
+            history = [self.state.features(sid, fallback=float(aqi[i])) for sid, i in zip(sids, rows)]
+            for feat in HISTORY_FEATURES:
+                columns[feat] = [h[feat] for h in history]
+            X = build_feature_matrix_from_columns(columns, len(sids))
+
+        with METRICS.span("hourly_predict"):
+            hourly = self.models["hourly"].predict(X)
+        with METRICS.span("daily_predict"):
+            daily = self.models["daily"].predict(X)
+
+        records = {}
+        with METRICS.span("format"):
+            for k, (sid, i) in enumerate(zip(sids, rows)):
+                known = self.weather[sid]
+                current = {key: known.get(key) for key in WEATHER_FIELDS}
+                current.update({
+                    "datetime": stamps[k],
+                    "calculated_aqi": float(aqi[i]),
+                    "primary_pollutant": str(primary[i]),
+                    "pollutant_details": {
+                        p: {
+                            "value": None if np.isnan(pollutants[i, j]) else float(pollutants[i, j]),
+                            "sub_index": float(sub_indices[i, j]),
+                        }
+                        for j, p in enumerate(POLLUTANTS)
+                    },
+                })
+                info = self.stations[sid]
+                records[sid] = format_predictions(
+                    hourly[k:k + 1], daily[k:k + 1], current, info["lat"], info["lon"]
+                )
+        return records
+
+    def _book_hours(self, records):
+        """ History and verification take one point per station-hour, like the hourly runs. """
+        booked = {}
+        for sid, record in records.items():
+            hour = to_epoch_hour(datetime.fromisoformat(record["current_conditions_time"]))
+            if hour > self.booked_hour.get(sid, -1):
+                self.booked_hour[sid] = hour
+                booked[sid] = record
+        if booked:
+            update_history(booked)
+            with METRICS.span("verification"):
+                self.verifier.update(booked)
+
+    def checkpoint(self):
+        """
+        Saves state, verification and run metrics, and merges the stations
+        re-forecast since the last checkpoint into all_forecasts.json as it
+        is now, so stations published by an hourly run meanwhile are kept.
+        """
+        if not self.dirty:
+            return
+        self.state.save(STREAM_STATE_FILE)
+        self.verifier.save(STREAM_VERIFICATION_DIR)
+        with output_lock():
+            published = _load_published()
+            published.update(self.unpublished)
+            with open(FORECAST_OUTPUT_FILE + ".tmp", "w") as f:
+                json.dump(published, f, indent=2)
+            os.replace(FORECAST_OUTPUT_FILE + ".tmp", FORECAST_OUTPUT_FILE)
+        self.unpublished = {}
+        METRICS.write({f"stream_{k}_total": v for k, v in self.stats.items()},
+                      STREAM_METRICS_JSON_FILE, STREAM_METRICS_PROM_FILE, STREAM_PROM_PREFIX)
+        METRICS.reset()
+        self.dirty = False
+
+
+# --- 3. Sources ---
+
+async def _enqueue(queue, line):
+    line = line.strip()
+    if line:
+        await queue.put((time.monotonic(), line))
+
+
+async def read_stream(reader, queue):
+    """ Queues every line from an asyncio StreamReader until EOF. """
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # Longer than the reader's buffer limit; the rest of it is discarded.
+            METRICS.incr("stream_rejected_readings")
+            continue
+        if not line:
+            return
+        await _enqueue(queue, line)
+
+
+async def read_stdin(queue):
+    """ Pipes and terminals are read asynchronously; a redirected regular file is read like --watch. """
+    if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+        await watch_file(sys.stdin.buffer, queue, from_start=True, follow=False)
+        return
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=READ_CHUNK_BYTES)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    await read_stream(reader, queue)
+
+
+async def serve_unix_socket(path, queue):
+    """ Accepts any number of writers on a UNIX socket; each sends NDJSON lines. """
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a previous run
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _serve_client(reader, writer, queue), path=path, limit=READ_CHUNK_BYTES,
+    )
+    print(f"Listening for readings on {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+async def _serve_client(reader, writer, queue):
+    try:
+        await read_stream(reader, queue)
+    finally:
+        writer.close()
+
+
+async def watch_file(path, queue, from_start=False, follow=True):
+    """
+    Queues lines appended to a file, like tail -F: an incomplete last line
+    waits for the rest, and a rotated, truncated or newly created file is
+    read from its start. `path` may also be an open binary file (read once, to EOF).
+    """
+    f = None if isinstance(path, str) else path
+    inode = None
+    partial = b""
+    while True:
+        if f is None:
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                from_start = True  # everything in it once created is new
+                await asyncio.sleep(WATCH_POLL_SECONDS)
+                continue
+            inode = os.fstat(f.fileno()).st_ino
+            if not from_start:
+                f.seek(0, os.SEEK_END)
+            from_start = True
+            partial = b""
+
+        lines = f.readlines(READ_CHUNK_BYTES)
+        if lines:
+            lines[0] = partial + lines[0]
+            partial = b"" if lines[-1].endswith(b"\n") else lines.pop()
+            for line in lines:
+                await _enqueue(queue, line)
+            continue
+        if not follow:
+            await _enqueue(queue, partial)
+            return
+
+        await asyncio.sleep(WATCH_POLL_SECONDS)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue  # mid-rotation; keep the old file until a new one appears
+        if st.st_ino != inode or st.st_size < f.tell():
+            f.close()
+            f = None
+
+
+# --- 4. Micro-Batching ---
+
+async def batch_loop(queue, forecaster, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+    """
+    Collects readings until the batch's window has passed since its first
+    reading arrived or it holds max_batch readings, then processes it in a
+    worker thread so sources keep reading meanwhile. Readings already queued
+    when a batch closes join it: work grows with stations re-forecast, not
+    readings, so a backlog is cleared in a few large batches instead of
+    many small ones. A None item ends the loop.
+    """
+    next_checkpoint = time.monotonic() + CHECKPOINT_SECONDS
+    done = False
+    while not done:
+        try:
+            item = await asyncio.wait_for(queue.get(), CHECKPOINT_SECONDS)
+        except asyncio.TimeoutError:
+            item = False
+        batch = []
+        if item is None:
+            done = True
+        elif item:
+            batch.append(item)
+            deadline = item[0] + window
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    if len(batch) >= max_batch:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+        if batch:
+            try:
+                await asyncio.to_thread(forecaster.process, batch)
+            except Exception as e:
+                print(f"⚠️ Batch of {len(batch)} readings failed: {e}")
+        if done or time.monotonic() >= next_checkpoint:
+            await asyncio.to_thread(forecaster.checkpoint)
+            next_checkpoint = time.monotonic() + CHECKPOINT_SECONDS
+
+
+async def run(forecaster, sources, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+    """ Runs the sources into one queue until they all end or SIGINT/SIGTERM, then flushes. """
+    queue = asyncio.Queue(QUEUE_MAX)
+    tasks = [asyncio.create_task(source(queue)) for source in sources]
+
+    async def close_when_sources_end():
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"⚠️ Reading source failed: {result}")
+        await queue.put(None)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: [task.cancel() for task in tasks])
+    closer = asyncio.create_task(close_when_sources_end())
+    await batch_loop(queue, forecaster, window, max_batch)
+    await closer
+
+
+# --- 5. Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-forecast stations from streamed sensor readings.")
+    parser.add_argument("--stdin", action="store_true",
+                        help="Read readings from stdin (the default when no other source is given)")
+    parser.add_argument("--socket", action="append", default=[], metavar="PATH",
+                        help="Accept readings on this UNIX socket (repeatable)")
+    parser.add_argument("--watch", action="append", default=[], metavar="PATH",
+                        help="Follow readings appended to this file (repeatable)")
+    parser.add_argument("--from-start", action="store_true",
+                        help="Read watched files from the beginning instead of only new lines")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW,
+                        help="Seconds a batch stays open after its first reading")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="Readings that close a batch before its window ends")
+    parser.add_argument("--max-match-km", type=float, default=MAX_MATCH_KM,
+                        help="Farthest a lat/lon reading may be from its station")
+    args = parser.parse_args(argv)
+
+    sources = [lambda q, p=path: serve_unix_socket(p, q) for path in args.socket]
+    sources += [lambda q, p=path: watch_file(p, q, args.from_start) for path in args.watch]
+    if args.stdin or not sources:
+        sources.append(read_stdin)
+
+    models = load_models()
+    if not models:
+        raise RuntimeError("Models failed to load")
+    forecaster = StreamForecaster(models, max_match_km=args.max_match_km)
+
+    started = time.monotonic()
+    asyncio.run(run(forecaster, sources, args.window, max(1, args.max_batch)))
+    stats = forecaster.stats
+    elapsed = time.monotonic() - started
+    print(f"✅ Stream closed: {stats['readings']} readings ({stats['rejected']} rejected) in "
+          f"{stats['batches']} batches, {stats['forecasts']} station forecasts, {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import heapq
+import json
+import math
+import os
+from datetime import date, datetime, UTC
+
+from station_state import to_epoch_hour
+
+# --- 1. Configuration ---
+VERIFICATION_DIR = os.getenv("VERIFICATION_DIR", "verification")
+STATE_FILE = "state.json"
+SCORES_FILE = "scores.json"
+
+# Weight of the "recent" scores: an error's influence halves after this many
+# newer verified forecasts of the same station and horizon (~1 week hourly).
+RECENT_HALF_LIFE = 168
+RECENT_DECAY = 0.5 ** (1 / RECENT_HALF_LIFE)
+
+# A day's mean is only trusted for daily forecasts with this many hourly readings.
+MIN_DAILY_OBSERVATIONS = 12
+
+KINDS = ("hourly", "daily")
+
+# Accumulator layout per station/kind/horizon (all O(1) to update):
+# n, sum(err), sum(|err|), sum(err^2), then the same four exponentially decayed.
+N, ERR, ABS, SQ, EW_N, EW_ERR, EW_ABS, EW_SQ = range(8)
+
+
+def _epoch_hour(iso):
+    """ Hour index of an ISO timestamp, on the same scale as StationState. """
+    return to_epoch_hour(datetime.fromisoformat(iso))
+
+
+def _day_hour(iso_date):
+    """ Epoch hour at the start of a YYYY-MM-DD date. """
+    return (date.fromisoformat(iso_date) - date(1970, 1, 1)).days * 24
+
+
+# --- 2. Verifier ---
+
+class ForecastVerifier:
+    """
+    Scores published forecasts once the AQI they predicted has been observed.
+
+    Forecasts waiting for their target are held per station in a min-heap
+    keyed by target hour, so each new observation pops only the forecasts
+    that have just matured; nothing already verified is kept or rescanned.
+    Hourly forecasts are matched to the observation for their target hour;
+    daily forecasts to the mean of the observations within their target day,
+    once a later day has been seen. Errors (forecast - observed) feed running
+    and exponentially decayed sums per station, kind and horizon.
+    """
+
+    def __init__(self):
+        self.pending = {}    # sid -> {kind: [[target_hour, horizon, predicted], ...] heap}
+        self.day_obs = {}    # sid -> {day_start_hour: [sum, count]} for targeted days only
+        self.last_hour = {}  # sid -> last observed hour
+        self.scores = {}     # sid -> {kind: {horizon: accumulator list}}
+        self.stats = {"verified": 0, "expired": 0}
+
+    # --- Observations ---
+
+    def observe(self, sid, ts_iso, aqi):
+        """ Records an observed AQI and scores every forecast it matures. """
+        hour = _epoch_hour(ts_iso)
+        if hour <= self.last_hour.get(sid, -1):
+            return
+        self.last_hour[sid] = hour
+        pending = self.pending.setdefault(sid, {kind: [] for kind in KINDS})
+
+        hourly = pending["hourly"]
+        while hourly and hourly[0][0] <= hour:
+            target, horizon, predicted = heapq.heappop(hourly)
+            if target == hour:
+                self._score(sid, "hourly", horizon, predicted, aqi)
+            else:
+                self.stats["expired"] += 1  # no run observed its target hour
+
+        days = self.day_obs.setdefault(sid, {})
+        day = hour - hour % 24
+        if str(day) in days:
+            days[str(day)][0] += aqi
+            days[str(day)][1] += 1
+
+        daily = pending["daily"]
+        while daily and daily[0][0] < day:
+            target, horizon, predicted = heapq.heappop(daily)
+            total, count = days.get(str(target), (0.0, 0))
+            if count >= MIN_DAILY_OBSERVATIONS:
+                self._score(sid, "daily", horizon, predicted, total / count)
+            else:
+                self.stats["expired"] += 1
+        # Every daily forecast still queued targets today or later.
+        for key in [k for k in days if int(k) < day]:
+            del days[key]
+
+    def _score(self, sid, kind, horizon, predicted, observed):
+        acc = self.scores.setdefault(sid, {k: {} for k in KINDS})[kind].setdefault(
+            str(horizon), [0.0] * 8
+        )
+        err = predicted - observed
+        acc[N] += 1
+        acc[ERR] += err
+        acc[ABS] += abs(err)
+        acc[SQ] += err * err
+        acc[EW_N] = acc[EW_N] * RECENT_DECAY + 1
+        acc[EW_ERR] = acc[EW_ERR] * RECENT_DECAY + err
+        acc[EW_ABS] = acc[EW_ABS] * RECENT_DECAY + abs(err)
+        acc[EW_SQ] = acc[EW_SQ] * RECENT_DECAY + err * err
+        self.stats["verified"] += 1
+
+    # --- Forecasts ---
+
+    def register(self, sid, record):
+        """ Queues a published station record's forecasts until their targets are observed. """
+        issued = _epoch_hour(record["current_conditions_time"])
+        issue_day = issued - issued % 24
+        pending = self.pending.setdefault(sid, {kind: [] for kind in KINDS})
+        days = self.day_obs.setdefault(sid, {})
+
+        hourly = [
+            (_epoch_hour(item["time"]), item["aqi"]) for item in record.get("hourly_forecast", [])
+        ]
+        daily = [
+            (_day_hour(item["date"]), item["avg_aqi"]) for item in record.get("daily_forecast", [])
+        ]
+        for kind, items, origin, unit in (("hourly", hourly, issued, 1), ("daily", daily, issue_day, 24)):
+            # A newer run's forecast for the same target and horizon replaces the older one.
+            queued = {(t, h): i for i, (t, h, _) in enumerate(pending[kind])}
+            for target, predicted in items:
+                horizon = (target - origin) // unit
+                entry = [target, horizon, float(predicted)]
+                if (target, horizon) in queued:
+                    pending[kind][queued[(target, horizon)]] = entry
+                else:
+                    heapq.heappush(pending[kind], entry)
+                if kind == "daily":
+                    days.setdefault(str(target), [0.0, 0])
+
+    def update(self, station_records):
+        """ One run: observe each station's current AQI, then queue its new forecasts. """
+        for sid, record in station_records.items():
+            self.observe(sid, record["current_conditions_time"], record["current_aqi"])
+            self.register(sid, record)
+
+    # --- Partitioning ---
+
+    def subset(self, station_ids):
+        """ A new verifier holding only the given stations' pending forecasts and scores. """
+        part = ForecastVerifier()
+        for name in ("pending", "day_obs", "last_hour", "scores"):
+            held = getattr(self, name)
+            setattr(part, name, {sid: held[sid] for sid in station_ids if sid in held})
+        return part
+
+    def merge(self, other):
+        """ Takes over other's state, replacing ours, for every station it holds. """
+        for name in ("pending", "day_obs", "last_hour", "scores"):
+            getattr(self, name).update(getattr(other, name))
+
+    # --- Export & Persistence ---
+
+    @staticmethod
+    def _summarize(acc):
+        if not acc[N]:
+            return None
+        return {
+            "n": int(acc[N]),
+            "mae": round(acc[ABS] / acc[N], 2),
+            "rmse": round(math.sqrt(acc[SQ] / acc[N]), 2),
+            "bias": round(acc[ERR] / acc[N], 2),
+            "recent_mae": round(acc[EW_ABS] / acc[EW_N], 2),
+            "recent_rmse": round(math.sqrt(acc[EW_SQ] / acc[EW_N]), 2),
+            "recent_bias": round(acc[EW_ERR] / acc[EW_N], 2),
+        }
+
+    def export(self):
+        """ Per-station and overall scores by horizon, for the dashboard. """
+        stations, overall = {}, {kind: {} for kind in KINDS}
+        for sid, kinds in self.scores.items():
+            stations[sid] = {}
+            for kind, horizons in kinds.items():
+                stations[sid][kind] = {h: self._summarize(acc) for h, acc in horizons.items()}
+                for h, acc in horizons.items():
+                    total = overall[kind].setdefault(h, [0.0] * 8)
+                    for i, value in enumerate(acc):
+                        total[i] += value
+        return {
+            "generated_at_utc": datetime.now(UTC).isoformat(),
+            "error_definition": "forecast - observed AQI",
+            "recent_half_life": RECENT_HALF_LIFE,
+            "overall": {
+                kind: {h: self._summarize(acc) for h, acc in sorted(horizons.items(), key=lambda x: int(x[0]))}
+                for kind, horizons in overall.items()
+            },
+            "stations": stations,
+        }
+
+    def save(self, directory=VERIFICATION_DIR):
+        os.makedirs(directory, exist_ok=True)
+        state = {
+            "pending": self.pending,
+            "day_obs": self.day_obs,
+            "last_hour": self.last_hour,
+            "scores": self.scores,
+        }
+        for name, payload in ((STATE_FILE, state), (SCORES_FILE, self.export())):
+            path = os.path.join(directory, name)
+            with open(path + ".tmp", "w") as f:
+                json.dump(payload, f, separators=(",", ":"))
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory=VERIFICATION_DIR):
+        """ Loads saved state, or returns an empty verifier if there is none. """
+        verifier = cls()
+        try:
+            with open(os.path.join(directory, STATE_FILE)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return verifier
+        verifier.pending = state["pending"]
+        verifier.day_obs = state["day_obs"]
+        verifier.last_hour = state["last_hour"]
+        verifier.scores = state["scores"]
+        return verifier
+
+
+def verify_forecasts(station_records, directory=VERIFICATION_DIR):
+    """ Loads the verifier, folds in one run's records and saves state plus scores. """
+    verifier = ForecastVerifier.load(directory)
+    verifier.update(station_records)
+    verifier.save(directory)
+    return verifier
@@ -0,0 +1,192 @@
+import json
+import os
+from datetime import datetime, UTC
+
+import numpy as np
+
+from station_state import to_epoch_hour
+
+# --- 1. Configuration ---
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+
+# Hot-log records per station before they are folded into monthly chunks.
+COMPACT_EVERY = 48
+
+# How much of each tier is exported for the dashboard.
+EXPORT_LIMITS = {"hourly": 168, "daily": 90, "weekly": 52}
+
+RAW_DTYPE = np.dtype([("hour", "<i8"), ("aqi", "<f4")])
+AGG_DTYPE = np.dtype([("start", "<i8"), ("sum", "<f8"), ("count", "<i4"), ("max", "<f4")])
+
+# Epoch hour 0 is a Thursday; shifting by 72 h makes weekly buckets start on Monday.
+WEEK_OFFSET_HOURS = 72
+
+
+def _bucket_start(tier, hour):
+    if tier == "daily":
+        return hour - hour % 24
+    return (hour + WEEK_OFFSET_HOURS) // 168 * 168 - WEEK_OFFSET_HOURS
+
+
+def _hour_to_datetime(hour):
+    """
+    Naive wall-clock time of an epoch hour. Hours come from the stations'
+    local (timezone=auto) times stored as if UTC, so no offset is attached.
+    """
+    return datetime.fromtimestamp(int(hour) * 3600, UTC).replace(tzinfo=None)
+
+
+def _read_last(path, dtype):
+    """ Reads only the final fixed-size record of a binary file, or None. """
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return None
+    with open(path, "rb") as f:
+        f.seek(-dtype.itemsize, os.SEEK_END)
+        return np.frombuffer(f.read(dtype.itemsize), dtype=dtype)[0]
+
+
+# --- 2. Store ---
+
+class HistoryStore:
+    """
+    Append-only per-station AQI history.
+
+    history/<station>/store/
+        hot.bin           raw hourly records appended each run
+        raw-YYYYMM.npy    compacted, de-duplicated monthly columnar chunks
+        daily.bin         pre-aggregated daily sum/count/max (one row per day)
+        weekly.bin        pre-aggregated weekly sum/count/max (one row per week)
+
+    Writes touch only the tail of these files, so cost per run is O(1) per
+    station regardless of how much history has built up.
+    """
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+
+    def _store_dir(self, sid):
+        path = os.path.join(self.root, sid, "store")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _chunk_path(self, sid, hour):
+        month = _hour_to_datetime(hour).strftime("%Y%m")
+        return os.path.join(self._store_dir(sid), f"raw-{month}.npy")
+
+    def _last_hour(self, sid):
+        store = self._store_dir(sid)
+        last = _read_last(os.path.join(store, "hot.bin"), RAW_DTYPE)
+        if last is not None:
+            return int(last["hour"])
+        chunks = sorted(f for f in os.listdir(store) if f.startswith("raw-"))
+        if chunks:
+            return int(np.load(os.path.join(store, chunks[-1]))["hour"][-1])
+        return None
+
+    def append(self, sid, ts, aqi):
+        """ Records one hourly observation. Repeats of an hour already stored are ignored. """
+        hour = to_epoch_hour(ts)
+        last_hour = self._last_hour(sid)
+        if last_hour is not None and hour <= last_hour:
+            return False
+
+        store = self._store_dir(sid)
+        record = np.array([(hour, aqi)], dtype=RAW_DTYPE)
+        with open(os.path.join(store, "hot.bin"), "ab") as f:
+            f.write(record.tobytes())
+
+        for tier in ("daily", "weekly"):
+            self._update_tier(os.path.join(store, f"{tier}.bin"), _bucket_start(tier, hour), aqi)
+
+        if os.path.getsize(os.path.join(store, "hot.bin")) >= COMPACT_EVERY * RAW_DTYPE.itemsize:
+            self.compact(sid)
+        return True
+
+    @staticmethod
+    def _update_tier(path, start, aqi):
+        """ Updates the open bucket in place, or appends a new one. """
+        last = _read_last(path, AGG_DTYPE)
+        if last is not None and last["start"] == start:
+            row = np.array([(start, last["sum"] + aqi, last["count"] + 1, max(last["max"], aqi))],
+                           dtype=AGG_DTYPE)
+            with open(path, "r+b") as f:
+                f.seek(-AGG_DTYPE.itemsize, os.SEEK_END)
+                f.write(row.tobytes())
+        else:
+            with open(path, "ab") as f:
+                f.write(np.array([(start, aqi, 1, aqi)], dtype=AGG_DTYPE).tobytes())
+
+    def compact(self, sid):
+        """ Folds the hot log into sorted, de-duplicated monthly chunks and truncates it. """
+        hot_path = os.path.join(self._store_dir(sid), "hot.bin")
+        if not os.path.exists(hot_path):
+            return
+        hot = np.fromfile(hot_path, dtype=RAW_DTYPE)
+        months = np.array([_hour_to_datetime(h).strftime("%Y%m") for h in hot["hour"]])
+        for month in np.unique(months):
+            path = self._chunk_path(sid, hot["hour"][months == month][0])
+            records = hot[months == month]
+            if os.path.exists(path):
+                records = np.concatenate([np.load(path), records])
+            # Keep the last record seen for each hour.
+            _, keep = np.unique(records["hour"][::-1], return_index=True)
+            records = records[::-1][keep]
+            tmp_path = path + ".tmp.npy"
+            np.save(tmp_path, records)
+            os.replace(tmp_path, path)
+        open(hot_path, "wb").close()
+
+    # --- 3. Reads & Export ---
+
+    def read_raw(self, sid, since_hour=None):
+        """ Raw hourly records (compacted chunks + hot log), optionally from since_hour on. """
+        store = self._store_dir(sid)
+        parts = []
+        first_month = _hour_to_datetime(since_hour).strftime("%Y%m") if since_hour is not None else ""
+        for name in sorted(os.listdir(store)):
+            if name.startswith("raw-") and name[4:10] >= first_month:
+                parts.append(np.load(os.path.join(store, name)))
+        hot_path = os.path.join(store, "hot.bin")
+        if os.path.exists(hot_path):
+            parts.append(np.fromfile(hot_path, dtype=RAW_DTYPE))
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=RAW_DTYPE)
+        if since_hour is not None:
+            records = records[records["hour"] >= since_hour]
+        return records
+
+    def read_tier(self, sid, tier):
+        path = os.path.join(self._store_dir(sid), f"{tier}.bin")
+        if not os.path.exists(path):
+            return np.empty(0, dtype=AGG_DTYPE)
+        return np.fromfile(path, dtype=AGG_DTYPE)
+
+    def export(self, sid):
+        """ Writes small hourly/daily/weekly JSON files for one station next to its store. """
+        out_dir = os.path.join(self.root, sid)
+        last_hour = self._last_hour(sid)
+        if last_hour is None:
+            return
+
+        raw = self.read_raw(sid, since_hour=last_hour - EXPORT_LIMITS["hourly"] + 1)
+        exports = {
+            "hourly": [
+                {"time": _hour_to_datetime(r["hour"]).isoformat(), "aqi": round(float(r["aqi"]), 2)}
+                for r in raw
+            ],
+        }
+        for tier in ("daily", "weekly"):
+            rows = self.read_tier(sid, tier)[-EXPORT_LIMITS[tier]:]
+            exports[tier] = [
+                {
+                    "date": _hour_to_datetime(r["start"]).strftime("%Y-%m-%d"),
+                    "avg_aqi": round(float(r["sum"] / r["count"]), 2),
+                    "max_aqi": round(float(r["max"]), 2),
+                }
+                for r in rows
+            ]
+
+        for tier, rows in exports.items():
+            path = os.path.join(out_dir, f"{tier}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(rows, f, separators=(",", ":"))
+            os.replace(path + ".tmp", path)
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from run_metrics import METRICS
+
+# --- 1. Configuration ---
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(".cache", "models"))
+
+# Bump when the on-disk layout below changes so old caches are rebuilt.
+CACHE_FORMAT_VERSION = 2
+
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type "Zero".
+K_ZERO_THRESHOLD = 1e-35
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+
+NODE_ARRAYS = ("feature", "threshold", "default_left", "missing_type", "child", "value")
+TREE_ARRAYS = ("tree_root", "tree_depth", "tree_output")
+
+# Rows evaluated together; bounds the (trees x rows) working arrays.
+# Smaller chunks stay in cache; measured fastest around 128-256 rows.
+PREDICT_CHUNK_ROWS = 256
+
+# Batches at least this large go to LightGBM's own booster when lightgbm is
+# installed (~2.5x faster per row per thread), paying its ~1.7 s import once.
+NATIVE_MIN_ROWS = int(os.getenv("MODEL_NATIVE_MIN_ROWS", "4096"))
+NATIVE_THREADS = int(os.getenv("MODEL_NATIVE_THREADS", "0")) or os.cpu_count() or 1
+# Below this many rows per thread, starting another thread costs more than it saves.
+NATIVE_ROWS_PER_THREAD = 2048
+
+# Load timings and sources, reported by --profile-startup.
+LOAD_STATS = {}
+
+
+def file_digest(path):
+    """ Content hash of a model pickle; the compiled cache is keyed by it. """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+# --- 2. Pickle -> Flat Arrays ---
+
+def _add_node(nodes):
+    """ Appends a leaf-shaped node (points to itself, never goes right) and returns its index. """
+    ref = len(nodes["feature"])
+    for name, value in (("feature", 0), ("threshold", np.inf), ("default_left", False),
+                        ("missing_type", 0), ("child", ref), ("value", 0.0)):
+        nodes[name].append(value)
+    return ref
+
+
+def _flatten_booster(dump, output, nodes, trees):
+    """
+    Appends every tree of one LightGBM dump_model() to the flat arrays.
+    Each split's two children are stored side by side (left, then right),
+    so one step is child[node] + (x > threshold[node]). Leaves are nodes
+    whose child is themselves and whose threshold is +inf: once reached,
+    further steps leave them in place.
+    """
+    for info in dump["tree_info"]:
+        root = _add_node(nodes)
+        queue = [(info["tree_structure"], root, 0)]
+        depth = 0
+        for node, ref, level in queue:
+            depth = max(depth, level)
+            if "split_index" not in node:
+                nodes["value"][ref] = node["leaf_value"]
+                continue
+            if node["decision_type"] != "<=":
+                raise ValueError("Categorical splits are not supported by the compiled cache")
+            left = _add_node(nodes)
+            _add_node(nodes)
+            nodes["feature"][ref] = node["split_feature"]
+            nodes["threshold"][ref] = node["threshold"]
+            nodes["default_left"][ref] = node["default_left"]
+            nodes["missing_type"][ref] = MISSING_TYPES[node["missing_type"]]
+            nodes["child"][ref] = left
+            queue.append((node["left_child"], left, level + 1))
+            queue.append((node["right_child"], left + 1, level + 1))
+        trees["tree_root"].append(root)
+        trees["tree_depth"].append(depth)
+        trees["tree_output"].append(output)
+
+
+def compile_model(pkl_path, out_dir):
+    """
+    Converts a pickled LightGBM regressor (or a MultiOutputRegressor of them)
+    into plain .npy arrays that load without importing lightgbm or sklearn,
+    plus each booster's text model for the native large-batch path.
+    """
+    import joblib
+
+    model = joblib.load(pkl_path)
+    estimators = getattr(model, "estimators_", [model])
+    nodes = {k: [] for k in NODE_ARRAYS}
+    trees = {k: [] for k in TREE_ARRAYS}
+    for output, estimator in enumerate(estimators):
+        _flatten_booster(estimator.booster_.dump_model(), output, nodes, trees)
+    # Deepest trees first, so the trees still walking at any level are a prefix.
+    order = np.argsort(-np.array(trees["tree_depth"]), kind="stable")
+    trees = {k: np.array(v)[order] for k, v in trees.items()}
+
+    # Per-process temp dir: parallel workers may compile the same model at once.
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    dtypes = {"feature": np.int32, "threshold": np.float64, "default_left": np.bool_,
+              "missing_type": np.int8, "child": np.int32, "value": np.float64,
+              "tree_root": np.int32, "tree_depth": np.int32, "tree_output": np.int32}
+    for name, values in {**nodes, **trees}.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.array(values, dtype=dtypes[name]))
+    for output, estimator in enumerate(estimators):
+        with open(os.path.join(tmp_dir, f"booster-{output}.txt"), "w") as f:
+            f.write(estimator.booster_.model_to_string())
+
+    feature_names = getattr(model, "feature_names_in_", None)
+    meta = {
+        "format_version": CACHE_FORMAT_VERSION,
+        "n_outputs": len(estimators),
+        "n_features": int(estimators[0].n_features_in_),
+        "feature_names": list(feature_names) if feature_names is not None else None,
+        "single_output": not hasattr(model, "estimators_"),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    if os.path.exists(os.path.join(out_dir, "meta.json")):
+        # Another process finished first; its arrays are identical.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    shutil.rmtree(out_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, out_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# --- 3. Compiled Model ---
+
+class CompiledEnsemble:
+    """
+    Tree ensemble evaluated from memory-mapped flat arrays, with a predict() like sklearn's.
+    All horizons' trees are walked together for a chunk of rows, one level
+    per vectorised step; large batches go to LightGBM's booster if installed.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        for name in NODE_ARRAYS + TREE_ARRAYS:
+            # Plain ndarray views of the maps: memmap subclass overhead on every gather adds up.
+            setattr(self, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")))
+        # Used as gather indices on every step; intp avoids a conversion each time.
+        self.feature = np.asarray(self.feature, dtype=np.intp)
+        self.child = np.asarray(self.child, dtype=np.intp)
+        self.tree_root = np.asarray(self.tree_root, dtype=np.intp)
+        self.n_outputs = self.meta["n_outputs"]
+        # (n_trees, n_outputs) one-hot map used to sum leaf values per horizon.
+        self.output_matrix = np.eye(self.n_outputs)[self.tree_output]
+        # Trees still walking at each level (stored deepest first, so a prefix).
+        self.level_trees = [
+            int(np.count_nonzero(self.tree_depth > level)) for level in range(int(self.tree_depth.max(initial=0)))
+        ]
+        # With only missing_type "None" splits, NaN handling reduces to NaN -> 0 up front.
+        self.plain_splits = not self.missing_type.any()
+        self.feature_names_in_ = self.meta["feature_names"]
+        self.path = path
+        self.version = os.path.basename(path)
+        self._boosters = None
+
+    def _go_right(self, node, x):
+        if self.plain_splits:
+            return x > self.threshold[node]
+        missing = self.missing_type[node]
+        x = np.where(np.isnan(x) & (missing != 2), 0.0, x)
+        is_missing = ((missing == 1) & (np.abs(x) <= K_ZERO_THRESHOLD)) | ((missing == 2) & np.isnan(x))
+        return np.where(is_missing, ~self.default_left[node], x > self.threshold[node])
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        boosters = self._native() if len(X) >= NATIVE_MIN_ROWS else None
+        if boosters:
+            threads = max(1, min(NATIVE_THREADS, len(X) // NATIVE_ROWS_PER_THREAD))
+            out = np.column_stack([b.predict(X, num_threads=threads) for b in boosters])
+        elif len(X):
+            out = np.vstack([
+                self._predict_chunk(X[start:start + PREDICT_CHUNK_ROWS])
+                for start in range(0, len(X), PREDICT_CHUNK_ROWS)
+            ])
+        else:
+            out = np.zeros((0, self.n_outputs))
+        return out[:, 0] if self.meta["single_output"] else out
+
+    def _predict_chunk(self, X):
+        """
+        Steps every (tree, row) pair down one level at a time, with no masks:
+        leaves point to themselves, and at each level only the prefix of
+        trees deeper than it is stepped at all.
+        """
+        n_rows = len(X)
+        if self.plain_splits:
+            # LightGBM reads NaN as 0 at splits whose missing type is None.
+            X = np.where(np.isnan(X), 0.0, X)
+        flat = X.ravel()
+        # Tree-major: the pairs of the first k trees are the first k * n_rows entries.
+        node = np.repeat(self.tree_root, n_rows)
+        row_offset = np.tile(np.arange(n_rows) * X.shape[1], len(self.tree_root))
+        for n_trees in self.level_trees:
+            size = n_trees * n_rows
+            active = node[:size]
+            x = flat[row_offset[:size] + self.feature[active]]
+            node[:size] = self.child[active] + self._go_right(active, x)
+        leaves = self.value[node].reshape(len(self.tree_root), n_rows)
+        return leaves.T @ self.output_matrix
+
+    def _native(self):
+        """ LightGBM boosters for the same trees, or [] where lightgbm is unavailable. """
+        if self._boosters is None:
+            try:
+                import lightgbm
+
+                self._boosters = [
+                    lightgbm.Booster(model_file=os.path.join(self.path, f"booster-{i}.txt"))
+                    for i in range(self.n_outputs)
+                ]
+            except Exception:
+                self._boosters = []
+        return self._boosters
+
+
+# --- 4. Loading ---
+
+def _record_load(name, seconds, source):
+    LOAD_STATS[name] = {"seconds": seconds, "source": source}
+    METRICS.record(f"model_load_{name}", seconds)
+
+
+def load_model(pkl_path, name=None):
+    """
+    Returns a model with .predict(). Uses the compiled cache for this pickle's
+    content hash, building it on first use; falls back to the pickle itself
+    if the model cannot be compiled.
+    """
+    name = name or os.path.splitext(os.path.basename(pkl_path))[0]
+    start = time.perf_counter()
+    cache_dir = os.path.join(
+        MODEL_CACHE_DIR, f"{name}-{file_digest(pkl_path)}-v{CACHE_FORMAT_VERSION}"
+    )
+
+    source = "compiled cache"
+    if not os.path.exists(os.path.join(cache_dir, "meta.json")):
+        try:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            compile_model(pkl_path, cache_dir)
+            source = "compiled now"
+        except Exception as e:
+            import joblib
+
+            print(f"Model cache unavailable for {pkl_path} ({e}); loading pickle.")
+            model = joblib.load(pkl_path)
+            # Same identity the compiled cache would have, so memoised predictions stay valid.
+            model.version = os.path.basename(cache_dir)
+            _record_load(name, time.perf_counter() - start, "pickle")
+            return model
+
+    model = CompiledEnsemble(cache_dir)
+    _record_load(name, time.perf_counter() - start, source)
+    return model
+
+
+def print_startup_profile(import_seconds):
+    """ Breaks process startup down into module imports and model loading. """
+    load_seconds = sum(stat["seconds"] for stat in LOAD_STATS.values())
+    heavy = [m for m in ("pandas", "joblib", "sklearn", "lightgbm") if m in sys.modules]
+    print("--- Startup profile ---")
+    print(f"Module imports:  {import_seconds:.3f} s")
+    for name, stat in LOAD_STATS.items():
+        print(f"Model '{name}':  {stat['seconds']:.3f} s ({stat['source']})")
+    print(f"Total startup:   {import_seconds + load_seconds:.3f} s")
+    print(f"Heavy libraries imported: {', '.join(heavy) or 'none'}")
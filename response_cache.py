@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- 1. Configuration ---
+CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", os.path.join(".cache", "responses.sqlite"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+# How long a response is served without refetching. Open-Meteo `current`
+# data updates every 15 minutes, OpenWeather air pollution roughly hourly.
+PROVIDER_TTLS = {
+    "open_meteo": 15 * 60,
+    "openweather": 60 * 60,
+}
+
+# Oldest entry we are still willing to serve when the upstream call fails.
+STALE_MAX_AGE = 24 * 60 * 60
+
+# Coordinates are rounded so nearby requests for the same point share an entry.
+COORD_PRECISION = 4
+
+# Request parameters that identify the location or the caller, not the data.
+_UNKEYED_PARAMS = {"lat", "lon", "latitude", "longitude", "appid"}
+
+
+# --- 2. Cache ---
+
+class ResponseCache:
+    """ Small on-disk TTL cache for upstream JSON payloads, with LRU eviction. """
+
+    def __init__(self, path=CACHE_FILE, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+        # Location key prefix -> shorter max age than the provider's TTL.
+        self.max_age_overrides = {}
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, provider TEXT, payload TEXT,"
+                " stored_at REAL, accessed_at REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+        return self.conn
+
+    @staticmethod
+    def _location(provider, lat, lon):
+        return f"{provider}:{round(lat, COORD_PRECISION)}:{round(lon, COORD_PRECISION)}"
+
+    @classmethod
+    def make_key(cls, provider, lat, lon, params):
+        keyed = {k: v for k, v in params.items() if k not in _UNKEYED_PARAMS}
+        digest = hashlib.sha1(json.dumps(keyed, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{cls._location(provider, lat, lon)}:{digest}"
+
+    def set_max_age(self, provider, lat, lon, seconds):
+        """ Serves this provider's responses for one point for at most `seconds` (if under its TTL). """
+        self.max_age_overrides[self._location(provider, lat, lon)] = seconds
+
+    def _lookup(self, key, max_age):
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT payload, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > max_age:
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return json.loads(row[0])
+
+    def get(self, provider, key):
+        """ Returns the cached payload if it is within the provider's TTL, else None. """
+        max_age = PROVIDER_TTLS[provider]
+        override = self.max_age_overrides.get(key.rsplit(":", 1)[0])
+        if override is not None:
+            max_age = min(max_age, override)
+        payload = self._lookup(key, max_age)
+        # fetch_all calls in from many threads; += on a shared dict is not atomic.
+        with self.lock:
+            self.stats["hits" if payload is not None else "misses"] += 1
+        return payload
+
+    def get_stale(self, key):
+        """ Returns an expired payload (up to STALE_MAX_AGE old) for use when upstream fails. """
+        payload = self._lookup(key, STALE_MAX_AGE)
+        if payload is not None:
+            with self.lock:
+                self.stats["stale"] += 1
+        return payload
+
+    def put(self, provider, key, payload):
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, provider, json.dumps(payload), now, now),
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def summary(self):
+        return (f"Cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+                f"{self.stats['stale']} served stale")
+
+
+CACHE = ResponseCache()
@@ -0,0 +1,352 @@
+"""
+Backtest / historical reprocessing for model_hourly.pkl and model_daily.pkl.
+
+Replays archived hourly observations (CSV or Parquet, one row per station
+and hour) through the same features the live scripts build, predicts every
+hour of every station across a process pool, and writes the forecasts in a
+long, horizon-aligned columnar layout (one row per issue time x horizon,
+with its target time) so they can be joined straight onto observations.
+
+    python run_backtest.py --input archive.parquet --output backtest/
+
+Input columns: station_id, datetime, pm2_5, pm10, co, no2, o3, so2, nh3 and,
+optionally, temperature, humidity, wind_speed, precipitation, pressure.
+Finished chunks are recorded in <output>/checkpoint.json; re-running the
+same command resumes where an interrupted run stopped.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from aqi_index import POLLUTANTS, compute_aqi
+from feature_matrix import build_feature_matrix_from_columns, validate_feature_order
+from model_cache import file_digest, load_model
+from station_state import LONG_WINDOW, SHORT_WINDOW
+
+# --- 1. Configuration ---
+MODEL_HOURLY_FILE = "model_hourly.pkl"
+MODEL_DAILY_FILE = "model_daily.pkl"
+BACKTEST_OUTPUT_DIR = "backtest"
+CHECKPOINT_FILE = "checkpoint.json"
+
+DEFAULT_CHUNK_ROWS = 50_000   # station-hours per worker task
+HOURLY_HORIZONS = [1, 2, 3, 6, 12, 18, 24]
+DAILY_HORIZONS = [1, 2, 3, 4, 5, 6, 7]
+
+WEATHER_COLUMNS = ["temperature", "humidity", "wind_speed", "precipitation", "pressure"]
+REQUIRED_COLUMNS = ["station_id", "datetime"] + POLLUTANTS
+
+
+# --- 2. Input & Features ---
+
+def parquet_available():
+    return any(importlib.util.find_spec(m) for m in ("pyarrow", "fastparquet"))
+
+
+def load_observations(path, start=None, end=None):
+    """ Reads a CSV or Parquet archive, sorted by station and time, one row per station-hour. """
+    if path.endswith((".parquet", ".pq")):
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_csv(path)
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"{path} is missing required columns: {', '.join(missing)}")
+    absent = [c for c in WEATHER_COLUMNS if c not in frame.columns]
+    if absent:
+        print(f"No {', '.join(absent)} column(s) in {path}; those features will be 0.")
+
+    frame["station_id"] = frame["station_id"].astype(str)
+    frame["datetime"] = pd.to_datetime(frame["datetime"])
+    if frame["datetime"].dt.tz is not None:
+        # Live runs see naive local wall-clock times; match that.
+        frame["datetime"] = frame["datetime"].dt.tz_localize(None)
+    if start:
+        frame = frame[frame["datetime"] >= pd.Timestamp(start)]
+    if end:
+        frame = frame[frame["datetime"] < pd.Timestamp(end)]
+
+    # Same rule as StationState: the last reading for an hour wins.
+    frame["hour_index"] = frame["datetime"].values.astype("datetime64[h]").astype(np.int64)
+    frame = frame.sort_values(["station_id", "hour_index"], kind="stable")
+    frame = frame.drop_duplicates(["station_id", "hour_index"], keep="last")
+    return frame.reset_index(drop=True)
+
+
+def history_features(hours, aqi):
+    """
+    Lags and trailing means for one station's sorted, unique epoch hours,
+    computed for every hour at once with a dense hourly grid and cumulative
+    sums. Gives the same values StationState.features() would after
+    replaying the series hour by hour, in HISTORY_FEATURES order.
+    """
+    offset = hours - hours[0]
+    dense = np.full(offset[-1] + 1, np.nan)
+    dense[offset] = aqi
+
+    columns = []
+    for lag in (24, 48, 168):
+        idx = offset - lag
+        columns.append(np.where(idx >= 0, dense[np.maximum(idx, 0)], np.nan))
+
+    present = ~np.isnan(dense)
+    csum = np.concatenate([[0.0], np.cumsum(np.where(present, dense, 0.0))])
+    ccount = np.concatenate([[0], np.cumsum(present)])
+    for size in (SHORT_WINDOW, LONG_WINDOW):
+        lo, hi = np.maximum(offset - size + 1, 0), offset + 1
+        counts = ccount[hi] - ccount[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns.append(np.where(counts > 0, (csum[hi] - csum[lo]) / counts, np.nan))
+
+    history = np.column_stack(columns)
+    return np.where(np.isnan(history), aqi[:, None], history)
+
+
+def build_features(frame):
+    """ Adds calculated_aqi, calendar and history feature columns to a block of stations. """
+    aqi, _, _ = compute_aqi({p: frame[p].to_numpy(dtype=float) for p in POLLUTANTS})
+    frame = frame.assign(calculated_aqi=aqi)
+
+    dt = frame["datetime"].dt
+    frame = frame.assign(
+        hour=dt.hour,
+        dayofweek=dt.dayofweek,
+        month=dt.month,
+        dayofyear=dt.dayofyear,
+        weekofyear=dt.isocalendar().week.astype(int).to_numpy(),
+    )
+
+    history = np.empty((len(frame), 5))
+    hours = frame["hour_index"].to_numpy()
+    bounds = np.flatnonzero(frame["station_id"].to_numpy()[1:] != frame["station_id"].to_numpy()[:-1]) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(frame)]):
+        history[lo:hi] = history_features(hours[lo:hi], aqi[lo:hi])
+    return frame.assign(
+        aqi_lag_24hr=history[:, 0], aqi_lag_48hr=history[:, 1], aqi_lag_168hr=history[:, 2],
+        aqi_roll_avg_24hr=history[:, 3], aqi_roll_avg_168hr=history[:, 4],
+    )
+
+
+# --- 3. Chunk Planning & Checkpoints ---
+
+def plan_chunks(frame, chunk_rows):
+    """
+    Groups whole stations into blocks of about chunk_rows rows (history
+    features need a station's full series), then splits each block into
+    chunks of at most chunk_rows. Returns [(block_rows, [chunk row slices])].
+    Deterministic for a given input, so chunk ids are stable across resumes.
+    """
+    sizes = frame.groupby("station_id", sort=False).size().to_numpy()
+    blocks, lo, hi = [], 0, 0
+    for size in sizes:
+        hi += size
+        if hi - lo >= chunk_rows:
+            blocks.append((lo, hi))
+            lo = hi
+    if hi > lo:
+        blocks.append((lo, hi))
+    return [
+        ((lo, hi), [(s, min(s + chunk_rows, hi)) for s in range(lo, hi, chunk_rows)])
+        for lo, hi in blocks
+    ]
+
+
+def run_fingerprint(input_path, chunk_rows, start, end, fmt):
+    stat = os.stat(input_path)
+    return {
+        "input": os.path.abspath(input_path),
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "chunk_rows": chunk_rows,
+        "start": start,
+        "end": end,
+        "format": fmt,
+        "models": {name: file_digest(name) for name in (MODEL_HOURLY_FILE, MODEL_DAILY_FILE)},
+    }
+
+
+def load_checkpoint(output_dir, fingerprint, restart):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if restart or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("fingerprint") != fingerprint:
+        raise SystemExit(
+            f"{path} belongs to a different input, model or chunk size; "
+            "use --restart to discard it or choose another --output."
+        )
+    return set(checkpoint["completed"])
+
+
+def save_checkpoint(output_dir, fingerprint, completed):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint, "completed": sorted(completed)}, f)
+    os.replace(path + ".tmp", path)
+
+
+# --- 4. Workers ---
+
+_MODELS = {}
+
+
+def _init_worker():
+    # Compiled models are memory-mapped, so every worker shares the same pages.
+    _MODELS["hourly"] = load_model(MODEL_HOURLY_FILE, "hourly")
+    _MODELS["daily"] = load_model(MODEL_DAILY_FILE, "daily")
+
+
+def horizon_columns(station_ids, hour_index, current_aqi, hourly, daily):
+    """ Long layout: one row per (issue hour, horizon), hourly horizons then daily. """
+    n = len(hour_index)
+    n_h, n_d = len(HOURLY_HORIZONS), len(DAILY_HORIZONS)
+    issued = hour_index.astype("datetime64[h]")
+    issue_day = issued.astype("datetime64[D]")
+
+    targets = np.concatenate([
+        issued[:, None] + np.array(HOURLY_HORIZONS, dtype="timedelta64[h]"),
+        (issue_day[:, None] + np.array(DAILY_HORIZONS, dtype="timedelta64[D]")).astype("datetime64[h]"),
+    ], axis=1)
+    width = n_h + n_d
+    return {
+        "station_id": np.repeat(station_ids, width),
+        "issued_at": np.repeat(issued, width).astype("datetime64[ns]"),
+        "kind": np.tile(np.array(["hourly"] * n_h + ["daily"] * n_d), n),
+        "horizon": np.tile(np.array(HOURLY_HORIZONS + DAILY_HORIZONS, dtype=np.int16), n),
+        "target_time": targets.ravel().astype("datetime64[ns]"),
+        "predicted_aqi": np.concatenate([hourly, daily], axis=1).ravel().astype(np.float32),
+        "current_aqi": np.repeat(current_aqi, width).astype(np.float32),
+    }
+
+
+def write_part(path, columns, fmt):
+    tmp_path = f"{path}.tmp"
+    if fmt == "parquet":
+        pd.DataFrame(columns).to_parquet(tmp_path, index=False)
+    else:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **{k: v.astype(str) if v.dtype == object else v for k, v in columns.items()})
+    os.replace(tmp_path, path)
+
+
+def predict_chunk(chunk_id, matrix, station_ids, hour_index, current_aqi, output_dir, fmt):
+    """ Worker task: predicts one chunk with both models and writes its part file. """
+    hourly = _MODELS["hourly"].predict(matrix)
+    daily = _MODELS["daily"].predict(matrix)
+    columns = horizon_columns(station_ids, hour_index, current_aqi, hourly, daily)
+    suffix = "parquet" if fmt == "parquet" else "npz"
+    write_part(os.path.join(output_dir, f"part-{chunk_id:05d}.{suffix}"), columns, fmt)
+    return chunk_id, len(matrix)
+
+
+# --- 5. Driver ---
+
+def iter_chunk_tasks(frame, plan, completed):
+    """ Builds feature matrices one station block at a time and yields the chunks still to do. """
+    chunk_id = 0
+    for (lo, hi), slices in plan:
+        todo = [chunk_id + k for k in range(len(slices)) if chunk_id + k not in completed]
+        if todo:
+            block = build_features(frame.iloc[lo:hi])
+            matrix = build_feature_matrix_from_columns(block, hi - lo)
+            for k, (s, e) in enumerate(slices):
+                if chunk_id + k in completed:
+                    continue
+                rows = slice(s - lo, e - lo)
+                yield (chunk_id + k, matrix[rows],
+                       block["station_id"].to_numpy()[rows],
+                       block["hour_index"].to_numpy()[rows],
+                       block["calculated_aqi"].to_numpy()[rows])
+        chunk_id += len(slices)
+
+
+def run_backtest(input_path, output_dir=BACKTEST_OUTPUT_DIR, chunk_rows=DEFAULT_CHUNK_ROWS,
+                 workers=None, fmt=None, start=None, end=None, restart=False):
+    fmt = fmt or ("parquet" if parquet_available() else "npz")
+    if fmt == "parquet" and not parquet_available():
+        raise SystemExit("Parquet output needs pyarrow or fastparquet; use --format npz.")
+    workers = workers or os.cpu_count() or 1
+
+    # Compile (or validate) the model cache once before workers memory-map it.
+    for name, path in (("hourly", MODEL_HOURLY_FILE), ("daily", MODEL_DAILY_FILE)):
+        validate_feature_order(load_model(path, name), name)
+
+    os.makedirs(output_dir, exist_ok=True)
+    fingerprint = run_fingerprint(input_path, chunk_rows, start, end, fmt)
+    completed = load_checkpoint(output_dir, fingerprint, restart)
+
+    frame = load_observations(input_path, start, end)
+    plan = plan_chunks(frame, chunk_rows)
+    sizes = [e - s for _, slices in plan for s, e in slices]
+    total_rows, total_chunks = sum(sizes), len(sizes)
+    done_rows = sum(sizes[i] for i in completed if i < total_chunks)
+    if completed:
+        print(f"Resuming: {len(completed)}/{total_chunks} chunks already done.")
+    print(f"Backtesting {total_rows:,} station-hours from {frame['station_id'].nunique()} stations "
+          f"in {total_chunks} chunks on {workers} worker(s)...")
+
+    started = time.perf_counter()
+    new_rows = 0
+    tasks = iter_chunk_tasks(frame, plan, completed)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(predict_chunk, *task, output_dir, fmt))
+            # Keep only a couple of chunks per worker in flight to bound memory.
+            if len(pending) < 2 * workers:
+                continue
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                new_rows += _record(future, completed, output_dir, fingerprint)
+            _report(len(completed), total_chunks, done_rows + new_rows, total_rows, new_rows, started)
+        for future in list(pending):
+            new_rows += _record(future, completed, output_dir, fingerprint)
+            _report(len(completed), total_chunks, done_rows + new_rows, total_rows, new_rows, started)
+
+    elapsed = time.perf_counter() - started
+    rate = new_rows / elapsed * 60 if elapsed else 0
+    print(f"Backtest complete: {new_rows:,} station-hours in {elapsed:.1f}s ({rate:,.0f}/min). "
+          f"Output in {output_dir}/")
+
+
+def _record(future, completed, output_dir, fingerprint):
+    chunk_id, rows = future.result()
+    completed.add(chunk_id)
+    save_checkpoint(output_dir, fingerprint, completed)
+    return rows
+
+
+def _report(done_chunks, total_chunks, done_rows, total_rows, new_rows, started):
+    elapsed = time.perf_counter() - started
+    rate = new_rows / elapsed * 60 if elapsed else 0
+    eta = (total_rows - done_rows) / (rate / 60) if rate else 0
+    print(f"[{done_chunks}/{total_chunks}] {done_rows:,}/{total_rows:,} station-hours, "
+          f"{rate:,.0f}/min, ETA {eta:.0f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay archived observations through the forecast models.")
+    parser.add_argument("--input", required=True, help="CSV or Parquet archive of hourly observations")
+    parser.add_argument("--output", default=BACKTEST_OUTPUT_DIR, help="Directory for part files and checkpoint")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--format", choices=["parquet", "npz"],
+                        help="Part file format (default: parquet if pyarrow is installed, else npz)")
+    parser.add_argument("--start", help="Only replay observations at or after this time")
+    parser.add_argument("--end", help="Only replay observations before this time")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+    run_backtest(args.input, args.output, args.chunk_rows, args.workers, args.format,
+                 args.start, args.end, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
-import pandas as pd
-import joblib
-import requests
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import argparse
 import json
 from datetime import datetime, timedelta, UTC
 import warnings
-import numpy as np
 import os
 import random  # Import random for micro-climate simulation
-import time    # Import time for delays
+
+from aqi_index import POLLUTANTS, compute_aqi
+from feature_matrix import build_feature_matrix, validate_feature_order
+from fetch_engine import fetch_all, fetch_json, fetch_open_meteo_bulk, start_deadline
+from forecast_output import degraded_record, fresh_records, output_lock, write_station_outputs
+from forecast_verification import verify_forecasts
+from model_cache import load_model, print_startup_profile
+from prediction_memo import PredictionMemo
+from response_cache import CACHE
+from run_metrics import METRICS
+from station_registry import load_stations, plan_fetches
+from station_state import StationState
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 # --- 1. Configuration ---
 warnings.filterwarnings('ignore')
@@ -19,36 +32,23 @@ MODEL_DAILY_FILE = 'model_daily.pkl'
 # --- UPDATED: Specific Local Path ---
 FORECAST_OUTPUT_FILE = 'all_forecasts.json'
 
-# --- Station Configuration (Bengaluru) ---
-STATIONS = {
-    "peenya": {"lat": 13.0270, "lon": 77.4940, "name": "Peenya"},
-    "btm_layout": {"lat": 12.9128, "lon": 77.6092, "name": "BTM Layout"},
-    "bwssb": {"lat": 12.9389, "lon": 77.6974, "name": "BWSSB Kadabesanahalli"},
-    "city_railway": {"lat": 12.9772, "lon": 77.5713, "name": "City Railway Station"},
-    "saneguruvanahalli": {"lat": 12.9918, "lon": 77.5458, "name": "Saneguruvanahalli"},
-    "hebbal": {"lat": 13.0305, "lon": 77.5925, "name": "Hebbal"},
-    "silk_board": {"lat": 12.9176, "lon": 77.6235, "name": "Silk Board"},
-    "jayanagar": {"lat": 12.9209, "lon": 77.5849, "name": "Jayanagar"},
-    "hombegowda": {"lat": 12.9366, "lon": 77.5927, "name": "Hombegowda Nagar"},
-    "mysore_road": {"lat": 12.9567, "lon": 77.5262, "name": "Mysore Road"}
-}
+# --- Station Configuration ---
+# Loaded from stations.csv (or STATIONS_FILE, CSV or GeoJSON)
+STATIONS = load_stations()
 
 # --- API URLs ---
-WEATHER_API_URL = "https://api.open-meteo.com/v1/forecast"
-OPENWEATHER_AQI_URL = "http://api.openweathermap.org/data/2.5/air_pollution"
+# (overridable so benchmarks can point at local stand-in servers)
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+OPENWEATHER_AQI_URL = os.getenv("OPENWEATHER_AQI_URL", "http://api.openweathermap.org/data/2.5/air_pollution")
+
+WEATHER_PARAMS = {
+    'current': 'temperature_2m,relative_humidity_2m,precipitation,pressure_msl,wind_speed_10m,visibility',
+    'timezone': 'auto'
+}
 
 # --- API Key ---
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 
-# --- Feature List ---
-FEATURES_LIST = [
-    'co', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3',
-    'calculated_aqi', 'temperature', 'humidity', 'wind_speed',
-    'precipitation', 'pressure', 'hour', 'dayofweek', 'month',
-    'dayofyear', 'weekofyear', 'aqi_lag_24hr', 'aqi_lag_48hr',
-    'aqi_lag_168hr', 'aqi_roll_avg_24hr', 'aqi_roll_avg_168hr'
-]
-
 LONG_HISTORY_FEATURES = ['aqi_lag_168hr', 'aqi_roll_avg_168hr']
 SHORT_HISTORY_FEATURES = ['aqi_lag_24hr', 'aqi_lag_48hr', 'aqi_roll_avg_24hr']
 
@@ -59,36 +59,58 @@ def load_models():
     print("Loading models...")
     try:
         models = {
-            'hourly': joblib.load(MODEL_HOURLY_FILE),
-            'daily': joblib.load(MODEL_DAILY_FILE)
+            'hourly': load_model(MODEL_HOURLY_FILE, 'hourly'),
+            'daily': load_model(MODEL_DAILY_FILE, 'daily')
         }
+        for name, model in models.items():
+            validate_feature_order(model, name)
         return models
     except FileNotFoundError:
         print(f"Error: Model files not found.")
         return None
 
-def fetch_current_weather_and_aqi(lat, lon):
+def fetch_weather_for_stations(stations):
+    """ Current weather for every station via bulk multi-location Open-Meteo calls. """
+    coords = [(info['lat'], info['lon']) for info in stations.values()]
+    return dict(zip(stations, fetch_open_meteo_bulk(WEATHER_API_URL, coords, WEATHER_PARAMS)))
+
+def fetch_aqi_components(lat, lon):
+    """ OpenWeather air-pollution components at one point. """
+    aqi_params = {'lat': lat, 'lon': lon, 'appid': OPENWEATHER_API_KEY}
+    aqi_list = fetch_json('openweather', OPENWEATHER_AQI_URL, aqi_params, lat, lon).get('list', [])
+    if not aqi_list: raise ValueError("Empty AQI list")
+    return aqi_list[0].get('components', {})
+
+def fetch_aqi_for_stations(stations):
+    """ One air-pollution request per upstream grid cell, shared by every station in it. """
+    plan = plan_fetches(stations)
+
+    def fetch_cell(key, cell):
+        try:
+            return fetch_aqi_components(cell['lat'], cell['lon'])
+        except Exception as e:
+            print(f"Error fetching AQI for {', '.join(cell['stations'])}: {e}")
+            return None
+
+    by_cell = fetch_all(plan, fetch_cell)
+    return {sid: by_cell[key] for key, cell in plan.items() for sid in cell['stations']}
+
+def fetch_current_weather_and_aqi(lat, lon, weather=None, pollutants=None):
     """ Fetches data and applies micro-climate variation to ensure uniqueness. """
     current_data = {}
 
-    # --- Fetch Weather ---
+    # --- Fetch Weather (skipped when the bulk call already covered this point) ---
     try:
-        weather_params = {
-            'latitude': lat,
-            'longitude': lon,
-            'current': 'temperature_2m,relative_humidity_2m,precipitation,pressure_msl,wind_speed_10m,visibility',
-            'timezone': 'auto'
-        }
-        r_weather = requests.get(WEATHER_API_URL, params=weather_params)
-        r_weather.raise_for_status()
-        weather = r_weather.json()['current']
+        if weather is None:
+            weather_params = {'latitude': lat, 'longitude': lon, **WEATHER_PARAMS}
+            weather = fetch_json('open_meteo', WEATHER_API_URL, weather_params, lat, lon)['current']
         current_data['temperature'] = weather.get('temperature_2m', 0)
         current_data['humidity'] = weather.get('relative_humidity_2m', 0)
         current_data['precipitation'] = weather.get('precipitation', 0)
         current_data['pressure'] = weather.get('pressure_msl', 0)
         current_data['wind_speed'] = weather.get('wind_speed_10m', 0)
         current_data['visibility'] = weather.get('visibility', 0)
-        current_data['datetime'] = pd.to_datetime(weather.get('time'))
+        current_data['datetime'] = datetime.fromisoformat(weather['time']) if weather.get('time') else None
     except Exception as e:
         print(f"Error fetching weather: {e}")
         return None
@@ -96,18 +118,12 @@ def fetch_current_weather_and_aqi(lat, lon):
     # --- Fetch AQI ---
     if not OPENWEATHER_API_KEY:
         print("Error: OPENWEATHER_API_KEY not set.")
-        for p in ['pm2_5', 'pm10', 'co', 'no2', 'o3', 'so2', 'nh3']:
-             current_data[p] = 0
-        return current_data
+        return None
 
     try:
-        aqi_params = {'lat': lat, 'lon': lon, 'appid': OPENWEATHER_API_KEY}
-        r_aqi = requests.get(OPENWEATHER_AQI_URL, params=aqi_params)
-        r_aqi.raise_for_status()
-        aqi_list = r_aqi.json().get('list', [])
-        if not aqi_list: raise ValueError("Empty AQI list")
-        
-        pollutants = aqi_list[0].get('components', {})
+        # Skipped when the station's grid cell was already fetched
+        if pollutants is None:
+            pollutants = fetch_aqi_components(lat, lon)
         
         # --- NEW: Apply Micro-Climate Variation ---
         # APIs return grid averages. We add ±10% variation to simulate local conditions
@@ -119,53 +135,27 @@ def fetch_current_weather_and_aqi(lat, lon):
             current_data[p] = base_value * variation
 
     except Exception as e:
+        # No zeros: the station is published as degraded instead
         print(f"Error fetching AQI: {e}")
-        for p in ['pm2_5', 'pm10', 'co', 'no2', 'o3', 'so2', 'nh3']:
-             current_data[p] = 0
-             
+        return None
+
     return current_data
 
-def calculate_indian_aqi_subindex(Cp, pollutant):
+def create_feature_vector(current_data, state=None, station_id=None):
     """
-    Calculates the AQI sub-index. 
-    FIXED: Uses continuous ranges to prevent values like 30.17 falling into gaps.
+    Creates the feature vector. When a StationState is given, the current AQI
+    is recorded in it and the lag/rolling features come from real history.
     """
-    breakpoints = {
-        'pm2_5': [((0, 30), (0, 50)), ((30, 60), (51, 100)), ((60, 90), (101, 200)), ((90, 120), (201, 300)), ((120, 250), (301, 400)), ((250, float('inf')), (401, 500))],
-        'pm10': [((0, 50), (0, 50)), ((50, 100), (51, 100)), ((100, 250), (101, 200)), ((250, 350), (201, 300)), ((350, 430), (301, 400)), ((430, float('inf')), (401, 500))],
-        'o3': [((0, 50), (0, 50)), ((50, 100), (51, 100)), ((100, 168), (101, 200)), ((168, 208), (201, 300)), ((208, 748), (301, 400)), ((748, float('inf')), (401, 500))],
-        'co': [((0.0, 1.0), (0, 50)), ((1.0, 2.0), (51, 100)), ((2.0, 10.0), (101, 200)), ((10.0, 17.0), (201, 300)), ((17.0, 34.0), (301, 400)), ((34.0, float('inf')), (401, 500))],
-        'so2': [((0, 40), (0, 50)), ((40, 80), (51, 100)), ((80, 380), (101, 200)), ((380, 800), (201, 300)), ((800, 1600), (301, 400)), ((1600, float('inf')), (401, 500))],
-        'no2': [((0, 40), (0, 50)), ((40, 80), (51, 100)), ((80, 180), (101, 200)), ((180, 280), (201, 300)), ((280, 400), (301, 400)), ((400, float('inf')), (401, 500))],
-        'nh3': [((0, 200), (0, 50)), ((200, 400), (51, 100)), ((400, 800), (101, 200)), ((800, 1200), (201, 300)), ((1200, 1800), (301, 400)), ((1800, float('inf')), (401, 500))]
-    }
-    
-    Cp_lookup = Cp
-    if pollutant == 'co': Cp_lookup = Cp / 1000.0 # Convert to mg/m3
-    if pd.isna(Cp_lookup) or Cp_lookup < 0: Cp_lookup = 0
-
-    for (BP_LO, BP_HI), (I_LO, I_HI) in breakpoints.get(pollutant, []):
-        if BP_LO <= Cp_lookup <= BP_HI: 
-            return ((I_HI - I_LO) / (BP_HI - BP_LO)) * (Cp_lookup - BP_LO) + I_LO
-            
-    if Cp_lookup > 0: return 500
-    return 0
-
-def create_feature_vector(current_data):
-    """ Creates the feature vector. """
     if current_data is None or 'datetime' not in current_data: return None
-    pollutants = ['pm2_5', 'pm10', 'co', 'no2', 'o3', 'so2', 'nh3']
-    
-    sub_indices = {}
-    pollutant_details = {}
-    for p in pollutants:
-        raw_value = current_data.get(p, 0)
-        sub_index = calculate_indian_aqi_subindex(raw_value, p)
-        sub_indices[p] = sub_index
-        pollutant_details[p] = {'value': raw_value, 'sub_index': sub_index}
-    
-    current_aqi = max(sub_indices.values()) if sub_indices else 0
-    primary_pollutant = max(sub_indices, key=sub_indices.get) if sub_indices else 'N/A'
+    raw_values = {p: current_data.get(p, 0) for p in POLLUTANTS}
+    aqi, primary, sub_indices = compute_aqi(raw_values)
+
+    pollutant_details = {
+        p: {'value': raw_values[p], 'sub_index': float(sub_indices[0, i])}
+        for i, p in enumerate(POLLUTANTS)
+    }
+    current_aqi = float(aqi[0])
+    primary_pollutant = str(primary[0])
     
     current_data['calculated_aqi'] = current_aqi
     current_data['primary_pollutant'] = primary_pollutant
@@ -173,13 +163,12 @@ def create_feature_vector(current_data):
     
     dt = current_data['datetime']
     # Time features
-    if isinstance(dt, pd.Timestamp):
+    if isinstance(dt, datetime):
         current_data['hour'] = dt.hour
-        current_data['dayofweek'] = dt.dayofweek
+        current_data['dayofweek'] = dt.weekday()
         current_data['month'] = dt.month
-        current_data['dayofyear'] = dt.dayofyear
-        weekofyear = dt.isocalendar().week
-        current_data['weekofyear'] = int(weekofyear) if pd.notna(weekofyear) else 0
+        current_data['dayofyear'] = dt.timetuple().tm_yday
+        current_data['weekofyear'] = dt.isocalendar().week
     else:
          current_data['hour'] = 0
          current_data['dayofweek'] = 0
@@ -187,20 +176,16 @@ def create_feature_vector(current_data):
          current_data['dayofyear'] = 1
          current_data['weekofyear'] = 1
 
-    # Fill history with current AQI
-    fill_value = current_aqi
+    # History features: real lags/rolling means where the station's ring buffer
+    # has them, otherwise filled with the current AQI
+    history = {}
+    if state is not None and isinstance(dt, datetime):
+        state.update(station_id, dt, current_aqi)
+        history = state.features(station_id, fallback=current_aqi)
     for feat in SHORT_HISTORY_FEATURES + LONG_HISTORY_FEATURES:
-        current_data[feat] = fill_value
+        current_data[feat] = history.get(feat, current_aqi)
 
-    feature_vector = pd.DataFrame(columns=FEATURES_LIST)
-    for col in FEATURES_LIST:
-        feature_vector.loc[0, col] = current_data.get(col, 0)
-
-    for col in feature_vector.columns:
-        feature_vector[col] = pd.to_numeric(feature_vector[col], errors='coerce')
-
-    feature_vector = feature_vector.fillna(0).astype(float)
-    return feature_vector[FEATURES_LIST]
+    return build_feature_matrix([current_data])
 
 
 def format_predictions(hourly_preds, daily_preds, current_data, lat, lon):
@@ -208,14 +193,14 @@ def format_predictions(hourly_preds, daily_preds, current_data, lat, lon):
     hourly_values = hourly_preds[0]
     daily_values = daily_preds[0]
     now_utc = datetime.now(UTC)
-    current_ts = current_data.get('datetime', pd.Timestamp.now(tz='UTC'))
+    current_ts = current_data.get('datetime') or datetime.now(UTC)
 
     hourly_targets = [1, 2, 3, 6, 12, 18, 24]
     hourly_forecast = [{'time': (current_ts + timedelta(hours=h)).isoformat(), 'hours_ahead': h, 'aqi': round(hourly_values[i], 2)} for i, h in enumerate(hourly_targets)]
     
     daily_targets = [1, 2, 3, 4, 5, 6, 7]
     daily_forecast = []
-    current_date = current_ts.date() if isinstance(current_ts, pd.Timestamp) else datetime.now(UTC).date()
+    current_date = current_ts.date()
     for i, d in enumerate(daily_targets):
          forecast_date = current_date + timedelta(days=d)
          daily_forecast.append({'date': forecast_date.strftime('%Y-%m-%d'), 'days_ahead': d, 'avg_aqi': round(daily_values[i], 2)})
@@ -243,8 +228,78 @@ def format_predictions(hourly_preds, daily_preds, current_data, lat, lon):
 
     return output_data
 
+def fetch_stations(stations):
+    """ Bulk weather plus one AQI fetch per upstream grid cell. Returns {station_id: data or None}. """
+    start_deadline()
+    weather = fetch_weather_for_stations(stations)
+    pollutants = fetch_aqi_for_stations(stations)
+    return fetch_all(
+        stations,
+        lambda sid, info: fetch_current_weather_and_aqi(info['lat'], info['lon'], weather[sid], pollutants[sid])
+        if pollutants[sid] is not None else None
+    )
+
+def build_station_forecast(station_id, station_info, current_data, models, state=None, memo=None):
+    """
+    Features, both model predictions and formatting for one fetched station.
+    With a memo, predictions for an unchanged feature row are reused.
+    """
+    with METRICS.span('feature_build', station_id):
+        feature_vector = create_feature_vector(current_data, state, station_id)
+    if feature_vector is None: return None
+
+    # Prediction (skipped when this exact feature row was already predicted)
+    key = memo.make_key(feature_vector, models) if memo is not None else None
+    cached = memo.get(key) if memo is not None else None
+    if cached:
+        hourly_preds, daily_preds = cached['hourly'], cached['daily']
+    else:
+        with METRICS.span('hourly_predict', station_id):
+            hourly_preds = models['hourly'].predict(feature_vector)
+        with METRICS.span('daily_predict', station_id):
+            daily_preds = models['daily'].predict(feature_vector)
+        if memo is not None:
+            memo.put(key, {'hourly': hourly_preds, 'daily': daily_preds})
+
+    # Formatting
+    with METRICS.span('format', station_id):
+        return format_predictions(hourly_preds, daily_preds, current_data,
+                                  station_info['lat'], station_info['lon'])
+
+def write_forecasts(all_stations_data):
+    with METRICS.span('write'):
+        # Per-station files + hash manifest; unchanged stations are not rewritten
+        changed = write_station_outputs(all_stations_data.items(), registry=STATIONS)
+        print(f"Per-station outputs: {len(changed)}/{len(all_stations_data)} stations changed")
+        if not changed and os.path.exists(FORECAST_OUTPUT_FILE):
+            return
+
+        # Ensure the directory exists
+        output_dir = os.path.dirname(FORECAST_OUTPUT_FILE)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        # Write to a temp file and swap it in: readers outside the lock never see a partial file
+        with output_lock():
+            with open(FORECAST_OUTPUT_FILE + '.tmp', 'w') as f:
+                json.dump(all_stations_data, f, indent=2)
+            os.replace(FORECAST_OUTPUT_FILE + '.tmp', FORECAST_OUTPUT_FILE)
+
+def write_run_metrics(n_stations, n_forecast):
+    """ Run-metrics JSON + Prometheus textfile (a no-op when RUN_METRICS=off). """
+    METRICS.incr('stations_total', n_stations)
+    METRICS.incr('stations_forecast', n_forecast)
+    METRICS.write({f'cache_{k}': v for k, v in CACHE.stats.items()})
+
 # --- 3. Main Execution ---
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast AQI for every configured station.")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Report module import time vs model load time")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
     run_start_time = datetime.now()
     print(f"--- Forecast run started at {run_start_time} ---")
     if not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY == "YOUR_OPENWEATHER_API_KEY":
@@ -254,6 +309,16 @@ def main():
     try:
         models = load_models()
         if models is None: exit(1)
+        if args.profile_startup:
+            print_startup_profile(IMPORT_SECONDS)
+
+        state = StationState.load()
+        memo = PredictionMemo.load()
+
+        # Fetch every station concurrently; the per-provider rate limiter
+        # in fetch_engine replaces the old fixed delay between stations.
+        print(f"Fetching data for {len(STATIONS)} stations...")
+        fetched = fetch_stations(STATIONS)
 
         # Dictionary to hold data for ALL stations
         all_stations_data = {}
@@ -262,40 +327,34 @@ def main():
         for station_id, station_info in STATIONS.items():
             print(f"\nProcessing Station: {station_info['name']}...")
             
-            # Add a small delay to prevent API rate limiting/caching
-            time.sleep(1.5)
-            
-            lat = station_info['lat']
-            lon = station_info['lon']
-            
-            current_data = fetch_current_weather_and_aqi(lat, lon)
+            current_data = fetched[station_id]
             if current_data is None: 
-                print(f"Skipping {station_info['name']} (Data fetch error)")
+                # Flag the station rather than publishing a made-up AQI
+                print(f"{station_info['name']} degraded (Data fetch error)")
+                all_stations_data[station_id] = degraded_record(
+                    station_id, station_info['lat'], station_info['lon'], 'upstream data unavailable')
                 continue
 
-            feature_vector = create_feature_vector(current_data)
-            if feature_vector is None: continue
-
-            # Prediction
-            hourly_preds = models['hourly'].predict(feature_vector)
-            daily_preds = models['daily'].predict(feature_vector)
-            
-            # Formatting
-            station_output = format_predictions(hourly_preds, daily_preds, current_data, lat, lon)
+            station_output = build_station_forecast(station_id, station_info, current_data, models, state, memo)
+            if station_output is None: continue
             
             # Add to the master dictionary
             all_stations_data[station_id] = station_output
 
         print(f"\nSaving combined predictions to '{FORECAST_OUTPUT_FILE}'...")
-        
-        # Ensure the directory exists
-        output_dir = os.path.dirname(FORECAST_OUTPUT_FILE)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # Write to file
-        with open(FORECAST_OUTPUT_FILE, 'w') as f: 
-            json.dump(all_stations_data, f, indent=2)
+        write_forecasts(all_stations_data)
+
+        # Score earlier forecasts that this run's observations have matured
+        fresh = fresh_records(all_stations_data)
+        with METRICS.span('verification'):
+            verifier = verify_forecasts(fresh)
+        print(f"Verification: {verifier.stats['verified']} forecasts scored, {verifier.stats['expired']} expired")
+
+        state.save()
+        memo.save()
+        print(CACHE.summary())
+        print(memo.summary(len(fresh)))
+        write_run_metrics(len(STATIONS), len(fresh))
 
         run_end_time = datetime.now()
         print(f"\n--- Forecast run COMPLETE (Duration: {run_end_time - run_start_time}) ---")
@@ -0,0 +1,147 @@
+import argparse
+import json
+from datetime import datetime, UTC
+
+import numpy as np
+
+from aqi_index import POLLUTANTS, compute_aqi
+from feature_matrix import FEATURE_INDEX
+from run_forecast_openweather import (
+    OPENWEATHER_API_KEY,
+    STATIONS,
+    create_feature_vector,
+    fetch_stations,
+    load_models,
+)
+
+# --- 1. Configuration ---
+GRID_OUTPUT_FILE = 'grid_forecast.json'
+DEFAULT_RESOLUTION = 0.01      # degrees (~1.1 km)
+DEFAULT_CHUNK_SIZE = 4096      # rows per predict() call
+BBOX_PADDING = 0.03            # degrees added around the stations by default
+IDW_POWER = 2
+
+HOURLY_HORIZONS = [1, 2, 3, 6, 12, 18, 24]
+DAILY_HORIZONS = [1, 2, 3, 4, 5, 6, 7]
+
+# Features that are the same for every cell (taken from the first station)
+# rather than spatially interpolated.
+TIME_FEATURES = ['hour', 'dayofweek', 'month', 'dayofyear', 'weekofyear']
+
+
+# --- 2. Grid Helpers ---
+
+def default_bbox(stations):
+    lats = [s['lat'] for s in stations.values()]
+    lons = [s['lon'] for s in stations.values()]
+    return (min(lats) - BBOX_PADDING, min(lons) - BBOX_PADDING,
+            max(lats) + BBOX_PADDING, max(lons) + BBOX_PADDING)
+
+
+def build_grid(bbox, resolution):
+    """ Returns the latitude and longitude axes of a regular grid covering bbox. """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lats = np.arange(min_lat, max_lat + resolution / 2, resolution)
+    lons = np.arange(min_lon, max_lon + resolution / 2, resolution)
+    return lats, lons
+
+
+def interpolate_features(station_coords, station_features, grid_lats, grid_lons):
+    """
+    Inverse-distance-weighted interpolation of the station feature rows onto
+    every grid cell in one vectorised pass. Returns an (n_cells, n_features) matrix.
+    """
+    cell_lat, cell_lon = np.meshgrid(grid_lats, grid_lons, indexing='ij')
+    cells = np.column_stack([cell_lat.ravel(), cell_lon.ravel()])
+
+    # Equirectangular distance is plenty at city scale.
+    dlat = cells[:, None, 0] - station_coords[None, :, 0]
+    dlon = (cells[:, None, 1] - station_coords[None, :, 1]) * np.cos(np.radians(cells[:, None, 0]))
+    dist = np.hypot(dlat, dlon)
+
+    weights = 1.0 / np.maximum(dist, 1e-9) ** IDW_POWER
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights @ station_features
+
+
+def predict_in_chunks(model, features, chunk_size):
+    """ Runs model.predict once per chunk of rows instead of once per point. """
+    outputs = []
+    for start in range(0, len(features), chunk_size):
+        outputs.append(model.predict(features[start:start + chunk_size]))
+    return np.vstack(outputs)
+
+
+def to_grids(predictions, shape, horizons):
+    """ Splits an (n_cells, n_horizons) prediction matrix into one 2-D grid per horizon. """
+    return {
+        str(h): np.round(predictions[:, i].reshape(shape), 1).tolist()
+        for i, h in enumerate(horizons)
+    }
+
+
+# --- 3. Main Execution ---
+def main():
+    parser = argparse.ArgumentParser(description="Forecast AQI over a dense lat/lon grid.")
+    parser.add_argument('--bbox', type=lambda s: tuple(float(v) for v in s.split(',')),
+                        help="min_lat,min_lon,max_lat,max_lon (default: stations + padding)")
+    parser.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION,
+                        help="Grid spacing in degrees")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Rows per model.predict call")
+    parser.add_argument('--output', default=GRID_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    if not OPENWEATHER_API_KEY:
+        raise RuntimeError("OPENWEATHER_API_KEY is missing")
+
+    models = load_models()
+    if not models:
+        raise RuntimeError("Models failed to load")
+
+    bbox = args.bbox or default_bbox(STATIONS)
+    grid_lats, grid_lons = build_grid(bbox, args.resolution)
+    shape = (len(grid_lats), len(grid_lons))
+    print(f"▶ Grid {shape[0]}x{shape[1]} ({shape[0] * shape[1]} cells) over {bbox}")
+
+    # Station observations are the anchors the grid is interpolated from.
+    fetched = fetch_stations(STATIONS)
+    coords, rows = [], []
+    for sid, raw in fetched.items():
+        if raw:
+            coords.append((STATIONS[sid]["lat"], STATIONS[sid]["lon"]))
+            rows.append(create_feature_vector(raw)[0])
+    if not rows:
+        raise RuntimeError("No station data available to build the grid")
+
+    station_features = np.vstack(rows)
+    grid_features = interpolate_features(np.array(coords), station_features, grid_lats, grid_lons)
+    for feat in TIME_FEATURES:
+        col = FEATURE_INDEX[feat]
+        grid_features[:, col] = station_features[0, col]
+    # AQI is not linear in the concentrations, so recompute it per cell.
+    grid_aqi, _, _ = compute_aqi({p: grid_features[:, FEATURE_INDEX[p]] for p in POLLUTANTS})
+    grid_features[:, FEATURE_INDEX['calculated_aqi']] = grid_aqi
+
+    hourly = predict_in_chunks(models["hourly"], grid_features, args.chunk_size)
+    daily = predict_in_chunks(models["daily"], grid_features, args.chunk_size)
+
+    artifact = {
+        "forecast_generated_at_utc": datetime.now(UTC).isoformat(),
+        "bbox": list(bbox),
+        "resolution": args.resolution,
+        "shape": list(shape),
+        "lats": np.round(grid_lats, 5).tolist(),
+        "lons": np.round(grid_lons, 5).tolist(),
+        "hourly_forecast": to_grids(hourly, shape, HOURLY_HORIZONS),
+        "daily_forecast": to_grids(daily, shape, DAILY_HORIZONS),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(artifact, f, separators=(",", ":"))
+
+    print(f"✅ Grid forecast written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
-import pandas as pd
-import joblib
-import requests
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import argparse
 import json
 from datetime import datetime, timedelta, UTC
 import warnings
-import numpy as np
 import os
-import time
+
+from aqi_index import POLLUTANTS, compute_aqi
+from feature_matrix import build_feature_matrix, validate_feature_order
+from fetch_engine import fetch_all, fetch_json, fetch_open_meteo_bulk, start_deadline
+from forecast_output import degraded_record, fresh_records, output_lock, write_station_outputs
+from forecast_verification import verify_forecasts
+from history_store import HistoryStore
+from model_cache import load_model, print_startup_profile
+from prediction_memo import PredictionMemo
+from response_cache import CACHE
+from run_metrics import METRICS
+from station_registry import load_stations, plan_fetches
+from station_state import StationState
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 # --- 1. Configuration ---
 warnings.filterwarnings('ignore')
@@ -15,35 +29,23 @@ warnings.filterwarnings('ignore')
 MODEL_HOURLY_FILE = 'model_hourly.pkl'
 MODEL_DAILY_FILE = 'model_daily.pkl'
 FORECAST_OUTPUT_FILE = 'all_forecasts.json'
-HISTORY_FILE = 'history.json'
-
-# --- Station Configuration (Bengaluru) ---
-STATIONS = {
-    "peenya": {"lat": 13.0270, "lon": 77.4940, "name": "Peenya"},
-    "btm_layout": {"lat": 12.9128, "lon": 77.6092, "name": "BTM Layout"},
-    "bwssb": {"lat": 12.9389, "lon": 77.6974, "name": "BWSSB Kadabesanahalli"},
-    "city_railway": {"lat": 12.9772, "lon": 77.5713, "name": "City Railway Station"},
-    "saneguruvanahalli": {"lat": 12.9918, "lon": 77.5458, "name": "Saneguruvanahalli"},
-    "hebbal": {"lat": 13.0305, "lon": 77.5925, "name": "Hebbal"},
-    "silk_board": {"lat": 12.9176, "lon": 77.6235, "name": "Silk Board"},
-    "jayanagar": {"lat": 12.9209, "lon": 77.5849, "name": "Jayanagar"},
-    "hombegowda": {"lat": 12.9366, "lon": 77.5927, "name": "Hombegowda Nagar"},
-    "mysore_road": {"lat": 12.9567, "lon": 77.5262, "name": "Mysore Road"},
-}
+
+# --- Station Configuration ---
+# Loaded from stations.csv (or STATIONS_FILE, CSV or GeoJSON).
+STATIONS = load_stations()
 
 # --- API Settings ---
-WEATHER_API_URL = "https://api.open-meteo.com/v1/forecast"
-OPENWEATHER_AQI_URL = "http://api.openweathermap.org/data/2.5/air_pollution"
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+OPENWEATHER_AQI_URL = os.getenv("OPENWEATHER_AQI_URL", "http://api.openweathermap.org/data/2.5/air_pollution")
 OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
 
-# --- Feature List (Must match training) ---
-FEATURES_LIST = [
-    'co', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3',
-    'calculated_aqi', 'temperature', 'humidity', 'wind_speed',
-    'precipitation', 'pressure', 'hour', 'dayofweek', 'month',
-    'dayofyear', 'weekofyear', 'aqi_lag_24hr', 'aqi_lag_48hr',
-    'aqi_lag_168hr', 'aqi_roll_avg_24hr', 'aqi_roll_avg_168hr'
-]
+WEATHER_PARAMS = {
+    "current": (
+        "temperature_2m,relative_humidity_2m,precipitation,"
+        "pressure_msl,wind_speed_10m,visibility"
+    ),
+    "timezone": "auto",
+}
 
 SHORT_HISTORY_FEATURES = ['aqi_lag_24hr', 'aqi_lag_48hr', 'aqi_roll_avg_24hr']
 LONG_HISTORY_FEATURES = ['aqi_lag_168hr', 'aqi_roll_avg_168hr']
@@ -52,45 +54,69 @@ LONG_HISTORY_FEATURES = ['aqi_lag_168hr', 'aqi_roll_avg_168hr']
 # --- 2. Helper Functions ---
 def load_models():
     try:
-        return {
-            "hourly": joblib.load(MODEL_HOURLY_FILE),
-            "daily": joblib.load(MODEL_DAILY_FILE),
+        models = {
+            "hourly": load_model(MODEL_HOURLY_FILE, "hourly"),
+            "daily": load_model(MODEL_DAILY_FILE, "daily"),
         }
     except FileNotFoundError:
         print("❌ Model files not found.")
         return None
 
+    for name, model in models.items():
+        validate_feature_order(model, name)
+    return models
+
+
+def fetch_weather_for_stations(stations):
+    """ Current weather for every station via bulk multi-location Open-Meteo calls. """
+    coords = [(info["lat"], info["lon"]) for info in stations.values()]
+    return dict(zip(stations, fetch_open_meteo_bulk(WEATHER_API_URL, coords, WEATHER_PARAMS)))
+
+
+def fetch_pollutants(lat, lon):
+    """ OpenWeather air-pollution components at one point. """
+    aqi_params = {"lat": lat, "lon": lon, "appid": OPENWEATHER_API_KEY}
+    aqi_res = fetch_json("openweather", OPENWEATHER_AQI_URL, aqi_params, lat, lon)
+    return aqi_res["list"][0]["components"]
 
-def fetch_data_for_station(lat, lon):
+
+def fetch_pollutants_for_stations(stations):
+    """ One air-pollution request per upstream grid cell, shared by every station in it. """
+    plan = plan_fetches(stations)
+
+    def fetch_cell(key, cell):
+        try:
+            return fetch_pollutants(cell["lat"], cell["lon"])
+        except Exception as e:
+            print(f"⚠️ AQI fetch failed for {', '.join(cell['stations'])}: {e}")
+            return None
+
+    by_cell = fetch_all(plan, fetch_cell)
+    return {sid: by_cell[key] for key, cell in plan.items() for sid in cell["stations"]}
+
+
+def fetch_data_for_station(lat, lon, weather=None, pollutants=None):
     try:
         current_data = {}
 
-        # Weather
-        w_params = {
-            "latitude": lat,
-            "longitude": lon,
-            "current": (
-                "temperature_2m,relative_humidity_2m,precipitation,"
-                "pressure_msl,wind_speed_10m,visibility"
-            ),
-            "timezone": "auto",
-        }
-        w_res = requests.get(WEATHER_API_URL, params=w_params, timeout=20).json()["current"]
+        # Weather (only fetched here if the bulk call did not cover this point)
+        if weather is None:
+            w_params = {"latitude": lat, "longitude": lon, **WEATHER_PARAMS}
+            weather = fetch_json("open_meteo", WEATHER_API_URL, w_params, lat, lon)["current"]
 
         current_data.update({
-            "temperature": w_res["temperature_2m"],
-            "humidity": w_res["relative_humidity_2m"],
-            "precipitation": w_res["precipitation"],
-            "pressure": w_res["pressure_msl"],
-            "wind_speed": w_res["wind_speed_10m"],
-            "visibility": w_res["visibility"],
-            "datetime": pd.to_datetime(w_res["time"]),
+            "temperature": weather["temperature_2m"],
+            "humidity": weather["relative_humidity_2m"],
+            "precipitation": weather["precipitation"],
+            "pressure": weather["pressure_msl"],
+            "wind_speed": weather["wind_speed_10m"],
+            "visibility": weather["visibility"],
+            "datetime": datetime.fromisoformat(weather["time"]),
         })
 
-        # AQI
-        aqi_params = {"lat": lat, "lon": lon, "appid": OPENWEATHER_API_KEY}
-        aqi_res = requests.get(OPENWEATHER_AQI_URL, params=aqi_params, timeout=20).json()
-        pollutants = aqi_res["list"][0]["components"]
+        # AQI (only fetched here if no shared grid-cell result was passed in)
+        if pollutants is None:
+            pollutants = fetch_pollutants(lat, lon)
 
         for p in ["pm2_5", "pm10", "co", "no2", "o3", "so2", "nh3"]:
             current_data[p] = pollutants.get(p, 0)
@@ -102,50 +128,35 @@ def fetch_data_for_station(lat, lon):
         return None
 
 
-def calculate_indian_aqi_subindex(Cp, pollutant):
-    breakpoints = {
-        "pm2_5": [((0, 30), (0, 50)), ((31, 60), (51, 100)), ((61, 90), (101, 200)),
-                  ((91, 120), (201, 300)), ((121, 250), (301, 400)), ((251, 1000), (401, 500))],
-        "pm10": [((0, 50), (0, 50)), ((51, 100), (51, 100)), ((101, 250), (101, 200)),
-                 ((251, 350), (201, 300)), ((351, 430), (301, 400)), ((431, 1000), (401, 500))],
-        "co": [((0, 1), (0, 50)), ((1.1, 2), (51, 100)), ((2.1, 10), (101, 200)),
-               ((10.1, 17), (201, 300)), ((17.1, 34), (301, 400)), ((34.1, 100), (401, 500))],
-    }
-
-    val = Cp / 1000.0 if pollutant == "co" else Cp
-
-    for (low, high), (i_low, i_high) in breakpoints.get(pollutant, []):
-        if low <= val <= high:
-            return ((i_high - i_low) / (high - low)) * (val - low) + i_low
-
-    return 0
+def create_feature_vector(current_data, state=None, station_id=None):
+    aqi, primary, sub_indices = compute_aqi({p: current_data[p] for p in POLLUTANTS})
 
-
-def create_feature_vector(current_data):
-    pollutants = ["pm2_5", "pm10", "co", "no2", "o3", "so2", "nh3"]
-    sub_indices = {p: calculate_indian_aqi_subindex(current_data[p], p) for p in pollutants}
-
-    current_aqi = max(sub_indices.values())
+    current_aqi = float(aqi[0])
     dt = current_data["datetime"]
 
     current_data.update({
         "calculated_aqi": current_aqi,
-        "primary_pollutant": max(sub_indices, key=sub_indices.get),
+        "primary_pollutant": str(primary[0]),
         "pollutant_details": {
-            p: {"value": current_data[p], "sub_index": sub_indices[p]} for p in pollutants
+            p: {"value": current_data[p], "sub_index": float(sub_indices[0, i])}
+            for i, p in enumerate(POLLUTANTS)
         },
         "hour": dt.hour,
-        "dayofweek": dt.dayofweek,
+        "dayofweek": dt.weekday(),
         "month": dt.month,
-        "dayofyear": dt.dayofyear,
+        "dayofyear": dt.timetuple().tm_yday,
         "weekofyear": int(dt.isocalendar().week),
     })
 
+    # Real lags/rolling means from the station's ring buffer, else current AQI.
+    history = {}
+    if state is not None:
+        state.update(station_id, dt, current_aqi)
+        history = state.features(station_id, fallback=current_aqi)
     for feat in SHORT_HISTORY_FEATURES + LONG_HISTORY_FEATURES:
-        current_data[feat] = current_aqi
+        current_data[feat] = history.get(feat, current_aqi)
 
-    df = pd.DataFrame([current_data])
-    return df[FEATURES_LIST].apply(pd.to_numeric, errors="coerce").fillna(0)
+    return build_feature_matrix([current_data])
 
 
 def format_predictions(h_preds, d_preds, current_data, lat, lon):
@@ -174,50 +185,117 @@ def format_predictions(h_preds, d_preds, current_data, lat, lon):
 
 
 def update_history(all_stations_data):
-    try:
-        with open(HISTORY_FILE, "r") as f:
-            history = json.load(f)
-    except FileNotFoundError:
-        history = {}
-
+    """ Appends this run's AQI to each station's history store and re-exports its tiers. """
+    store = HistoryStore()
     for sid, data in all_stations_data.items():
-        history.setdefault(sid, [])
-        history[sid].append({
-            "date": data["current_conditions_time"],
-            "aqi": data["current_aqi"],
-        })
-        history[sid] = history[sid][-30:]
+        with METRICS.span("history_update", sid):
+            store.append(sid, datetime.fromisoformat(data["current_conditions_time"]), data["current_aqi"])
+            store.export(sid)
+
+
+def fetch_stations(stations):
+    """ Bulk weather plus one AQI fetch per upstream grid cell. Returns {sid: raw data or None}. """
+    start_deadline()
+    weather = fetch_weather_for_stations(stations)
+    pollutants = fetch_pollutants_for_stations(stations)
+    return fetch_all(
+        stations,
+        lambda sid, info: fetch_data_for_station(info["lat"], info["lon"], weather[sid], pollutants[sid])
+        if pollutants[sid] is not None else None,
+    )
+
+
+def build_station_forecast(sid, info, raw, models, state=None, memo=None):
+    """
+    Features, both model predictions and formatting for one fetched station.
+    With a memo, predictions for an unchanged feature row are reused.
+    """
+    with METRICS.span("feature_build", sid):
+        vec = create_feature_vector(raw, state, sid)
+
+    key = memo.make_key(vec, models) if memo is not None else None
+    cached = memo.get(key) if memo is not None else None
+    if cached:
+        h_p, d_p = cached["hourly"], cached["daily"]
+    else:
+        with METRICS.span("hourly_predict", sid):
+            h_p = models["hourly"].predict(vec)
+        with METRICS.span("daily_predict", sid):
+            d_p = models["daily"].predict(vec)
+        if memo is not None:
+            memo.put(key, {"hourly": h_p, "daily": d_p})
+
+    with METRICS.span("format", sid):
+        return format_predictions(h_p, d_p, raw, info["lat"], info["lon"])
+
+
+def write_forecasts(all_stations_data):
+    with METRICS.span("write"):
+        changed = write_station_outputs(all_stations_data.items(), registry=STATIONS)
+        print(f"Per-station outputs: {len(changed)}/{len(all_stations_data)} stations changed")
+        if not changed and os.path.exists(FORECAST_OUTPUT_FILE):
+            return
 
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+        # Replaced atomically: the daemon, stream and dashboard read it without the lock.
+        with output_lock():
+            with open(FORECAST_OUTPUT_FILE + ".tmp", "w") as f:
+                json.dump(all_stations_data, f, indent=2)
+            os.replace(FORECAST_OUTPUT_FILE + ".tmp", FORECAST_OUTPUT_FILE)
+
+
+def write_run_metrics(n_stations, n_forecast):
+    """ Run-metrics JSON + Prometheus textfile (a no-op when RUN_METRICS=off). """
+    METRICS.incr("stations_total", n_stations)
+    METRICS.incr("stations_forecast", n_forecast)
+    METRICS.write({f"cache_{k}": v for k, v in CACHE.stats.items()})
 
 
 # --- 3. Main Execution ---
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast AQI for every configured station.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report module import time vs model load time")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     if not OPENWEATHER_API_KEY:
         raise RuntimeError("OPENWEATHER_API_KEY is missing")
 
     models = load_models()
     if not models:
         raise RuntimeError("Models failed to load")
+    if args.profile_startup:
+        print_startup_profile(IMPORT_SECONDS)
+
+    state = StationState.load()
+    memo = PredictionMemo.load()
 
+    fetched = fetch_stations(STATIONS)
     all_stations_data = {}
 
     for sid, info in STATIONS.items():
         print(f"▶ Processing {info['name']}...")
-        raw = fetch_data_for_station(info["lat"], info["lon"])
+        raw = fetched[sid]
         if raw:
-            vec = create_feature_vector(raw)
-            h_p = models["hourly"].predict(vec)
-            d_p = models["daily"].predict(vec)
-            all_stations_data[sid] = format_predictions(h_p, d_p, raw, info["lat"], info["lon"])
-        time.sleep(1)
-
-    update_history(all_stations_data)
-
-    with open(FORECAST_OUTPUT_FILE, "w") as f:
-        json.dump(all_stations_data, f, indent=2)
-
+            all_stations_data[sid] = build_station_forecast(sid, info, raw, models, state, memo)
+        else:
+            print(f"⚠️ {info['name']} degraded: publishing last good forecast, flagged")
+            all_stations_data[sid] = degraded_record(sid, info["lat"], info["lon"], "upstream data unavailable")
+
+    fresh = fresh_records(all_stations_data)
+    update_history(fresh)
+    with METRICS.span("verification"):
+        verifier = verify_forecasts(fresh)
+    print(f"Verification: {verifier.stats['verified']} forecasts scored, {verifier.stats['expired']} expired")
+    state.save()
+    memo.save()
+    write_forecasts(all_stations_data)
+
+    print(CACHE.summary())
+    print(memo.summary(len(fresh)))
+    write_run_metrics(len(STATIONS), len(fresh))
     print("✅ Forecast & history updated successfully.")
 
 
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, UTC
+
+# --- 1. Configuration ---
+METRICS_ENABLED = os.getenv("RUN_METRICS", "on").lower() not in ("0", "off", "false")
+METRICS_JSON_FILE = os.getenv("RUN_METRICS_FILE", "run_metrics.json")
+# Point this at node_exporter's --collector.textfile.directory to scrape it.
+METRICS_PROM_FILE = os.getenv("RUN_METRICS_PROM_FILE", "run_metrics.prom")
+
+PROM_PREFIX = "aqi_forecast"
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+# --- 2. Collectors ---
+
+class RunMetrics:
+    """
+    Per-run timings. Every span adds to a per-stage total (count, seconds,
+    max) and, when keyed by a station id, to that station's own breakdown.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now(UTC)
+            self.started = time.perf_counter()
+            self.stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            self.spans = defaultdict(lambda: defaultdict(float))
+            self.counters = defaultdict(float)
+
+    @contextmanager
+    def span(self, stage, key=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, key)
+
+    def record(self, stage, seconds, key=None):
+        with self.lock:
+            totals = self.stages[stage]
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            if key is not None:
+                self.spans[key][stage] += seconds
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def snapshot(self, extra_counters=None):
+        with self.lock:
+            return {
+                "run_started_at_utc": self.started_at.isoformat(),
+                "run_duration_seconds": time.perf_counter() - self.started,
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "counters": {**self.counters, **(extra_counters or {})},
+                "spans": {k: dict(v) for k, v in self.spans.items()},
+            }
+
+    def write(self, extra_counters=None, json_path=METRICS_JSON_FILE, prom_path=METRICS_PROM_FILE,
+              prom_prefix=PROM_PREFIX):
+        """
+        Writes the run-metrics JSON and a Prometheus textfile-collector file.
+        `extra_counters` adds values kept elsewhere, e.g. response cache stats.
+        Processes writing their own files need their own `prom_prefix`.
+        """
+        data = self.snapshot(extra_counters)
+        _write_atomic(json_path, json.dumps(data, indent=2))
+        _write_atomic(prom_path, to_prometheus(data, prom_prefix))
+
+
+class DisabledMetrics:
+    """ Drop-in stand-in when RUN_METRICS=off: every call is a no-op. """
+
+    _NULL_SPAN = nullcontext()
+
+    def reset(self):
+        pass
+
+    def span(self, stage, key=None):
+        return self._NULL_SPAN
+
+    def record(self, stage, seconds, key=None):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+    def write(self, extra_counters=None, json_path=None, prom_path=None, prom_prefix=None):
+        pass
+
+
+def to_prometheus(data, prefix=PROM_PREFIX):
+    """ Stage totals and counters in Prometheus text format (per-station spans stay in JSON). """
+    lines = [
+        f"# HELP {prefix}_stage_seconds_total Time spent in each pipeline stage during the last run.",
+        f"# TYPE {prefix}_stage_seconds_total gauge",
+    ]
+    lines += [f'{prefix}_stage_seconds_total{{stage="{s}"}} {v["seconds"]:.6f}'
+              for s, v in sorted(data["stages"].items())]
+    lines += [
+        f"# HELP {prefix}_stage_calls_total Spans recorded for each stage during the last run.",
+        f"# TYPE {prefix}_stage_calls_total gauge",
+    ]
+    lines += [f'{prefix}_stage_calls_total{{stage="{s}"}} {v["count"]}'
+              for s, v in sorted(data["stages"].items())]
+    lines += [
+        f"# HELP {prefix}_stage_max_seconds Slowest single span of each stage during the last run.",
+        f"# TYPE {prefix}_stage_max_seconds gauge",
+    ]
+    lines += [f'{prefix}_stage_max_seconds{{stage="{s}"}} {v["max_seconds"]:.6f}'
+              for s, v in sorted(data["stages"].items())]
+    for name, value in sorted(data["counters"].items()):
+        lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+    lines += [
+        f"# TYPE {prefix}_run_duration_seconds gauge",
+        f"{prefix}_run_duration_seconds {data['run_duration_seconds']:.6f}",
+        f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+        f"{prefix}_last_run_timestamp_seconds {time.time():.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+METRICS = RunMetrics() if METRICS_ENABLED else DisabledMetrics()
@@ -0,0 +1,239 @@
+"""
+Sharded forecast runs for large, multi-city station registries.
+
+Stations are split into shards by a stable hash of their id. Each shard
+starts from the shared state files (station ring buffers, prediction memo,
+verification), fetches and predicts its stations, and writes its partial
+output plus its stations' part of that state under the shards directory,
+so shards never write the same file. A merge step combines the partials
+into the usual all_forecasts.json and per-station files, adds a per-city
+index and folds the state parts back into the shared files. State is kept
+per station, not per shard, so changing the shard count loses nothing.
+Only the response cache is per shard; it is keyed by coordinates and
+simply refills after a change.
+
+One machine, N worker processes (runs every shard, then merges):
+
+    python run_sharded.py --workers 8
+
+N machines sharing (or later collecting) the shards directory:
+
+    python run_sharded.py --shard-index 0 --shard-count 4   # on each node
+    python run_sharded.py --merge --shard-count 4            # once, after all shards
+
+Each node needs the shared state written by the previous merge
+(.cache/station_state.npz, .cache/prediction_memo.json, verification/).
+Local workers split the provider rate budgets between them, but every node
+gets the full budget: set OPEN_METEO_RATE_PER_SEC and OPENWEATHER_RATE_PER_SEC
+on each node to its share of the account's limits.
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, UTC
+from multiprocessing import get_context
+
+from forecast_output import OUTPUT_DIR, degraded_record, fresh_records, output_lock, write_station_outputs
+from forecast_verification import ForecastVerifier
+from prediction_memo import PredictionMemo
+from run_metrics import METRICS
+from station_registry import load_stations
+from station_state import StationState
+
+# --- 1. Configuration ---
+VARIANTS = {
+    "openweather": "run_forecast_openweather",
+    "all_stations": "run_forecast_all_stations",
+}
+SHARDS_DIR = os.getenv("SHARDS_DIR", "shards")
+SHARD_CACHE_DIR = os.path.join(".cache", "shards")
+CITY_INDEX_FILE = "cities.json"
+
+# Provider budgets (see fetch_engine) that are split evenly across local workers.
+RATE_LIMIT_ENV = {"OPEN_METEO_RATE_PER_SEC": "5", "OPENWEATHER_RATE_PER_SEC": "1"}
+# Read before any shard divides them.
+BASE_RATES = {name: float(os.getenv(name, default)) for name, default in RATE_LIMIT_ENV.items()}
+
+
+def shard_of(station_id, shard_count):
+    """ Stable across processes, machines and Python versions, unlike hash(). """
+    digest = hashlib.sha1(station_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def shard_name(index, count):
+    return f"shard-{index}-of-{count}"
+
+
+def partial_path(index, count, shards_dir=SHARDS_DIR):
+    return os.path.join(shards_dir, f"{shard_name(index, count)}.json")
+
+
+def partial_state_dir(index, count, shards_dir=SHARDS_DIR):
+    return os.path.join(shards_dir, shard_name(index, count))
+
+
+def _write_json(path, payload, **kwargs):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(payload, f, **kwargs)
+    os.replace(path + ".tmp", path)
+
+
+# --- 2. One Shard ---
+
+def run_shard(index, count, variant="openweather", shards_dir=SHARDS_DIR, rate_divisor=1):
+    """
+    Forecasts this shard's stations and writes its partial output and state.
+    Runs in a fresh process of its own (one shard per process): the shard's
+    response cache path and rate budgets are set in the environment before
+    the pipeline (and fetch_engine) is imported.
+    """
+    os.environ["RESPONSE_CACHE_FILE"] = os.path.join(
+        SHARD_CACHE_DIR, shard_name(index, count), "responses.sqlite"
+    )
+    for name, base in BASE_RATES.items():
+        os.environ[name] = str(base / rate_divisor)
+    METRICS.reset()
+
+    pipeline = importlib.import_module(VARIANTS[variant])
+
+    started = time.perf_counter()
+    stations = {sid: info for sid, info in pipeline.STATIONS.items() if shard_of(sid, count) == index}
+    models = pipeline.load_models()
+    if not models:
+        raise RuntimeError("Models failed to load")
+    state = StationState.load()
+    memo = PredictionMemo.load()
+
+    fetched = pipeline.fetch_stations(stations) if stations else {}
+    records = {}
+    for sid, info in stations.items():
+        raw = fetched[sid]
+        output = pipeline.build_station_forecast(sid, info, raw, models, state, memo) if raw else None
+        records[sid] = output or degraded_record(sid, info["lat"], info["lon"], "upstream data unavailable")
+
+    fresh = fresh_records(records)
+    if hasattr(pipeline, "update_history"):
+        pipeline.update_history(fresh)
+    verifier = ForecastVerifier.load()
+    verifier.update(fresh)
+
+    # Only this shard's stations; merge_shards() writes them into the shared files.
+    part_dir = partial_state_dir(index, count, shards_dir)
+    state.subset(stations).save(os.path.join(part_dir, "station_state.npz"))
+    memo.save(os.path.join(part_dir, "prediction_memo.json"))
+    verifier.subset(stations).save(os.path.join(part_dir, "verification"))
+
+    _write_json(partial_path(index, count, shards_dir), {
+        "shard_index": index,
+        "shard_count": count,
+        "generated_at_utc": datetime.now(UTC).isoformat(),
+        "stations": records,
+    }, separators=(",", ":"))
+    METRICS.write(
+        json_path=os.path.join(shards_dir, f"{shard_name(index, count)}-metrics.json"),
+        prom_path=os.path.join(shards_dir, f"{shard_name(index, count)}-metrics.prom"),
+    )
+    elapsed = time.perf_counter() - started
+    print(f"{shard_name(index, count)}: {len(fresh)}/{len(stations)} stations in {elapsed:.1f}s")
+    return index, len(stations), len(fresh)
+
+
+# --- 3. Merge ---
+
+def merge_shards(count, shards_dir=SHARDS_DIR, output_dir=OUTPUT_DIR, stations_file=None, variant="openweather"):
+    """
+    Combines every shard's partial into the variant's all_forecasts.json and
+    the per-station files (same layout as a single-process run), writes the
+    per-city index, and folds each shard's ring buffers, memo entries and
+    verification state into the shared state files.
+    """
+    # Imported here, not at the top: shard processes must set their cache
+    # and rate-limit environment before the pipeline pulls in fetch_engine.
+    forecast_output_file = importlib.import_module(VARIANTS[variant]).FORECAST_OUTPUT_FILE
+    partials = {}
+    for index in range(count):
+        path = partial_path(index, count, shards_dir)
+        if not os.path.exists(path):
+            raise SystemExit(f"Missing partial output for {shard_name(index, count)} ({path})")
+        with open(path) as f:
+            partials[index] = json.load(f)["stations"]
+
+    registry = load_stations(stations_file) if stations_file else load_stations()
+    combined = {}
+    for records in partials.values():
+        combined.update(records)
+    # Registry order first, so the merged file does not depend on shard layout.
+    ordered = {sid: combined[sid] for sid in registry if sid in combined}
+    ordered.update({sid: combined[sid] for sid in sorted(combined) if sid not in ordered})
+
+    changed = write_station_outputs(ordered.items(), output_dir, registry=ordered)
+    with output_lock():
+        _write_json(forecast_output_file, ordered, indent=2)
+
+    cities = {}
+    for sid in ordered:
+        city = registry.get(sid, {}).get("city") or "unknown"
+        cities.setdefault(city, []).append(sid)
+    _write_json(os.path.join(output_dir, CITY_INDEX_FILE), {
+        "generated_at_utc": datetime.now(UTC).isoformat(),
+        "cities": {city: {"stations": ids, "count": len(ids)} for city, ids in sorted(cities.items())},
+    }, separators=(",", ":"))
+
+    state, memo, verifier = StationState.load(), PredictionMemo.load(), ForecastVerifier.load()
+    for index in range(count):
+        part_dir = partial_state_dir(index, count, shards_dir)
+        state.merge(StationState.load(os.path.join(part_dir, "station_state.npz")))
+        memo.merge(PredictionMemo.load(os.path.join(part_dir, "prediction_memo.json")))
+        verifier.merge(ForecastVerifier.load(os.path.join(part_dir, "verification")))
+    state.save()
+    memo.save()
+    verifier.save()
+
+    print(f"Merged {count} shard(s): {len(ordered)} stations in {len(cities)} cities, "
+          f"{len(changed)} station files changed")
+    return ordered
+
+
+# --- 4. Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the forecast pipeline in hash-partitioned shards.")
+    parser.add_argument("--variant", choices=VARIANTS, default="openweather")
+    parser.add_argument("--workers", type=int,
+                        help="Run all shards on this machine in this many processes, then merge")
+    parser.add_argument("--shard-index", type=int, help="Run only this shard (multi-machine mode)")
+    parser.add_argument("--shard-count", type=int, help="Total shards (multi-machine mode)")
+    parser.add_argument("--merge", action="store_true", help="Merge the partial outputs of --shard-count shards")
+    parser.add_argument("--shards-dir", default=SHARDS_DIR)
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        if not args.shard_count:
+            parser.error("--merge needs --shard-count")
+        merge_shards(args.shard_count, args.shards_dir, variant=args.variant)
+    elif args.shard_index is not None:
+        if not args.shard_count or not 0 <= args.shard_index < args.shard_count:
+            parser.error("--shard-index must be in [0, --shard-count)")
+        run_shard(args.shard_index, args.shard_count, args.variant, args.shards_dir)
+    else:
+        workers = args.workers or os.cpu_count() or 1
+        # Fresh interpreters, one shard each, so every shard imports fetch_engine
+        # with its own cache and budget and starts with empty metrics.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 max_tasks_per_child=1) as pool:
+            futures = [pool.submit(run_shard, i, workers, args.variant, args.shards_dir, workers)
+                       for i in range(workers)]
+            for future in futures:
+                future.result()
+        merge_shards(workers, args.shards_dir, variant=args.variant)
+
+
+if __name__ == "__main__":
+    main()
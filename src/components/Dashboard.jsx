@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import CurrentAQI from './CurrentAQI';
 import ForecastChart from './ForecastChart';
 import PollutantOverview from './PollutantOverview';
@@ -12,6 +12,8 @@ import LocationChangeNotification from './LocationChangeNotification';
 import StationsMap from './StationsMap';
 import LoadingScreen from './LoadingScreen';
 
+const DATA_BASE_URL = 'https://raw.githubusercontent.com/Kushalp2004/aqi_sentinal/data/forecasts';
+
 const Dashboard = () => {
     const [selectedStation, setSelectedStation] = useState('peenya');
     const [allData, setAllData] = useState(null); // Stores data for all stations
@@ -20,17 +22,31 @@ const Dashboard = () => {
     const [showNotification, setShowNotification] = useState(false);
     const [isTransitioning, setIsTransitioning] = useState(false);
     const [previousStation, setPreviousStation] = useState('peenya');
+    const stationHashes = useRef({}); // Content hash of each station file we already hold
+    const stationCache = useRef({});
 
     // --- Monster Architecture: Live Data Fetching ---
     useEffect(() => {
         const fetchLiveData = async () => {
             try {
-                // Fetching from the RAW GitHub URL of your 'data' branch
-                // The ?t= timestamp prevents the browser from caching old data
-                const url = `https://raw.githubusercontent.com/Kushalp2004/aqi_sentinal/data/all_forecasts.json?t=${new Date().getTime()}`;
-                const response = await fetch(url);
-                const fetchedData = await response.json();
-                
+                // Only the small manifest is cache-busted; it lists a content hash per station
+                const manifestResponse = await fetch(`${DATA_BASE_URL}/manifest.json?t=${new Date().getTime()}`);
+                const manifest = await manifestResponse.json();
+
+                // Download just the stations whose hash changed since our last poll.
+                // Files are addressed by hash, so the browser cache can serve the rest.
+                const changed = Object.entries(manifest.stations)
+                    .filter(([id, entry]) => stationHashes.current[id] !== entry.hash);
+                await Promise.all(changed.map(async ([id, entry]) => {
+                    const response = await fetch(`${DATA_BASE_URL}/${entry.file}?h=${entry.hash}`);
+                    stationCache.current[id] = await response.json();
+                    stationHashes.current[id] = entry.hash;
+                }));
+
+                // Degraded stations with nothing published before carry no AQI to show
+                const fetchedData = Object.fromEntries(
+                    Object.entries(stationCache.current).filter(([, record]) => record.current_aqi != null)
+                );
                 setAllData(fetchedData);
                 if (fetchedData[selectedStation]) {
                     setData(fetchedData[selectedStation]);
@@ -102,9 +118,15 @@ const Dashboard = () => {
                             {/* Uses the actual time from your Python script's inference run */}
                             {new Date(data.current_conditions_time).toLocaleString()}
                         </div>
-                        <div className="text-xs text-blue-500 mt-1 flex items-center gap-1 justify-end">
-                            <span className="animate-pulse">●</span> Live Data Stream
-                        </div>
+                        {data.status === 'degraded' ? (
+                            <div className="text-xs text-amber-500 mt-1 flex items-center gap-1 justify-end">
+                                <span>●</span> Upstream data unavailable, showing last good reading
+                            </div>
+                        ) : (
+                            <div className="text-xs text-blue-500 mt-1 flex items-center gap-1 justify-end">
+                                <span className="animate-pulse">●</span> Live Data Stream
+                            </div>
+                        )}
                     </div>
                 </header>
 
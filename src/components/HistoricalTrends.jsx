@@ -10,21 +10,19 @@ const HistoricalTrends = ({ selectedStation }) => {
         const fetchHistory = async () => {
             setLoading(true);
             try {
-                // FETCH: Pulling real recorded history from your GitHub data branch
-                const url = `https://raw.githubusercontent.com/Kushalp2004/aqi_sentinal/data/history.json?t=${new Date().getTime()}`;
+                // FETCH: Only this station's pre-aggregated daily tier from the data branch
+                const url = `https://raw.githubusercontent.com/Kushalp2004/aqi_sentinal/data/history/${selectedStation}/daily.json?t=${new Date().getTime()}`;
                 const response = await fetch(url);
-                const allHistory = await response.json();
-                
-                if (allHistory[selectedStation]) {
-                    const stationHistory = allHistory[selectedStation].map(item => ({
-                        date: new Date(item.date).toLocaleDateString([], { month: 'short', day: 'numeric' }),
-                        aqi: item.aqi
-                    }));
-                    
-                    // Slice data based on selected range (7 or 30 days)
-                    const limit = range === '7d' ? 7 : 30;
-                    setHistory(stationHistory.slice(-limit));
-                }
+                const dailyHistory = await response.json();
+
+                const stationHistory = dailyHistory.map(item => ({
+                    date: new Date(item.date).toLocaleDateString([], { month: 'short', day: 'numeric' }),
+                    aqi: item.avg_aqi
+                }));
+
+                // Slice data based on selected range (7 or 30 days)
+                const limit = range === '7d' ? 7 : 30;
+                setHistory(stationHistory.slice(-limit));
             } catch (err) {
                 console.error("History fetch failed:", err);
             } finally {
@@ -0,0 +1,187 @@
+import csv
+import json
+import math
+import os
+from collections import defaultdict
+
+import numpy as np
+
+# --- 1. Configuration ---
+STATIONS_FILE = os.getenv(
+    "STATIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.csv")
+)
+
+# Cell size of the lookup grid behind StationIndex (~5.5 km).
+INDEX_CELL_DEG = 0.05
+
+# Stations in the same AQI_GRID_DEG cell share one OpenWeather air-pollution
+# request and so publish identical pollutants and current AQI, taken at one
+# member station's coordinates. That trades per-station precision for fewer
+# calls, so it is off (0 = one request per station) unless set explicitly,
+# e.g. for registries much denser than the provider's model grid.
+AQI_GRID_DEG = float(os.getenv("AQI_GRID_DEG", "0"))
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat, lon, lats, lons):
+    """ Great-circle distance from one point to arrays of points. """
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def grid_cell(lat, lon, cell_deg):
+    return (math.floor(lat / cell_deg), math.floor(lon / cell_deg))
+
+
+# --- 2. Loading ---
+
+def _station(sid, name, lat, lon, city, source):
+    if not sid:
+        raise ValueError(f"{source}: station without an id")
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError(f"{source}: station '{sid}' has no valid coordinates") from None
+    return {"lat": lat, "lon": lon, "name": name or sid, "city": city or ""}
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            sid = (row.get("station_id") or "").strip()
+            yield sid, _station(sid, row.get("name"), row.get("lat"), row.get("lon"), row.get("city"), path)
+
+
+def _read_geojson(path):
+    with open(path, encoding="utf-8") as f:
+        collection = json.load(f)
+    for feature in collection.get("features", []):
+        props = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "Point":
+            continue
+        lon, lat = geometry["coordinates"][:2]
+        sid = str(props.get("station_id") or props.get("id") or feature.get("id") or "")
+        yield sid, _station(sid, props.get("name"), lat, lon, props.get("city"), path)
+
+
+def load_stations(path=STATIONS_FILE):
+    """
+    Reads the station registry from CSV (station_id,name,lat,lon,city) or
+    GeoJSON (Point features with station_id/name/city properties).
+    Returns {station_id: {"lat", "lon", "name", "city"}} in file order.
+    """
+    reader = _read_geojson if path.endswith((".geojson", ".json")) else _read_csv
+    stations = {}
+    for sid, info in reader(path):
+        if sid in stations:
+            raise ValueError(f"{path}: duplicate station id '{sid}'")
+        stations[sid] = info
+    return stations
+
+
+# --- 3. Spatial Index ---
+
+class StationIndex:
+    """
+    Buckets stations into a regular lat/lon grid. A nearest-station query
+    searches outward ring by ring from the query's cell and stops once no
+    unvisited cell can hold anything closer, so it only measures distances
+    to a handful of stations however large the registry is.
+    """
+
+    def __init__(self, stations, cell_deg=INDEX_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.ids = list(stations)
+        self.lats = np.array([stations[sid]["lat"] for sid in self.ids], dtype=float)
+        self.lons = np.array([stations[sid]["lon"] for sid in self.ids], dtype=float)
+        self.cells = defaultdict(list)
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            self.cells[grid_cell(lat, lon, cell_deg)].append(i)
+        self.cells = {key: np.array(members) for key, members in self.cells.items()}
+        keys = np.array(list(self.cells)) if self.cells else np.zeros((0, 2), dtype=int)
+        self.cell_min = keys.min(axis=0) if len(keys) else None
+        self.cell_max = keys.max(axis=0) if len(keys) else None
+
+    def _ring(self, ci, cj, r):
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def nearest(self, lat, lon, k=1):
+        """ The k closest stations as [(station_id, distance_km)], nearest first. """
+        if not self.ids:
+            return []
+        k = min(k, len(self.ids))
+        ci, cj = grid_cell(lat, lon, self.cell_deg)
+        # Rings needed to cover every occupied cell from the query's cell.
+        max_ring = int(max(abs(ci - self.cell_min[0]), abs(ci - self.cell_max[0]),
+                           abs(cj - self.cell_min[1]), abs(cj - self.cell_max[1])))
+
+        found, dists = [], []
+        for r in range(max_ring + 1):
+            members = [self.cells[c] for c in self._ring(ci, cj, r) if c in self.cells]
+            if members:
+                idx = np.concatenate(members)
+                found.append(idx)
+                dists.append(haversine_km(lat, lon, self.lats[idx], self.lons[idx]))
+            if sum(len(f) for f in found) >= k:
+                kth = np.sort(np.concatenate(dists))[k - 1]
+                # Anything in ring r+1 or beyond is at least r full cells away.
+                lon_scale = math.cos(math.radians(min(89.0, abs(lat) + (r + 1) * self.cell_deg)))
+                if kth <= r * self.cell_deg * KM_PER_DEG * lon_scale:
+                    break
+
+        idx, dist = np.concatenate(found), np.concatenate(dists)
+        order = np.argsort(dist, kind="stable")[:k]
+        return [(self.ids[idx[i]], float(dist[i])) for i in order]
+
+
+# --- 4. Fetch Planning ---
+
+def plan_fetches(stations, cell_deg=AQI_GRID_DEG):
+    """
+    Groups stations by upstream air-pollution grid cell so each cell is
+    fetched once. Returns {cell_key: {"lat", "lon", "stations": [ids]}},
+    requesting each cell at the coordinates of its first station in
+    registry order, so every request is at a real station. With cell_deg 0
+    every station is its own cell.
+    """
+    plan = {}
+    for sid, info in stations.items():
+        if cell_deg <= 0:
+            plan[sid] = {"lat": info["lat"], "lon": info["lon"], "stations": [sid]}
+            continue
+        i, j = grid_cell(info["lat"], info["lon"], cell_deg)
+        key = f"{i}_{j}"
+        if key not in plan:
+            plan[key] = {"lat": info["lat"], "lon": info["lon"], "stations": []}
+        plan[key]["stations"].append(sid)
+    return plan
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Station registry tools.")
+    parser.add_argument("--stations-file", default=STATIONS_FILE)
+    parser.add_argument("--nearest", nargs=2, type=float, metavar=("LAT", "LON"))
+    parser.add_argument("-k", type=int, default=1)
+    args = parser.parse_args()
+
+    registry = load_stations(args.stations_file)
+    if args.nearest:
+        for sid, km in StationIndex(registry).nearest(*args.nearest, k=args.k):
+            print(f"{sid:<24} {registry[sid]['name']:<32} {km:8.2f} km")
+    else:
+        plan = plan_fetches(registry)
+        print(f"{len(registry)} stations in {len(plan)} upstream cells (AQI_GRID_DEG={AQI_GRID_DEG})")
@@ -0,0 +1,177 @@
+import os
+from datetime import UTC
+
+import numpy as np
+
+# --- 1. Configuration ---
+STATE_FILE = os.getenv("STATION_STATE_FILE", os.path.join(".cache", "station_state.npz"))
+
+# Current hour plus 168 hours of lag, so aqi_lag_168hr is still in the buffer.
+WINDOW_HOURS = 169
+SHORT_WINDOW = 24
+LONG_WINDOW = 168
+
+# Same order as the tail of FEATURES_LIST.
+HISTORY_FEATURES = [
+    'aqi_lag_24hr', 'aqi_lag_48hr', 'aqi_lag_168hr',
+    'aqi_roll_avg_24hr', 'aqi_roll_avg_168hr',
+]
+
+
+def to_epoch_hour(ts):
+    """ Hour index used to address ring slots (naive timestamps are read as UTC). """
+    if ts.tzinfo is None:
+        # datetime.timestamp() would read a naive value in the host's timezone.
+        ts = ts.replace(tzinfo=UTC)
+    return int(ts.timestamp() // 3600)
+
+
+# --- 2. Ring-Buffer State ---
+
+class StationState:
+    """
+    Hourly AQI history per station in a fixed (n_stations, WINDOW_HOURS) ring.
+    Missing hours are NaN. Running sums/counts for the 24 h and 168 h windows
+    are updated as slots enter and leave, so lags and rolling means are O(1)
+    per hourly update.
+    """
+
+    def __init__(self, station_ids=()):
+        self.index = {}
+        self.values = np.full((0, WINDOW_HOURS), np.nan)
+        self.last_hour = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, 2))
+        self.counts = np.zeros((0, 2), dtype=np.int64)
+        for sid in station_ids:
+            self._row(sid)
+
+    def _row(self, sid):
+        if sid not in self.index:
+            self.index[sid] = len(self.index)
+            self.values = np.vstack([self.values, np.full((1, WINDOW_HOURS), np.nan)])
+            self.last_hour = np.append(self.last_hour, -1)
+            self.sums = np.vstack([self.sums, np.zeros((1, 2))])
+            self.counts = np.vstack([self.counts, np.zeros((1, 2), dtype=np.int64)])
+        return self.index[sid]
+
+    def _slot_value(self, row, hour):
+        return self.values[row, hour % WINDOW_HOURS]
+
+    def _advance(self, row, hour):
+        """ Moves a station's ring forward to `hour`, retiring values that leave each window. """
+        last = self.last_hour[row]
+        if last < 0 or hour - last >= WINDOW_HOURS:
+            self.values[row] = np.nan
+            self.sums[row] = 0.0
+            self.counts[row] = 0
+        else:
+            for h in range(last + 1, hour + 1):
+                for w, size in enumerate((SHORT_WINDOW, LONG_WINDOW)):
+                    leaving = self._slot_value(row, h - size)
+                    if not np.isnan(leaving):
+                        self.sums[row, w] -= leaving
+                        self.counts[row, w] -= 1
+                # Slot h held hour h - WINDOW_HOURS, outside every window by now.
+                self.values[row, h % WINDOW_HOURS] = np.nan
+        self.last_hour[row] = hour
+
+    def update(self, sid, ts, aqi):
+        """ Records the AQI observed at timestamp `ts` for a station. """
+        row = self._row(sid)
+        hour = to_epoch_hour(ts)
+        if hour < self.last_hour[row]:
+            return  # Older than what we already hold; ignore.
+        if hour > self.last_hour[row]:
+            self._advance(row, hour)
+
+        previous = self._slot_value(row, hour)
+        if not np.isnan(previous):
+            self.sums[row] -= previous
+            self.counts[row] -= 1
+        if aqi is not None and not np.isnan(aqi):
+            self.values[row, hour % WINDOW_HOURS] = aqi
+            self.sums[row] += aqi
+            self.counts[row] += 1
+        else:
+            self.values[row, hour % WINDOW_HOURS] = np.nan
+
+    def features(self, sid, fallback):
+        """
+        History features for a station in HISTORY_FEATURES order. Lags or
+        windows with no observations fall back to `fallback` (usually the
+        current AQI), matching what the models saw before state existed.
+        """
+        row = self.index.get(sid)
+        if row is None or self.last_hour[row] < 0:
+            return {feat: fallback for feat in HISTORY_FEATURES}
+
+        hour = self.last_hour[row]
+        values = [self._slot_value(row, hour - lag) for lag in (24, 48, 168)]
+        values += [
+            self.sums[row, w] / self.counts[row, w] if self.counts[row, w] else np.nan
+            for w in range(2)
+        ]
+        return {
+            feat: fallback if np.isnan(v) else float(v)
+            for feat, v in zip(HISTORY_FEATURES, values)
+        }
+
+    def subset(self, station_ids):
+        """ A new state holding only the given stations' rings. """
+        part = StationState()
+        ids = [sid for sid in station_ids if sid in self.index]
+        rows = [self.index[sid] for sid in ids]
+        part.index = {sid: i for i, sid in enumerate(ids)}
+        part.values = self.values[rows].copy()
+        part.last_hour = self.last_hour[rows].copy()
+        part._rebuild_sums()
+        return part
+
+    def merge(self, other):
+        """ Takes over other's rings, replacing ours, for every station it holds. """
+        for sid, row in other.index.items():
+            mine = self._row(sid)
+            self.values[mine] = other.values[row]
+            self.last_hour[mine] = other.last_hour[row]
+        self._rebuild_sums()
+
+    # --- 3. Persistence ---
+
+    def save(self, path=STATE_FILE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            station_ids=np.array(list(self.index), dtype=str),
+            values=self.values.astype(np.float32),
+            last_hour=self.last_hour,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        """ Loads saved state, or returns an empty one if there is none. """
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as data:
+            state.index = {str(sid): i for i, sid in enumerate(data['station_ids'])}
+            state.values = data['values'].astype(float)
+            state.last_hour = data['last_hour'].astype(np.int64)
+        state._rebuild_sums()
+        return state
+
+    def _rebuild_sums(self):
+        """ Recomputes the running window sums from the ring in one vectorised pass. """
+        n = len(self.index)
+        self.sums = np.zeros((n, 2))
+        self.counts = np.zeros((n, 2), dtype=np.int64)
+        if n == 0:
+            return
+        for w, size in enumerate((SHORT_WINDOW, LONG_WINDOW)):
+            slots = (self.last_hour[:, None] - np.arange(size)[None, :]) % WINDOW_HOURS
+            window = np.take_along_axis(self.values, slots, axis=1)
+            self.sums[:, w] = np.nansum(window, axis=1)
+            self.counts[:, w] = np.sum(~np.isnan(window), axis=1)
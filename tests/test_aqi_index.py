@@ -0,0 +1,15 @@
+import numpy as np
+
+from aqi_index import compute_aqi
+from benchmarks.bench_aqi_index import check_parity, legacy_subindex
+
+
+def test_subindex_matches_scalar_implementation():
+    check_parity(np.random.default_rng(0), n=5000)
+
+
+def test_compute_aqi_takes_highest_subindex():
+    aqi, primary, sub_indices = compute_aqi({"pm2_5": [45.0, 10.0], "pm10": [20.0, 180.0]})
+    np.testing.assert_allclose(aqi, [legacy_subindex(45.0, "pm2_5"), legacy_subindex(180.0, "pm10")])
+    assert list(primary) == ["pm2_5", "pm10"]
+    assert sub_indices.shape == (2, 7)
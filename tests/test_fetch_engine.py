@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import fetch_engine
+from fetch_engine import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, TokenBucket, request_json
+
+URL = "https://upstream.test/air_pollution"
+
+
+class StubResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}", response=self)
+
+
+class StubSession:
+    """ Answers each GET with the next scripted reply: a StubResponse, or (delay, StubResponse). """
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self.lock:
+            reply = self.replies[min(self.calls, len(self.replies) - 1)]
+            self.calls += 1
+        if isinstance(reply, tuple):
+            delay, reply = reply
+            time.sleep(delay)
+        return reply
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """ No deadline, rate limit, hedging or real backoff; a fresh breaker. Returns a session installer. """
+    monkeypatch.setattr(fetch_engine, "_deadline", Deadline(None))
+    monkeypatch.setattr(fetch_engine, "HEDGE_AFTER_SECONDS", 0)
+    monkeypatch.setattr(fetch_engine, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(fetch_engine, "MAX_RETRIES", 3)
+    monkeypatch.setitem(fetch_engine.RATE_LIMITERS, "openweather", TokenBucket(1000, 1000))
+    monkeypatch.setitem(fetch_engine.BREAKERS, "openweather", CircuitBreaker("openweather", 3, 60))
+
+    def install(*replies):
+        session = StubSession(*replies)
+        monkeypatch.setattr(fetch_engine, "SESSION", session)
+        return session
+
+    return install
+
+
+def test_5xx_is_retried_until_success(upstream):
+    session = upstream(StubResponse(503), StubResponse(502), StubResponse(200, {"ok": 1}))
+    assert request_json("openweather", URL, {}) == {"ok": 1}
+    assert session.calls == 3
+    assert fetch_engine.BREAKERS["openweather"].failures == 0
+
+
+def test_4xx_is_not_retried(upstream):
+    session = upstream(StubResponse(404))
+    with pytest.raises(requests.HTTPError):
+        request_json("openweather", URL, {})
+    assert session.calls == 1
+
+
+def test_breaker_opens_after_threshold_then_half_opens(upstream, monkeypatch):
+    breaker = CircuitBreaker("openweather", threshold=2, cooldown=0.05)
+    monkeypatch.setitem(fetch_engine.BREAKERS, "openweather", breaker)
+    session = upstream(StubResponse(503))
+
+    with pytest.raises(CircuitOpenError):
+        request_json("openweather", URL, {})
+    assert session.calls == 2
+    # Open: fails fast without a request.
+    with pytest.raises(CircuitOpenError):
+        request_json("openweather", URL, {})
+    assert session.calls == 2
+
+    # Half-open after the cooldown: one failure re-opens it at once.
+    time.sleep(0.06)
+    with pytest.raises(CircuitOpenError):
+        request_json("openweather", URL, {})
+    assert session.calls == 3
+
+    # A success after the next cooldown closes it.
+    time.sleep(0.06)
+    session.replies = [StubResponse(200, {"ok": 1})]
+    assert request_json("openweather", URL, {}) == {"ok": 1}
+    assert breaker.failures == 0 and breaker.allow()
+
+
+def test_deadline_stops_retries(upstream, monkeypatch):
+    monkeypatch.setattr(fetch_engine, "_deadline", Deadline(0.3))
+    monkeypatch.setattr(fetch_engine, "BACKOFF_BASE", 1.0)
+    session = upstream(StubResponse(503))
+    # The first backoff (0.5-1 s) would outlast the deadline, so no retry is made.
+    with pytest.raises(fetch_engine.RetryableHTTPError):
+        request_json("openweather", URL, {})
+    assert session.calls == 1
+
+
+def test_expired_deadline_makes_no_request(upstream, monkeypatch):
+    monkeypatch.setattr(fetch_engine, "_deadline", Deadline(0.001))
+    session = upstream(StubResponse(200, {"ok": 1}))
+    time.sleep(0.01)
+    with pytest.raises(DeadlineExceeded):
+        request_json("openweather", URL, {})
+    assert session.calls == 0
+
+
+def test_slow_request_is_hedged(upstream, monkeypatch):
+    monkeypatch.setattr(fetch_engine, "HEDGE_AFTER_SECONDS", 0.05)
+    session = upstream((0.5, StubResponse(200, {"from": "primary"})), StubResponse(200, {"from": "backup"}))
+    assert request_json("openweather", URL, {}) == {"from": "backup"}
+    assert session.calls == 2
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from forecast_output import load_manifest, write_station_outputs
+
+
+def _record(aqi, generated_at="2025-01-01T10:00:00+00:00"):
+    return {"current_aqi": aqi, "hourly_forecast": [], "forecast_generated_at_utc": generated_at}
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the output lock file lives under .cache/
+    return str(tmp_path / "forecasts")
+
+
+def test_unchanged_stations_are_not_rewritten(output_dir):
+    records = {"peenya": _record(80.0), "btm_layout": _record(95.0)}
+    assert write_station_outputs(records.items(), output_dir) == ["peenya", "btm_layout"]
+    stamps = {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns for name in os.listdir(output_dir)}
+
+    # Only the generation time differs, which the content hash ignores.
+    again = {"peenya": _record(80.0, "later"), "btm_layout": _record(95.0, "later")}
+    assert write_station_outputs(again.items(), output_dir) == []
+    assert stamps == {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns for name in os.listdir(output_dir)}
+
+    hashes = {sid: entry["hash"] for sid, entry in load_manifest(output_dir)["stations"].items()}
+    assert write_station_outputs({"peenya": _record(81.0)}.items(), output_dir) == ["peenya"]
+    entries = load_manifest(output_dir)["stations"]
+    assert entries["peenya"]["hash"] != hashes["peenya"]
+    assert entries["btm_layout"]["hash"] == hashes["btm_layout"]
+
+
+def test_stations_dropped_from_the_registry_are_pruned(output_dir):
+    records = {"peenya": _record(80.0), "retired": _record(95.0)}
+    write_station_outputs(records.items(), output_dir)
+
+    # A partial writer (stream, daemon refresh) leaves other stations alone.
+    write_station_outputs({"peenya": _record(82.0)}.items(), output_dir)
+    assert set(load_manifest(output_dir)["stations"]) == {"peenya", "retired"}
+
+    write_station_outputs({"peenya": _record(82.0)}.items(), output_dir, registry={"peenya": {}})
+    assert set(load_manifest(output_dir)["stations"]) == {"peenya"}
+    assert not os.path.exists(os.path.join(output_dir, "retired.json"))
+    assert os.path.exists(os.path.join(output_dir, "peenya.json"))
@@ -0,0 +1,40 @@
+import json
+import os
+
+from forecast_stream import StreamForecaster
+
+STATIONS = {
+    "peenya": {"lat": 13.03, "lon": 77.52},
+    "btm": {"lat": 12.91, "lon": 77.61},
+}
+
+
+def _write(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def test_checkpoint_keeps_stations_published_meanwhile(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write("all_forecasts.json", {"peenya": {"current_aqi": 90, "current_weather": {"temperature": 24.0}}})
+
+    forecaster = StreamForecaster(models={}, stations=STATIONS)
+    assert forecaster.weather["peenya"] == {"temperature": 24.0}
+
+    forecaster.unpublished = {"btm": {"current_aqi": 120}}
+    forecaster.dirty = True
+    # An hourly run publishes after the stream's last checkpoint.
+    _write("all_forecasts.json", {"peenya": {"current_aqi": 95}, "silk_board": {"current_aqi": 150}})
+    forecaster.checkpoint()
+
+    with open("all_forecasts.json") as f:
+        published = json.load(f)
+    assert published == {
+        "peenya": {"current_aqi": 95},
+        "silk_board": {"current_aqi": 150},
+        "btm": {"current_aqi": 120},
+    }
+    assert forecaster.unpublished == {}
+    # Verification goes to the stream's own directory, not the hourly runs'.
+    assert os.path.exists(os.path.join("verification", "stream", "state.json"))
+    assert not os.path.exists(os.path.join("verification", "state.json"))
@@ -0,0 +1,43 @@
+from forecast_verification import ForecastVerifier
+
+
+def _record(time, aqi, hourly=(), daily=()):
+    return {
+        "current_conditions_time": time,
+        "current_aqi": aqi,
+        "hourly_forecast": [{"time": t, "aqi": a} for t, a in hourly],
+        "daily_forecast": [{"date": d, "avg_aqi": a} for d, a in daily],
+    }
+
+
+def test_hourly_forecast_is_scored_at_its_target_hour_and_missed_targets_expire():
+    verifier = ForecastVerifier()
+    verifier.update({"peenya": _record(
+        "2025-01-01T10:00:00", 70.0,
+        hourly=[("2025-01-01T11:00:00", 100.0), ("2025-01-01T12:00:00", 90.0)],
+    )})
+
+    verifier.observe("peenya", "2025-01-01T11:00:00", 80.0)
+    assert verifier.stats == {"verified": 1, "expired": 0}
+    # No run observed 12:00, so that forecast can never be scored.
+    verifier.observe("peenya", "2025-01-01T13:00:00", 85.0)
+    assert verifier.stats == {"verified": 1, "expired": 1}
+
+    scores = verifier.export()["stations"]["peenya"]["hourly"]
+    assert list(scores) == ["1"]
+    assert scores["1"]["n"] == 1
+    assert scores["1"]["mae"] == 20.0
+    assert scores["1"]["bias"] == 20.0
+    assert verifier.pending["peenya"]["hourly"] == []
+
+
+def test_daily_forecast_is_scored_against_the_days_mean_once_the_day_ends():
+    verifier = ForecastVerifier()
+    verifier.update({"peenya": _record("2025-01-01T23:00:00", 70.0, daily=[("2025-01-02", 60.0)])})
+    for hour in range(24):
+        verifier.observe("peenya", f"2025-01-02T{hour:02d}:00:00", 50.0)
+    assert verifier.stats["verified"] == 0
+
+    verifier.observe("peenya", "2025-01-03T00:00:00", 50.0)
+    assert verifier.stats == {"verified": 1, "expired": 0}
+    assert verifier.export()["stations"]["peenya"]["daily"]["1"]["bias"] == 10.0
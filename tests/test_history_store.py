@@ -0,0 +1,22 @@
+import json
+import os
+from datetime import datetime
+
+from history_store import HistoryStore
+
+
+def test_export_keeps_local_wall_clock_times(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("peenya", datetime(2025, 1, 1, 10, 0), 120.0)
+    store.append("peenya", datetime(2025, 1, 1, 23, 0), 80.0)
+    store.export("peenya")
+
+    with open(os.path.join(tmp_path, "peenya", "hourly.json")) as f:
+        hourly = json.load(f)
+    with open(os.path.join(tmp_path, "peenya", "daily.json")) as f:
+        daily = json.load(f)
+    assert hourly == [
+        {"time": "2025-01-01T10:00:00", "aqi": 120.0},
+        {"time": "2025-01-01T23:00:00", "aqi": 80.0},
+    ]
+    assert daily == [{"date": "2025-01-01", "avg_aqi": 100.0, "max_aqi": 120.0}]
@@ -0,0 +1,40 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+import model_cache
+from model_cache import CompiledEnsemble, load_model
+
+joblib = pytest.importorskip("joblib")
+pytest.importorskip("lightgbm")
+
+from benchmarks.bench_tree_inference import check_parity  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("name", ["model_hourly", "model_daily"])
+def test_compiled_model_matches_pickled_predict(name, tmp_path, monkeypatch):
+    monkeypatch.setattr(model_cache, "MODEL_CACHE_DIR", str(tmp_path))
+    pkl_path = os.path.join(REPO_DIR, f"{name}.pkl")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        reference = joblib.load(pkl_path)
+        model = load_model(pkl_path)
+    assert isinstance(model, CompiledEnsemble)
+    check_parity(reference, model, np.random.default_rng(0), n=2000)
+
+
+def test_compiled_model_loads_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_cache, "MODEL_CACHE_DIR", str(tmp_path))
+    pkl_path = os.path.join(REPO_DIR, "model_hourly.pkl")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        first = load_model(pkl_path)
+    second = load_model(pkl_path)
+    assert model_cache.LOAD_STATS["model_hourly"]["source"] == "compiled cache"
+    assert second.version == first.version
+    X = np.zeros((3, first.meta["n_features"]))
+    np.testing.assert_array_equal(second.predict(X), first.predict(X))
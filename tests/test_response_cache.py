@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import fetch_engine
+import response_cache
+from response_cache import ResponseCache
+
+PARAMS = {"lat": 12.9, "lon": 77.6, "appid": "key"}
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Replaces only the module's own reference, not time.time for everything else.
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"))
+    yield cache
+    if cache.conn is not None:
+        cache.conn.close()
+
+
+def test_max_age_override_shortens_ttl_for_one_point(cache, clock):
+    hot = cache.make_key("openweather", 12.9, 77.6, PARAMS)
+    other = cache.make_key("openweather", 13.0, 77.5, PARAMS)
+    cache.put("openweather", hot, {"aqi": 1})
+    cache.put("openweather", other, {"aqi": 2})
+    cache.set_max_age("openweather", 12.9, 77.6, 450)
+
+    clock.now += 600
+    assert cache.get("openweather", hot) is None
+    assert cache.get("openweather", other) == {"aqi": 2}
+
+
+def test_entry_expires_after_provider_ttl(cache, clock):
+    key = cache.make_key("open_meteo", 12.9, 77.6, PARAMS)
+    cache.put("open_meteo", key, {"t": 24.0})
+
+    clock.now += response_cache.PROVIDER_TTLS["open_meteo"] - 1
+    assert cache.get("open_meteo", key) == {"t": 24.0}
+    clock.now += 2
+    assert cache.get("open_meteo", key) is None
+    assert cache.stats == {"hits": 1, "misses": 1, "stale": 0}
+
+
+def test_key_ignores_location_rounding_and_api_key(cache):
+    assert (cache.make_key("openweather", 12.90001, 77.6, PARAMS)
+            == cache.make_key("openweather", 12.9, 77.6, {**PARAMS, "appid": "other"}))
+    assert cache.make_key("openweather", 12.9, 77.6, PARAMS) != cache.make_key("open_meteo", 12.9, 77.6, PARAMS)
+
+
+@pytest.fixture
+def fetch(cache, monkeypatch):
+    """ fetch_json against the temp cache, with the upstream call replaced by `upstream.reply`. """
+    class Upstream:
+        reply = None
+        calls = 0
+
+        def request_json(self, provider, url, params):
+            self.calls += 1
+            if isinstance(self.reply, Exception):
+                raise self.reply
+            return self.reply
+
+    upstream = Upstream()
+    monkeypatch.setattr(fetch_engine, "CACHE", cache)
+    monkeypatch.setattr(fetch_engine, "request_json", upstream.request_json)
+    return upstream, lambda: fetch_engine.fetch_json("openweather", "https://upstream.test", PARAMS, 12.9, 77.6)
+
+
+def test_fresh_entry_is_served_without_upstream_call(fetch, clock):
+    upstream, fetch_json = fetch
+    upstream.reply = {"aqi": 1}
+    assert fetch_json() == {"aqi": 1}
+    upstream.reply = {"aqi": 2}
+    clock.now += 60
+    assert fetch_json() == {"aqi": 1}
+    assert upstream.calls == 1
+
+
+def test_expired_entry_is_served_stale_when_upstream_fails(fetch, cache, clock):
+    upstream, fetch_json = fetch
+    upstream.reply = {"aqi": 1}
+    fetch_json()
+
+    clock.now += response_cache.PROVIDER_TTLS["openweather"] + 1
+    upstream.reply = ConnectionError("upstream down")
+    assert fetch_json() == {"aqi": 1}
+    assert upstream.calls == 2
+    assert cache.stats["stale"] == 1
+
+
+def test_failure_is_raised_once_entry_is_too_old_to_serve(fetch, clock):
+    upstream, fetch_json = fetch
+    upstream.reply = {"aqi": 1}
+    fetch_json()
+
+    clock.now += response_cache.STALE_MAX_AGE + 1
+    upstream.reply = ConnectionError("upstream down")
+    with pytest.raises(ConnectionError):
+        fetch_json()
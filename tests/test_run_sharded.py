@@ -0,0 +1,45 @@
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+from forecast_output import load_manifest
+from run_sharded import merge_shards, partial_path, partial_state_dir, shard_of, _write_json
+from station_registry import load_stations
+from station_state import StationState
+
+STATION_IDS = [f"station_{i}" for i in range(1000)]
+
+
+def test_shard_assignment_is_stable_and_complete():
+    for count in (1, 3, 8):
+        shards = [shard_of(sid, count) for sid in STATION_IDS]
+        assert all(0 <= shard < count for shard in shards)
+        assert shards == [shard_of(sid, count) for sid in STATION_IDS]
+        # Hash partitioning keeps shards roughly even.
+        assert min(Counter(shards).values()) > len(STATION_IDS) / count * 0.8
+    # Pinned: SHA-1 based, so every process, machine and Python version agrees (unlike hash()).
+    ids = ("peenya", "btm_layout", "silk_board", "hebbal", "jayanagar")
+    assert [shard_of(sid, 4) for sid in ids] == [0, 0, 3, 3, 0]
+
+
+def test_merge_reproduces_the_full_station_set(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    registry = load_stations()
+    count = 3
+    for index in range(count):
+        ids = [sid for sid in registry if shard_of(sid, count) == index]
+        records = {sid: {"current_aqi": float(n), "forecast_generated_at_utc": "now"} for n, sid in enumerate(ids)}
+        _write_json(partial_path(index, count, "shards"), {"stations": records})
+        state = StationState()
+        for sid in ids:
+            state.update(sid, datetime(2025, 1, 1, 10), 100.0)
+        state.save(os.path.join(partial_state_dir(index, count, "shards"), "station_state.npz"))
+
+    merged = merge_shards(count, "shards", "forecasts")
+
+    assert list(merged) == list(registry)
+    with open("all_forecasts.json") as f:
+        assert list(json.load(f)) == list(registry)
+    assert set(load_manifest("forecasts")["stations"]) == set(registry)
+    assert set(StationState.load().index) == set(registry)
@@ -0,0 +1,22 @@
+from station_registry import plan_fetches
+
+STATIONS = {
+    "btm_layout": {"lat": 12.9135, "lon": 77.5950},
+    "jayanagar": {"lat": 12.9250, "lon": 77.5838},
+    "peenya": {"lat": 13.0339, "lon": 77.5133},
+}
+
+
+def test_default_plan_fetches_every_station_at_its_own_coordinates():
+    plan = plan_fetches(STATIONS)
+    assert len(plan) == len(STATIONS)
+    for sid, info in STATIONS.items():
+        assert plan[sid] == {"lat": info["lat"], "lon": info["lon"], "stations": [sid]}
+
+
+def test_shared_cell_is_requested_at_a_member_station():
+    plan = plan_fetches(STATIONS, cell_deg=0.1)
+    cells = sorted(plan.values(), key=lambda cell: len(cell["stations"]))
+    assert [cell["stations"] for cell in cells] == [["peenya"], ["btm_layout", "jayanagar"]]
+    shared = cells[1]
+    assert (shared["lat"], shared["lon"]) == (STATIONS["btm_layout"]["lat"], STATIONS["btm_layout"]["lon"])
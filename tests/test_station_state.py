@@ -0,0 +1,38 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+from station_state import StationState, to_epoch_hour
+
+
+@pytest.fixture
+def non_utc_tz(monkeypatch):
+    """ A host timezone with a half-hour offset, so local-time hour buckets differ from UTC ones. """
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset is not available on this platform")
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_naive_timestamps_are_read_as_utc(non_utc_tz):
+    hour = to_epoch_hour(datetime(2025, 1, 1, 10, 5))
+    assert to_epoch_hour(datetime(2025, 1, 1, 10, 40)) == hour
+    assert to_epoch_hour(pd.Timestamp("2025-01-01T10:05")) == hour
+    assert to_epoch_hour(datetime(2025, 1, 1, 10, 5, tzinfo=timezone.utc)) == hour
+    assert to_epoch_hour(datetime(2025, 1, 1, 15, 35, tzinfo=timezone(timedelta(hours=5, minutes=30)))) == hour
+
+
+def test_readings_within_an_hour_share_a_slot(non_utc_tz):
+    state = StationState()
+    state.update("peenya", datetime(2025, 1, 1, 10, 5), 100.0)
+    state.update("peenya", datetime(2025, 1, 2, 10, 5), 80.0)
+    state.update("peenya", pd.Timestamp("2025-01-02T10:40"), 50.0)
+
+    features = state.features("peenya", fallback=-1.0)
+    assert features["aqi_lag_24hr"] == 100.0
+    assert features["aqi_roll_avg_24hr"] == 50.0